@@ -0,0 +1,634 @@
+import logging
+import math
+import mmap
+import os
+import subprocess
+import sys
+import threading
+import time
+import warnings
+from array import array
+from collections import deque
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop  # C sample math for crossfades; removed in Python 3.13
+except ImportError:
+    audioop = None
+
+from ring_buffer import PCMRingBuffer
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # s16le
+FRAME_BYTES = CHANNELS * SAMPLE_WIDTH
+CHUNK_FRAMES = 4096
+CHUNK_BYTES = CHUNK_FRAMES * FRAME_BYTES
+BYTES_PER_SECOND = SAMPLE_RATE * FRAME_BYTES
+
+TRANSITION_MODES = ('gapless', 'crossfade')
+FADE_STEP_FRAMES = 64  # Crossfade gains change every 1.5 ms
+SINK_RETRY_SECONDS = 0.5   # First wait before reopening a sink that failed again...
+SINK_RETRY_MAX = 8         # ...doubling up to this
+SINK_RETRY_ATTEMPTS = 6    # Consecutive failures before the engine gives up and stops
+
+CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+
+class CommandSink:
+    """Output to a process that reads raw PCM (s16le, SAMPLE_RATE, stereo) on stdin"""
+    def __init__(self, command, registry=None, role='sink'):
+        self.command = list(command)
+        self.registry = registry
+        self.role = role
+        self.stdout = None  # Subclasses that read the process's output set this to PIPE
+        self.process = None
+
+    def open(self):
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=self.stdout,
+            creationflags=CREATE_NO_WINDOW
+        )
+        if self.registry:
+            self.registry.register(self.role, self.process.pid)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        if not self.process:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        if self.registry:
+            self.registry.unregister(self.process.pid)
+        self.process = None
+
+
+class FFplaySink(CommandSink):
+    """Persistent output: one ffplay process fed raw PCM over stdin"""
+    def __init__(self, ffplay_path='ffplay', registry=None):
+        super().__init__([
+            ffplay_path,
+            '-f', 's16le',
+            '-ar', str(SAMPLE_RATE),
+            '-ch_layout', 'stereo',
+            '-nodisp',
+            '-loglevel', 'quiet',
+            '-'
+        ], registry, role='ffplay')
+
+
+class TrackDecoder:
+    """Decode a single file to raw PCM in the engine's output format.
+
+    A non-zero gain_db is applied as a fixed volume, which costs next to
+    nothing compared to a live loudnorm filter.
+    """
+    def __init__(self, path, ffmpeg_path='ffmpeg', gain_db=0.0, source=None, input_args=()):
+        self.path = path
+        gain = ['-af', f'volume={gain_db:.2f}dB'] if abs(gain_db) >= 0.01 else []
+        self.process = subprocess.Popen(
+            [
+                ffmpeg_path,
+                '-hide_banner',
+                '-loglevel', 'error',
+                '-nostdin',
+                *input_args,
+                '-i', source or path,
+                '-vn',
+                *gain,
+                '-ac', str(CHANNELS),
+                '-ar', str(SAMPLE_RATE),
+                '-f', 's16le',
+                '-'
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            creationflags=CREATE_NO_WINDOW
+        )
+
+    def read(self, size=CHUNK_BYTES):
+        """Read up to size bytes of PCM; b'' means the track has ended"""
+        return self.process.stdout.read(size)
+
+    def abort(self):
+        if self.process.poll() is None:
+            self.process.kill()
+
+    def close(self):
+        self.abort()
+        self.process.stdout.close()
+        self.process.wait()
+
+
+class PrefetchedTrack:
+    """A track decoding ahead of playback into a bounded buffer.
+
+    A background thread keeps up to max_bytes of PCM ready, so the engine can
+    open the next entry before the current one ends and switch without a gap.
+    """
+    def __init__(self, path, ffmpeg_path='ffmpeg', max_bytes=10 * BYTES_PER_SECOND, gain_db=0.0,
+                 source=None, input_args=()):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.chunks = deque()
+        self.buffered = 0
+        self.consumed = 0  # Bytes handed to the engine so far
+        self.eof = False
+        self.cond = threading.Condition()
+        self.decoder = TrackDecoder(path, ffmpeg_path, gain_db, source, input_args)
+        self.thread = threading.Thread(target=self._fill, daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while True:
+                chunk = self.decoder.read()
+                with self.cond:
+                    while chunk and self.buffered >= self.max_bytes and not self.eof:
+                        self.cond.wait()
+                    if not chunk or self.eof:
+                        break
+                    self.chunks.append(chunk)
+                    self.buffered += len(chunk)
+                    self.cond.notify_all()
+        except (OSError, ValueError):
+            pass
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+
+    def read(self):
+        """Return the next chunk of PCM, blocking until decoded; b'' at the end"""
+        with self.cond:
+            while not self.chunks and not self.eof:
+                self.cond.wait()
+            if not self.chunks:
+                return b''
+            chunk = self.chunks.popleft()
+            self.buffered -= len(chunk)
+            self.consumed += len(chunk)
+            self.cond.notify_all()
+            return chunk
+
+    def unread(self, data):
+        """Push PCM back to the front of the buffer"""
+        if data:
+            with self.cond:
+                self.chunks.appendleft(data)
+                self.buffered += len(data)
+                self.consumed -= len(data)
+
+    def abort(self):
+        """Stop decoding and drop anything buffered"""
+        with self.cond:
+            self.eof = True
+            self.chunks.clear()
+            self.buffered = 0
+            self.cond.notify_all()
+        self.decoder.abort()
+
+    def close(self):
+        self.abort()
+        self.thread.join(timeout=2)
+        self.decoder.close()
+
+
+class MappedPCMTrack:
+    """A raw PCM file in the engine's format, played straight from a memory map.
+
+    No decoder process and no copies: read() returns memoryview slices of the
+    mapping. Pages already played are dropped from the mapping as it goes, so
+    resident memory stays flat however long the track is.
+    """
+    RELEASE_BYTES = 4 * 1024 * 1024   # Drop played pages in steps of this size...
+    REWIND_BYTES = 1024 * 1024        # ...keeping this much behind for unread()
+
+    def __init__(self, path, source, chunk_bytes=CHUNK_BYTES):
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.file = open(source, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size // FRAME_BYTES * FRAME_BYTES
+        self.map = None
+        self.view = memoryview(b'')
+        if self.size:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            if hasattr(self.map, 'madvise'):
+                self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.consumed = 0
+        self.released = 0
+        self.aborted = False
+
+    def read(self):
+        """Return a view of the next chunk of PCM; b'' at the end"""
+        if self.aborted or self.consumed >= self.size:
+            return b''
+        end = min(self.consumed + self.chunk_bytes, self.size)
+        chunk = self.view[self.consumed:end]
+        self.consumed = end
+        self._release_played()
+        return chunk
+
+    def unread(self, data):
+        """Give back the end of what was last read (the mapping still holds it)"""
+        self.consumed -= len(data)
+
+    def _release_played(self):
+        if not hasattr(self.map, 'madvise'):
+            return
+        limit = (self.consumed - self.REWIND_BYTES) // mmap.PAGESIZE * mmap.PAGESIZE
+        if limit - self.released >= self.RELEASE_BYTES:
+            self.map.madvise(mmap.MADV_DONTNEED, self.released, limit - self.released)
+            self.released = limit
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        self.abort()
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # A chunk is still referenced; the mapping goes with it
+        self.file.close()
+
+
+def equal_power_mix(outgoing, incoming, offset, total):
+    """Mix two equal-length s16le buffers along an equal-power crossfade.
+
+    offset is the frame position of these buffers within a fade of total frames.
+    The gains step every FADE_STEP_FRAMES frames, so each step is mixed as one
+    block instead of sample by sample.
+    """
+    step = FADE_STEP_FRAMES * FRAME_BYTES
+    blocks = []
+    for start in range(0, len(outgoing), step):
+        t = (offset + start // FRAME_BYTES) / total * (math.pi / 2)
+        blocks.append(_mix_block(outgoing[start:start + step], incoming[start:start + step],
+                                 math.cos(t), math.sin(t)))
+    return b''.join(blocks)
+
+
+def _mix_block(outgoing, incoming, fade_out, fade_in):
+    if audioop:
+        return audioop.add(audioop.mul(outgoing, SAMPLE_WIDTH, fade_out),
+                           audioop.mul(incoming, SAMPLE_WIDTH, fade_in), SAMPLE_WIDTH)
+    a = array('h')
+    a.frombytes(outgoing)
+    b = array('h')
+    b.frombytes(incoming)
+    return array('h', [max(-32768, min(32767, int(x * fade_out + y * fade_in)))
+                       for x, y in zip(a, b)]).tobytes()
+
+
+class StreamingEngine:
+    """Long-lived playback loop writing every track into one persistent sink.
+
+    Changing tracks only swaps the decoder feeding the sink; the output process
+    keeps running, so there is no teardown/respawn between songs. The next
+    entry starts decoding lookahead_seconds before the current one ends, and
+    the two are joined either back-to-back (gapless) or with an equal-power
+    crossfade. Decoded PCM goes through a fixed-size ring buffer that a
+    separate output thread drains into the sink.
+    """
+    def __init__(self, next_track, sink, ffmpeg_path='ffmpeg',
+                 on_track_start=None, on_progress=None, duration_of=None, gain_of=None,
+                 transition='gapless', crossfade_seconds=4.0, lookahead_seconds=10.0,
+                 buffer_ms=2000, start_ms=500, cache=None):
+        self.logger = logging.getLogger('StreamingEngine')
+        if transition not in TRANSITION_MODES:
+            raise ValueError(f"Unknown transition mode: {transition}")
+        self.next_track = next_track
+        self.sink = sink
+        self.ffmpeg_path = ffmpeg_path
+        self.on_track_start = on_track_start
+        self.on_progress = on_progress
+        self.duration_of = duration_of
+        self.gain_of = gain_of
+        self.cache = cache
+        self.transition = transition
+        self.crossfade_bytes = self._frame_align(crossfade_seconds * BYTES_PER_SECOND)
+        self.lookahead_bytes = max(self._frame_align(lookahead_seconds * BYTES_PER_SECOND),
+                                   self.crossfade_bytes + CHUNK_BYTES)
+        self.buffer = PCMRingBuffer(self._frame_align(buffer_ms / 1000 * BYTES_PER_SECOND))
+        self.start_bytes = min(self._frame_align(start_ms / 1000 * BYTES_PER_SECOND),
+                               self.buffer.capacity)
+        self.running = False
+        self.stopping = threading.Event()
+        self.playing = threading.Event()
+        self.playing.set()
+        self.current = None
+        self.thread = None
+        self.output_thread = None
+        self.last_gap = 0.0  # Seconds between the end of one track and audio from the next
+        self.boundaries = deque()  # (buffer offset, path) of track starts the output has not reached
+
+    @staticmethod
+    def _frame_align(size):
+        return int(size) // FRAME_BYTES * FRAME_BYTES
+
+    def start(self):
+        self.running = True
+        self.sink.open()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.output_thread = threading.Thread(target=self._output_loop, daemon=True)
+        self.output_thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopping.set()
+        self.playing.set()
+        self.skip()
+        self.buffer.close()
+        if self.thread:
+            self.thread.join(timeout=5)
+        if self.output_thread:
+            self.output_thread.join(timeout=5)
+        self.sink.close()
+
+    def skip(self):
+        """Abandon the current track; the loop moves straight on to the next one"""
+        current = self.current
+        if current:
+            current.abort()
+
+    def pause(self):
+        self.playing.clear()
+
+    def resume(self):
+        self.playing.set()
+
+    def is_alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _open_next(self):
+        """Start decoding the next playlist entry, or return None when there is none"""
+        while self.running:
+            path = self.next_track()
+            if not path:
+                self.logger.error("Playlist returned no track, stopping engine")
+                return None
+            try:
+                gain_db = self.gain_of(path) if self.gain_of else 0.0
+                cached = self.cache.lookup(path, gain_db) if self.cache else None
+                if cached and self.cache.format == 'pcm':
+                    return MappedPCMTrack(path, cached)
+                if cached:
+                    # The gain is already baked into the cached copy
+                    return PrefetchedTrack(path, self.ffmpeg_path, self.lookahead_bytes,
+                                           source=cached, input_args=self.cache.input_args)
+                return PrefetchedTrack(path, self.ffmpeg_path, self.lookahead_bytes, gain_db)
+            except OSError as e:
+                self.logger.error(f"Could not start decoder for {path}: {e}")
+                time.sleep(1)
+        return None
+
+    def _run(self):
+        track = None
+        announced = False
+        track_ended = None
+        while self.running:
+            if track is None:
+                track = self._open_next()
+                announced = False
+                if track is None:
+                    break
+            self.current = track
+            try:
+                upcoming, started = self._play(track, announced, track_ended)
+            finally:
+                track.close()
+                self.current = None
+            track_ended = time.perf_counter()
+            if not started:
+                self.logger.warning(f"No audio decoded from {track.path}, skipping")
+            track, announced = upcoming if upcoming else (None, False)
+
+        if track is not None:
+            track.close()
+
+    def _play(self, track, announced, track_ended):
+        """Play one track, returning ((next_track, announced), started)"""
+        expected = None
+        if self.duration_of:
+            duration = self.duration_of(track.path) or 0
+            expected = int(duration * BYTES_PER_SECOND) or None
+
+        upcoming = None
+        lookahead_started = False
+        tail = deque()  # Held-back PCM for the crossfade
+        tail_bytes = 0
+        started = announced
+        while self.running:
+            self.playing.wait()
+            chunk = track.read()
+            if not chunk:
+                break
+            if not started:
+                started = True
+                self._track_started(track.path, track_ended)
+
+            if not lookahead_started and expected and expected - track.consumed <= self.lookahead_bytes:
+                lookahead_started = True
+                upcoming = self._open_next()
+
+            if upcoming is not None and self.transition == 'crossfade':
+                # Hold back the last crossfade_bytes so they can be mixed with the next head
+                tail.append(chunk)
+                tail_bytes += len(chunk)
+                while tail and tail_bytes - len(tail[0]) >= self.crossfade_bytes:
+                    tail_bytes -= len(tail[0])
+                    self._write(tail.popleft())
+            else:
+                self._write(chunk)
+
+        if not self.running:
+            if upcoming is not None:
+                upcoming.close()
+            return None, started
+
+        if upcoming is None:
+            if lookahead_started:
+                # The playlist ran dry during the lookahead
+                self.running = False
+            # Otherwise the duration was unknown or overestimated: open the next entry now
+            return None, started
+
+        if tail and self.crossfade_bytes:
+            # Trim the tail to whole crossfade length and mix it into the next head
+            while tail_bytes > self.crossfade_bytes:
+                excess = tail_bytes - self.crossfade_bytes
+                head = tail[0]
+                if len(head) <= excess:
+                    self._write(tail.popleft())
+                    tail_bytes -= len(head)
+                else:
+                    self._write(head[:excess])
+                    tail[0] = head[excess:]
+                    tail_bytes -= excess
+            self._track_started(upcoming.path, None)
+            self._crossfade(tail, tail_bytes, upcoming)
+            return (upcoming, True), started
+
+        return (upcoming, False), started
+
+    def _crossfade(self, tail, tail_bytes, upcoming):
+        """Write the held-back tail mixed with the start of the upcoming track"""
+        total_frames = tail_bytes // FRAME_BYTES
+        offset = 0
+        for outgoing in tail:
+            incoming = b''
+            while len(incoming) < len(outgoing):
+                chunk = upcoming.read()
+                if not chunk:
+                    break
+                incoming += chunk
+            upcoming.unread(incoming[len(outgoing):])
+            incoming = incoming[:len(outgoing)].ljust(len(outgoing), b'\0')
+            self._write(equal_power_mix(outgoing, incoming, offset, total_frames))
+            offset += len(outgoing) // FRAME_BYTES
+
+    def _track_started(self, path, track_ended):
+        """Mark where the track begins in the buffer; it is announced once the output gets there"""
+        if track_ended is not None:
+            self.last_gap = time.perf_counter() - track_ended
+            self.logger.debug(f"Track gap: {self.last_gap * 1000:.1f} ms")
+        self.boundaries.append((self.buffer.write_pos, path))
+
+    def _announce_reached(self, end):
+        """Call on_track_start for every track whose first byte is before buffer offset end"""
+        while self.boundaries and self.boundaries[0][0] < end:
+            _, path = self.boundaries.popleft()
+            if self.on_track_start:
+                try:
+                    self.on_track_start(path)
+                except Exception as e:
+                    self.logger.error(f"Track start handler failed for {path}: {e}")
+
+    def _write(self, chunk):
+        """Queue decoded PCM for the output thread"""
+        self.buffer.write(chunk)
+        if self.on_progress:
+            self.on_progress()
+
+    def _output_loop(self):
+        """Drain the ring buffer into the sink, refilling to start_bytes after an underrun"""
+        primed = False
+        failures = 0  # Consecutive sink failures
+        while not self.buffer.closed:
+            if not primed:
+                # Start (or restart) once the buffer reaches its start level, or
+                # straight away if the decoding side has finished
+                ready = self.buffer.wait_for_data(self.start_bytes, 0.1)
+                if not ready and (self.is_alive() or not self.buffer.fill()):
+                    continue
+                primed = True
+
+            view = self.buffer.peek(CHUNK_BYTES)
+            if view is None:
+                if self.playing.is_set() and self.is_alive():
+                    self.buffer.record_underrun()
+                    self.logger.warning(f"Audio buffer underrun #{self.buffer.underruns}")
+                primed = False
+                continue
+
+            size = len(view)
+            self._announce_reached(self.buffer.read_pos + size)
+            try:
+                self.sink.write(view)
+            except (BrokenPipeError, OSError, ValueError) as e:
+                if self.buffer.closed:
+                    break
+                failures = self._reopen_sink(e, failures + 1)
+                if failures is None:
+                    break
+                continue
+            finally:
+                view.release()
+            failures = 0
+            self.buffer.consume(size)
+
+    def _reopen_sink(self, error, failures):
+        """Reopen the sink after its failures-th failure in a row, waiting longer each time.
+
+        The first reopen is immediate. Returns the failure count once the sink
+        is open again, or None after SINK_RETRY_ATTEMPTS failures, when the
+        engine stops so the supervisor restarts it with a fresh sink.
+        """
+        while failures <= SINK_RETRY_ATTEMPTS:
+            delay = 0 if failures == 1 else min(SINK_RETRY_SECONDS * 2 ** (failures - 2), SINK_RETRY_MAX)
+            self.logger.warning(f"Audio sink failed ({error}), reopening output in {delay:g}s")
+            if self.stopping.wait(delay):
+                return None
+            try:
+                self.sink.close()
+                self.sink.open()
+                return failures
+            except (OSError, ValueError) as e:
+                error = e
+                failures += 1
+        self.logger.error(f"Audio sink failed {SINK_RETRY_ATTEMPTS} times in a row ({error}), stopping engine")
+        self.running = False
+        self.skip()
+        self.buffer.close()
+        return None
+
+def _measure(mode, pcm_file, ffmpeg_path):
+    """Play one PCM file into /dev/null through one source; prints a result line"""
+    import resource
+    track = (MappedPCMTrack(pcm_file, pcm_file) if mode == 'mmap' else
+             PrefetchedTrack(pcm_file, ffmpeg_path, source=pcm_file,
+                             input_args=['-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS)]))
+    start = time.perf_counter()
+    total = 0
+    with open(os.devnull, 'wb') as sink:
+        while True:
+            chunk = track.read()
+            if not chunk:
+                break
+            sink.write(chunk)
+            total += len(chunk)
+    elapsed = time.perf_counter() - start
+    track.close()
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    print(f"{mode:>7}: {total / BYTES_PER_SECOND:7.0f}s of audio in {elapsed:.2f}s, "
+          f"CPU {cpu:.2f}s, peak RSS {own.ru_maxrss // 1024} MB "
+          f"(decoder {children.ru_maxrss // 1024} MB)")
+
+
+def _benchmark(pcm_file, ffmpeg_path):
+    """Compare a cached PCM file read through ffmpeg with the mmap path, one process each"""
+    size = os.path.getsize(pcm_file)
+    print(f"{pcm_file}: {size / 1024 ** 2:.0f} MB, {size / BYTES_PER_SECOND / 60:.1f} min")
+    for mode in ('ffmpeg', 'mmap'):
+        subprocess.run([sys.executable, __file__, '--measure', mode, pcm_file, ffmpeg_path])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 4 and sys.argv[1] == '--measure':
+        _measure(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif len(sys.argv) > 1:
+        _benchmark(sys.argv[1], os.environ.get('FFMPEG', 'ffmpeg'))
+    else:
+        print("Usage: python audio_engine.py <raw s16le 44.1 kHz stereo file>")
+        sys.exit(1)
@@ -0,0 +1,411 @@
+"""Benchmarks and a soak test that run on Linux, against the stand-in tools in fake_tools.py.
+
+    python benchmark.py [scan] [playlist] [latency] [soak] [--sizes 1000,10000,100000]
+                        [--soak-hours 24] [--soak-seconds 120] [--engine pipe|stream] [--keep]
+
+scan      library index: cold scan, rescan with nothing changed, rescan after one new file
+playlist  shuffle and first/next window of Playlist.m3u, plain and smart shuffle
+latency   runs virtual_dj.py: song-change detection latency (fake ffmpeg writing
+          "Opening '...'" to the DJ printing "Now Playing"), and recovery time
+          after ffmpeg, ffplay and OBS are made to crash
+soak      runs virtual_dj.py through --soak-hours of simulated playback in
+          --soak-seconds and reports the DJ's memory over time
+
+With no section named, all four run. Everything happens in a temporary
+folder (kept with --keep), so the real library, config.json and pidfile
+are never touched.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+import fake_tools
+from library_index import LibraryIndex
+from playlist_source import PlaylistSource
+from smart_shuffle import smart_shuffle
+
+SECTIONS = ('scan', 'playlist', 'latency', 'soak')
+SIZES = (1000, 10000, 100000)
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 4
+PLAYLIST_WINDOW = 50
+DJ_LIBRARY_SIZE = 500      # Library the DJ plays from in the latency and soak runs
+LATENCY_SECONDS = 90
+LATENCY_SPEED = 60         # Songs of 2.5-5.5 minutes then last 2.5-5.5 seconds
+CRASH_EVERY = 15           # Seconds between two forced crashes in the latency run
+CRASH_TARGETS = ('ffmpeg', 'ffplay', 'obs')
+SOAK_HOURS = 24
+SOAK_SECONDS = 120
+SAMPLE_SECONDS = 1.0
+STOP_TIMEOUT = 20
+DJ_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "virtual_dj.py")
+NOW_PLAYING = re.compile(r"Now Playing: .* - (.*) \(\d+:\d\d\)")
+STARTUP = re.compile(r"(Startup \d+\.\d+s: .*); first song playing")
+
+
+def make_library(root, count, seed=1):
+    """count fake songs under root as Artist/Album/NN - Track.mp3, each naming its duration"""
+    marker = os.path.join(root, '.complete')
+    if os.path.exists(marker):
+        return root
+    rng = random.Random(seed)
+    per_artist = TRACKS_PER_ALBUM * ALBUMS_PER_ARTIST
+    for i in range(count):
+        artist, rest = divmod(i, per_artist)
+        album, track = divmod(rest, TRACKS_PER_ALBUM)
+        folder = os.path.join(root, f"Artist {artist:05d}", f"Album {album:02d}")
+        if track == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"{track + 1:02d} - Track {i:06d}.mp3"), 'w') as f:
+            f.write(f"duration={rng.uniform(150, 330):.2f}\n")
+    open(marker, 'w').close()
+    return root
+
+
+def title_of(path):
+    """The title the DJ shows for a path (see CurrentSong.update)"""
+    title = os.path.splitext(os.path.basename(path))[0]
+    return title.split(" - ", 1)[1] if " - " in title else title
+
+
+def percentiles(values, scale=1000):
+    """'median / p95 / max' of values, in ms by default"""
+    if not values:
+        return "n/a"
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (f"median {statistics.median(ordered) * scale:.1f}, p95 {p95 * scale:.1f}, "
+            f"max {ordered[-1] * scale:.1f}")
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+# --- in-process benchmarks ---------------------------------------------------------------
+
+def bench_scan(workdir, sizes):
+    print("\n=== Library scan ===")
+    for count in sizes:
+        library = make_library(os.path.join(workdir, 'libraries', str(count)), count)
+        db = os.path.join(workdir, f'scan-{count}.db')
+        if os.path.exists(db):
+            os.remove(db)
+        index = LibraryIndex(db)
+        cold, stats = timed(index.scan, [library])
+        warm, _ = timed(index.scan, [library])
+        extra = os.path.join(library, "Artist 00000", "Album 00", "99 - Benchmark.mp3")
+        with open(extra, 'w') as f:
+            f.write("duration=200\n")
+        one_new, _ = timed(index.scan, [library])
+        os.remove(extra)
+        listing, tracks = timed(index.tracks, [library])
+        index.close()
+        print(f"{count:>7} tracks: cold {cold:7.2f}s ({stats['added']} added), "
+              f"unchanged {warm * 1000:7.1f} ms, one new file {one_new * 1000:7.1f} ms, "
+              f"track list {listing * 1000:7.1f} ms")
+
+
+def bench_playlist(workdir, sizes):
+    print(f"\n=== Playlist generation (window of {PLAYLIST_WINDOW}) ===")
+    for count in sizes:
+        library = make_library(os.path.join(workdir, 'libraries', str(count)), count)
+        index = LibraryIndex(os.path.join(workdir, f'playlist-{count}.db'))
+        index.scan([library])
+        tracks = index.tracks([library])
+        index.close()
+        for mode, order in (('random', None), ('smart', smart_shuffle)):
+            state = os.path.join(workdir, f'playlist-{count}-{mode}.json')
+            if os.path.exists(state):
+                os.remove(state)
+            source = PlaylistSource(state, order=order)
+            first, _ = timed(write_window, source, tracks, os.path.join(workdir, 'Playlist.m3u'))
+            source.index += PLAYLIST_WINDOW
+            following, _ = timed(write_window, source, tracks, os.path.join(workdir, 'Playlist.m3u'))
+            print(f"{count:>7} tracks, {mode:>6}: first window {first * 1000:8.1f} ms, "
+                  f"next window {following * 1000:6.1f} ms")
+
+
+def write_window(source, tracks, playlist_file):
+    """What VirtualDJ._generate_playlist does with a fresh track list"""
+    source.set_tracks(tracks)
+    with open(playlist_file, 'w', encoding='utf-8') as f:
+        for song in source.peek(PLAYLIST_WINDOW):
+            escaped_path = song.replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+
+
+# --- virtual_dj.py against the fake tools ------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class DJRun:
+    """virtual_dj.py in its own folder with the fake tools, its output and memory recorded"""
+    def __init__(self, workdir, name, library, speed, engine='pipe'):
+        self.dir = os.path.join(workdir, name)
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        tools = fake_tools.install(os.path.join(workdir, 'bin'))
+        self.obs_port = free_port()
+        config = {
+            'audio_sources': [library],
+            'ffmpeg_path': tools['ffmpeg'],
+            'obs_path': tools['obs'],
+            'audio_engine': engine,
+            'startup': {'obs_websocket_port': self.obs_port, 'obs_ready_timeout': 5},
+            'status_outputs': {'json': 'now_playing.json'},
+        }
+        with open(os.path.join(self.dir, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=4)
+        open(os.path.join(self.dir, 'Playlist.m3u'), 'w').close()
+        self.env = dict(os.environ, FAKE_TOOLS_DIR=self.dir, FAKE_SPEED=str(speed),
+                        FAKE_OBS_PORT=str(self.obs_port))
+        self.speed = speed
+        self.process = None
+        self.lines = []        # (time, line) for every line the DJ printed
+        self.memory = []       # (seconds since start, DJ RSS in bytes)
+        self.started = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.started = time.time()
+        self.process = subprocess.Popen([sys.executable, '-u', DJ_SCRIPT], cwd=self.dir, env=self.env,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        text=True, errors='replace')
+        threading.Thread(target=self._read_output, daemon=True).start()
+        threading.Thread(target=self._sample_memory, daemon=True).start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self.lines.append((time.time(), line.rstrip('\n').split('\r')[-1]))
+
+    def _sample_memory(self):
+        try:
+            process = psutil.Process(self.process.pid)
+            while not self.stopped.wait(SAMPLE_SECONDS):
+                self.memory.append((time.time() - self.started, process.memory_info().rss))
+        except psutil.Error:
+            pass
+
+    def wait_for_first_song(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if any(NOW_PLAYING.search(line) for _, line in self.lines):
+                return True
+            if self.process.poll() is not None:
+                break
+            time.sleep(0.1)
+        print("[X] The DJ never started playing; its last output:")
+        for _, line in self.lines[-30:]:
+            print(f"    {line}")
+        return False
+
+    def crash(self, tool):
+        open(os.path.join(self.dir, f'crash-{tool}'), 'w').close()
+
+    def stop(self):
+        """SIGINT, as Ctrl+C would; anything still running afterwards is killed"""
+        try:
+            children = psutil.Process(self.process.pid).children(recursive=True)
+        except psutil.Error:
+            children = []
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"[X] The DJ did not stop within {STOP_TIMEOUT}s, killing it")
+            self.process.kill()
+            self.process.wait()
+        self.stopped.set()
+        with open(os.path.join(self.dir, 'output.log'), 'w', encoding='utf-8') as f:
+            f.writelines(f"{when:.6f} {line}\n" for when, line in self.lines)
+        if self.process.returncode not in (0, -signal.SIGINT):
+            print(f"[X] The DJ exited with code {self.process.returncode}, see output.log")
+        leftovers = [child for child in children if child.is_running()]
+        for child in leftovers:
+            child.kill()
+        if leftovers:
+            print(f"[X] {len(leftovers)} child processes outlived the DJ")
+
+    def events(self):
+        """[(time, tool, event, detail)] written by the fake tools"""
+        found = []
+        try:
+            with open(os.path.join(self.dir, 'events.log'), encoding='utf-8') as f:
+                for line in f:
+                    when, tool, _, event, detail = line.rstrip('\n').split('\t', 4)
+                    found.append((float(when), tool, event, detail))
+        except OSError:
+            pass
+        return sorted(found)
+
+    def songs(self):
+        """[(time, title)] of every song change the DJ reported"""
+        found = []
+        for when, line in self.lines:
+            match = NOW_PLAYING.search(line)
+            if match:
+                found.append((when, match.group(1)))
+        return found
+
+    def startup_summary(self):
+        for _, line in self.lines:
+            match = STARTUP.search(line)
+            if match:
+                return match.group(1)
+        return None
+
+
+def detection_latency(run):
+    """Seconds from the fake ffmpeg announcing a file to the DJ reporting it, per song change"""
+    opened = {}
+    for when, tool, event, detail in run.events():
+        if tool == 'ffmpeg' and event == 'open':
+            opened.setdefault(title_of(detail), []).append(when)
+    latencies = []
+    unmatched = 0
+    for when, title in run.songs():
+        earlier = [t for t in opened.get(title, []) if t <= when]
+        if earlier:
+            latencies.append(when - earlier[-1])
+        else:
+            unmatched += 1
+    return latencies, unmatched
+
+
+def recovery_times(run):
+    """Per crashed tool: seconds until it was running again, and (for the audio
+    pipeline) until the DJ reported a song again"""
+    events = run.events()
+    songs = run.songs()
+    restart = {}
+    audio = []
+    for when, tool, event, _ in events:
+        if event != 'crash':
+            continue
+        again = next((t for t, other, e, _ in events if other == tool and e == 'start' and t > when), None)
+        if again is not None:
+            restart.setdefault(tool, []).append(again - when)
+        if tool in ('ffmpeg', 'ffplay'):
+            song = next((t for t, _ in songs if t > when), None)
+            if song is not None:
+                audio.append(song - when)
+    return restart, audio
+
+
+def bench_latency(workdir, engine):
+    print(f"\n=== Song changes and crash recovery ({engine} engine, {LATENCY_SECONDS}s "
+          f"at {LATENCY_SPEED}x) ===")
+    library = make_library(os.path.join(workdir, 'libraries', str(DJ_LIBRARY_SIZE)), DJ_LIBRARY_SIZE)
+    run = DJRun(workdir, 'dj-latency', library, LATENCY_SPEED, engine)
+    run.start()
+    if not run.wait_for_first_song():
+        run.stop()
+        return
+    print(run.startup_summary() or "Startup: no summary printed")
+    end = time.time() + LATENCY_SECONDS
+    crashes = 0
+    while time.time() < end:
+        time.sleep(min(CRASH_EVERY, max(0.0, end - time.time())))
+        if time.time() < end - 5:  # Leave time to recover before stopping
+            run.crash(CRASH_TARGETS[crashes % len(CRASH_TARGETS)])
+            crashes += 1
+    run.stop()
+
+    songs = run.songs()
+    print(f"{len(songs)} song changes, {crashes} crashes forced")
+    if engine == 'pipe':
+        latencies, unmatched = detection_latency(run)
+        print(f"Song-change detection latency (ms): {percentiles(latencies)}"
+              + (f" ({unmatched} unmatched)" if unmatched else ""))
+    restart, audio = recovery_times(run)
+    for tool in CRASH_TARGETS:
+        if tool in restart:
+            print(f"{tool:>6} crash -> restarted (ms): {percentiles(restart[tool])}")
+    print(f"Audio crash -> next song reported (ms): {percentiles(audio)}")
+
+
+def bench_soak(workdir, engine, hours, seconds):
+    speed = hours * 3600 / seconds
+    print(f"\n=== Soak: {hours:g}h simulated in {seconds:g}s ({speed:g}x, {engine} engine) ===")
+    library = make_library(os.path.join(workdir, 'libraries', str(DJ_LIBRARY_SIZE)), DJ_LIBRARY_SIZE)
+    run = DJRun(workdir, 'dj-soak', library, speed, engine)
+    run.start()
+    if not run.wait_for_first_song():
+        run.stop()
+        return
+    time.sleep(seconds)
+    run.stop()
+
+    songs = run.songs()
+    restarts = sum(1 for _, tool, event, _ in run.events() if tool == 'ffmpeg' and event == 'start')
+    print(f"{len(songs)} song changes, {restarts} ffmpeg processes started")
+    # The first tenth is warm-up: caches filling, the library being probed
+    samples = [(t, rss) for t, rss in run.memory if t >= seconds / 10]
+    if len(samples) < 2:
+        print("Not enough memory samples")
+        return
+    first, last = samples[0], samples[-1]
+    peak = max(rss for _, rss in samples)
+    growth = last[1] - first[1]
+    simulated = (last[0] - first[0]) * speed / 3600
+    print(f"DJ memory: {first[1] / 2 ** 20:.1f} MB after warm-up, {last[1] / 2 ** 20:.1f} MB at the end, "
+          f"peak {peak / 2 ** 20:.1f} MB")
+    print(f"Growth: {growth / 2 ** 20:+.2f} MB over {simulated:.1f} simulated hours "
+          f"({growth / 2 ** 10 / max(simulated, 1e-9):+.1f} KB per hour)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks and a soak test against fake tools")
+    parser.add_argument('sections', nargs='*', help="scan, playlist, latency, soak (default: all)")
+    parser.add_argument('--sizes', default=",".join(str(s) for s in SIZES))
+    parser.add_argument('--soak-hours', type=float, default=SOAK_HOURS)
+    parser.add_argument('--soak-seconds', type=float, default=SOAK_SECONDS)
+    parser.add_argument('--engine', choices=['pipe', 'stream'], default='pipe')
+    parser.add_argument('--keep', action='store_true', help="keep the temporary folder")
+    args = parser.parse_args()
+    sections = args.sections or list(SECTIONS)
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f"unknown section(s): {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    workdir = tempfile.mkdtemp(prefix='virtual-dj-bench-')
+    print(f"Working in {workdir}")
+    try:
+        if 'scan' in sections:
+            bench_scan(workdir, sizes)
+        if 'playlist' in sections:
+            bench_playlist(workdir, sizes)
+        if 'latency' in sections:
+            bench_latency(workdir, args.engine)
+        if 'soak' in sections:
+            bench_soak(workdir, args.engine, args.soak_hours, args.soak_seconds)
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metadata_cache import probe_file
+
+STORE_EVERY = 200  # Probe results written to the cache per transaction
+
+class BulkProber:
+    """Probe many files in parallel with a bounded number of ffprobe processes.
+
+    ffprobe only accepts one input per invocation, so batching happens at the
+    task level: each worker runs ffprobe back-to-back over a batch of files,
+    keeping at most `workers` ffprobe processes alive at once.
+    """
+    def __init__(self, cache, workers=None, batch_size=8, progress=None):
+        self.logger = logging.getLogger('BulkProber')
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.progress = progress or self._log_progress
+        self.busy = threading.Lock()
+        self.stopped = threading.Event()
+
+    def stale(self, paths):
+        """Return the (path, stat) pairs whose cache entry is missing or outdated"""
+        todo = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not self.cache.is_fresh(path, st):
+                todo.append((path, st))
+        return todo
+
+    def probe(self, paths):
+        """Probe every stale path, storing results in the cache. Returns (ok, failed)"""
+        with self.busy:
+            todo = self.stale(paths)
+            if not todo:
+                return 0, 0
+
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            done = ok = failed = 0
+            results = []
+            self.progress(0, len(todo))
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._probe_batch, batch) for batch in batches]
+                for future in as_completed(futures):
+                    batch_results, batch_failed = future.result()
+                    results.extend(batch_results)
+                    if len(results) >= STORE_EVERY:
+                        self.cache.store_many(results)
+                        results = []
+                    ok += len(batch_results)
+                    failed += batch_failed
+                    done += len(batch_results) + batch_failed
+                    self.progress(done, len(todo))
+            if results:
+                self.cache.store_many(results)
+            return ok, failed
+
+    def stop(self):
+        """Skip whatever a running probe() has not started yet (the interpreter waits for its workers)"""
+        self.stopped.set()
+
+    def _probe_batch(self, batch):
+        """Probe a batch of files; returns the (path, stat, info) results and the failure count"""
+        results = []
+        failed = 0
+        for path, st in batch:
+            if self.stopped.is_set():
+                break
+            try:
+                results.append((path, st, probe_file(path, self.cache.ffprobe_path)))
+            except Exception as e:
+                self.logger.warning(f"Could not probe {path}: {e}")
+                failed += 1
+        return results, failed
+
+    def _log_progress(self, done, total):
+        step = max(1, total // 10)
+        if done == total or done % step < self.batch_size:
+            self.logger.info(f"Probed {done}/{total} files")
+
+
+def _benchmark(folder, workers=None):
+    """Compare serial and parallel probe throughput over a folder"""
+    from library_index import AUDIO_EXTENSIONS
+    from metadata_cache import MetadataCache
+
+    paths = [os.path.join(root, name)
+             for root, _, files in os.walk(folder)
+             for name in files if name.lower().endswith(AUDIO_EXTENSIONS)]
+    print(f"{len(paths)} files in {folder}")
+
+    for label, count in (("serial", 1), ("parallel", workers or os.cpu_count() or 1)):
+        cache = MetadataCache(':memory:', ffprobe_path=os.environ.get('FFPROBE', 'ffprobe'))
+        prober = BulkProber(cache, workers=count, progress=lambda done, total: None)
+        start = time.perf_counter()
+        ok, failed = prober.probe(paths)
+        elapsed = time.perf_counter() - start
+        rate = (ok + failed) / elapsed if elapsed else 0
+        print(f"{label:>8} ({count} workers): {elapsed:.2f}s, {rate:.1f} files/s, {failed} failed")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python bulk_probe.py <folder> [workers]")
+        sys.exit(1)
+    _benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None)
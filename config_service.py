@@ -0,0 +1,209 @@
+import copy
+import json
+import logging
+import os
+import threading
+
+from audio_engine import TRANSITION_MODES
+from library_index import LIBRARY_INDEX_FILE
+from metadata_cache import METADATA_CACHE_FILE
+
+CONFIG_FILE = "config.json"
+POLL_INTERVAL = 2.0
+
+SINK_TYPES = ('file', 'command', 'null')  # Extra outputs accepted under outputs.sinks
+STREAM_FORMATS = ('mp3', 'opus')            # Encodings the http_stream server can serve
+
+# These are read once at startup (all of them, or some of their fields), so changing them
+# needs a restart; everything else is applied live by subscribers or read where it is used
+RESTART_KEYS = ('audio_engine', 'control_api', 'library_index', 'metadata_cache', 'playlist_state',
+                'processes', 'outputs', 'http_stream', 'metrics', 'shuffle', 'history', 'loudness',
+                'track_cache', 'watch', 'startup', 'probe_workers', 'virtual_cable_name', 'transition',
+                'buffer')
+
+
+class ConfigError(Exception):
+    """config.json is missing, unreadable or invalid; problems lists each issue found"""
+    def __init__(self, message, problems=()):
+        super().__init__(message)
+        self.problems = list(problems) or [message]
+
+
+def _check_number(errors, section, key, minimum=0):
+    value = section.get(key)
+    if value is not None and (not isinstance(value, (int, float)) or value < minimum):
+        errors.append(f"{key} must be a number >= {minimum}")
+
+
+def validate(config):
+    """Raise ConfigError listing every problem with a parsed config"""
+    errors = []
+    if not isinstance(config, dict):
+        raise ConfigError("config.json must contain a JSON object")
+    sources = config.get('audio_sources')
+    if not isinstance(sources, list) or not sources or not all(isinstance(s, str) for s in sources):
+        errors.append("audio_sources must be a non-empty list of folder paths")
+    for key in ('ffmpeg_path', 'obs_path', 'virtual_cable_name'):
+        if key in config and not isinstance(config[key], str):
+            errors.append(f"{key} must be a string")
+    if config.get('audio_engine', 'pipe') not in ('pipe', 'stream'):
+        errors.append("audio_engine must be 'pipe' or 'stream'")
+    for key in ('obs', 'watchdog', 'transition', 'buffer', 'loudness', 'track_cache', 'shuffle',
+                'history', 'status_outputs', 'control_api', 'watch', 'startup', 'processes', 'outputs',
+                'http_stream', 'metrics'):
+        if key in config and not isinstance(config[key], dict):
+            errors.append(f"{key} must be an object")
+    watchdog = config.get('watchdog')
+    if isinstance(watchdog, dict):
+        _check_number(errors, watchdog, 'timeout_seconds', 1)
+        _check_number(errors, watchdog, 'max_skips', 1)
+    _check_number(errors, config, 'playlist_window', 1)
+    if config.get('metadata_cache', METADATA_CACHE_FILE) == config.get('library_index', LIBRARY_INDEX_FILE):
+        errors.append("metadata_cache and library_index must be different files")
+    transition = config.get('transition')
+    if isinstance(transition, dict):
+        if transition.get('mode', 'gapless') not in TRANSITION_MODES:
+            errors.append(f"transition.mode must be one of {', '.join(TRANSITION_MODES)}")
+        _check_number(errors, transition, 'crossfade_seconds', 0)
+        _check_number(errors, transition, 'lookahead_seconds', 0)
+    buffer = config.get('buffer')
+    if isinstance(buffer, dict):
+        _check_number(errors, buffer, 'size_ms', 100)
+        _check_number(errors, buffer, 'start_ms', 0)
+    outputs = config.get('outputs')
+    if isinstance(outputs, dict):
+        sinks = outputs.get('sinks', [])
+        if not isinstance(sinks, list) or not all(isinstance(s, dict) and s.get('type') in SINK_TYPES
+                                                   for s in sinks):
+            errors.append(f"outputs.sinks must be a list of objects with a type of {', '.join(SINK_TYPES)}")
+        elif any(s['type'] == 'command' and not isinstance(s.get('command'), list) for s in sinks):
+            errors.append("outputs.sinks of type command need a command list")
+        if outputs.get('on_overflow', 'resync') not in ('resync', 'drop'):
+            errors.append("outputs.on_overflow must be 'resync' or 'drop'")
+        _check_number(errors, outputs, 'queue_ms', 100)
+    stream = config.get('http_stream')
+    if isinstance(stream, dict):
+        if config.get('audio_engine', 'pipe') != 'stream':
+            errors.append("http_stream needs audio_engine 'stream'")
+        if stream.get('format', 'mp3') not in STREAM_FORMATS:
+            errors.append(f"http_stream.format must be one of {', '.join(STREAM_FORMATS)}")
+        for key in ('bitrate', 'port', 'max_listeners'):
+            _check_number(errors, stream, key, 1)
+        _check_number(errors, stream, 'metaint', 0)
+        _check_number(errors, stream, 'burst_seconds', 0)
+    metrics = config.get('metrics')
+    if isinstance(metrics, dict):
+        _check_number(errors, metrics, 'port', 0)
+        _check_number(errors, metrics, 'dump_interval', 0)
+    if errors:
+        raise ConfigError("; ".join(errors), errors)
+    return config
+
+
+class ConfigService:
+    """The one place config.json is read.
+
+    Loaded and validated once; a background thread then watches the file and,
+    when it changes and still validates, swaps in the new config and calls
+    subscribers with the changed top-level keys. An invalid edit is reported
+    and ignored, so a typo never takes the stream down.
+    """
+    def __init__(self, path=CONFIG_FILE, poll_interval=POLL_INTERVAL):
+        self.logger = logging.getLogger('ConfigService')
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.stamp = None
+        self.data = self._read()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _read(self):
+        try:
+            st = os.stat(self.path)
+            # Remember the version even if it turns out bad, so it is reported once
+            self.stamp = (st.st_mtime_ns, st.st_size)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"Could not read {self.path}: {e}")
+        return validate(data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def snapshot(self):
+        """A private deep copy of the whole config"""
+        return copy.deepcopy(self.data)
+
+    def subscribe(self, callback, keys=None):
+        """Call callback(changes, config) after a reload that touches any of keys (all if None).
+
+        changes maps each changed top-level key to (old value, new value).
+        """
+        with self.lock:
+            self.subscribers.append((callback, set(keys) if keys else None))
+
+    def reload(self):
+        """Re-read the file now; returns the changes applied (empty if invalid or unchanged)"""
+        with self.lock:
+            try:
+                new = self._read()
+            except ConfigError as e:
+                self.logger.error(f"Ignoring config change: {e}")
+                return {}
+            old = self.data
+            changes = {key: (old.get(key), new.get(key))
+                       for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+            self.data = new
+            subscribers = list(self.subscribers)
+
+        if changes:
+            self.logger.info(f"Config reloaded: {', '.join(sorted(changes))} changed")
+            for key in sorted(changes.keys() & set(RESTART_KEYS)):
+                self.logger.warning(f"Config key {key} takes effect after a restart")
+        for callback, keys in subscribers:
+            if keys is None or keys & changes.keys():
+                try:
+                    callback(changes, self)
+                except Exception as e:
+                    self.logger.error(f"Config subscriber failed: {e}")
+        return changes
+
+    def watch(self):
+        """Start polling the file for changes (a stat call every poll_interval)"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._watch_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _watch_loop(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                continue
+            if (st.st_mtime_ns, st.st_size) != self.stamp:
+                self.reload()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_config(path=CONFIG_FILE):
+    """The process-wide ConfigService, loaded on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ConfigService(path)
+        return _shared
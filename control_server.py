@@ -0,0 +1,425 @@
+import asyncio
+import base64
+import hashlib
+import inspect
+import json
+import logging
+import os
+import struct
+import time
+from urllib.parse import urlsplit
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 8765
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_HEADER_BYTES = 16384
+MAX_MESSAGE_BYTES = 65536
+LISTEN_BACKLOG = 512  # Hundreds of overlays may reconnect at once after a restart
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+               405: "Method Not Allowed", 409: "Conflict", 415: "Unsupported Media Type",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+LOCAL_ORIGIN_HOSTS = ('localhost', '127.0.0.1', '::1')  # Browser pages allowed to send commands
+
+
+class CommandError(Exception):
+    """A control command that cannot be carried out in the current state"""
+
+
+def local_origin(request):
+    """False if a browser sent the request from a page that is not on this machine.
+
+    Clients outside a browser send no Origin and are let through; so is any
+    page served from localhost.
+    """
+    origin = request.headers.get('origin')
+    if origin is None:
+        return True
+    try:
+        return urlsplit(origin).hostname in LOCAL_ORIGIN_HOSTS
+    except ValueError:
+        return False
+
+
+class Request:
+    def __init__(self, method, path, headers, body, reader, writer, version='HTTP/1.1'):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.reader = reader
+        self.writer = writer
+
+    def json(self):
+        return json.loads(self.body) if self.body else {}
+
+
+def encode_frame(payload, opcode=OP_TEXT):
+    """A single unmasked, unfragmented server-to-client WebSocket frame"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def read_frame(reader):
+    """Read one client frame; returns (opcode, payload)"""
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"WebSocket message too large ({length} bytes)")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        # XOR the whole payload at once instead of byte by byte
+        key = int.from_bytes((mask * (length // 4 + 1))[:length], 'big')
+        payload = (int.from_bytes(payload, 'big') ^ key).to_bytes(length, 'big')
+    return opcode, payload
+
+
+class Subscriber:
+    """One WebSocket listener; only the newest status is kept for slow clients"""
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = None
+        self.ready = asyncio.Event()
+
+    def offer(self, frame):
+        self.pending = frame
+        self.ready.set()
+
+
+class ControlServer:
+    """Now-playing push and remote control over HTTP and WebSocket.
+
+    Runs on the DJ's asyncio loop, so every connection is a coroutine rather
+    than a thread. A status update is encoded into a frame once and handed to
+    each subscriber, which always sends only the newest one.
+
+    HTTP:      GET /status, POST /<command>
+    WebSocket: GET /ws, then send {"command": "<name>"} messages
+
+    With control=False none of these routes exist, leaving a bare HTTP server
+    for the routes added with add_route().
+    """
+    def __init__(self, status, commands, host=CONTROL_HOST, port=CONTROL_PORT, name="Control API",
+                 control=True):
+        self.logger = logging.getLogger('ControlServer')
+        self.name = name
+        self.status = status
+        self.commands = commands
+        self.host = host
+        self.port = port
+        self.server = None
+        self.loop = None
+        self.subscribers = set()
+        self.connections = set()
+        self.routes = {}
+        if control:
+            self.add_route('GET', '/status', self._get_status)
+            self.add_route('GET', '/ws', self._websocket)
+            for name in commands:
+                self.add_route('POST', f'/{name}', self._post_command)
+
+    def add_route(self, method, path, handler):
+        """Register `async handler(request)` returning (status, body[, content_type]),
+        or None once it has written its own response"""
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                 limit=MAX_HEADER_BYTES, backlog=LISTEN_BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"[OK] {self.name} on http://{self.host}:{self.port}")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            for subscriber in list(self.subscribers):
+                subscriber.writer.close()
+            if self.connections:
+                # Closed sockets end the handlers; give them a moment to unwind
+                await asyncio.wait(self.connections, timeout=1)
+            await self.server.wait_closed()
+            self.server = None
+
+    def publish(self, status=None):
+        """Push a status snapshot to every subscriber; safe to call from any thread"""
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            if asyncio.get_running_loop() is self.loop:
+                self._broadcast(status)
+                return
+        except RuntimeError:
+            pass
+        self.loop.call_soon_threadsafe(self._broadcast, status)
+
+    def _snapshot(self, status=None):
+        snapshot = dict(status or self.status())
+        if snapshot.get('start_time') and not snapshot.get('paused'):
+            elapsed = time.time() - snapshot['start_time']
+            snapshot['remaining'] = max(0, round(snapshot.get('duration', 0) - elapsed, 1))
+        return snapshot
+
+    def _broadcast(self, status):
+        if not self.subscribers:
+            return
+        frame = encode_frame(json.dumps({'type': 'status', **self._snapshot(status)}).encode('utf-8'))
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+
+    async def run_command(self, name, args=None):
+        command = self.commands.get(name)
+        if command is None:
+            raise CommandError(f"Unknown command: {name}")
+        result = command(**(args or {}))
+        if inspect.isawaitable(result):
+            result = await result
+        self.publish()
+        return result
+
+    # --- HTTP ----------------------------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            request = await self._read_request(reader, writer)
+            if request is None:
+                return
+            handler = self.routes.get((request.method, request.path))
+            if handler is None:
+                known = any(path == request.path for _, path in self.routes)
+                self._respond(writer, 405 if known else 404, {'error': 'not found'})
+            else:
+                response = await handler(request)
+                if response is not None:
+                    self._respond(writer, *response)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            self.logger.error(f"Error handling request: {e}")
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.LimitOverrunError, asyncio.IncompleteReadError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            self._respond(writer, 400, {'error': 'bad request line'})
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length') or 0)
+        if length > MAX_MESSAGE_BYTES:
+            self._respond(writer, 400, {'error': 'body too large'})
+            return None
+        body = await reader.readexactly(length) if length else b''
+        return Request(method, target.split('?', 1)[0], headers, body, reader, writer, version)
+
+    @staticmethod
+    def _respond(writer, status, body, content_type='application/json'):
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        writer.write(f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode('latin-1') + body)
+
+    async def _get_status(self, request):
+        return 200, self._snapshot()
+
+    async def _post_command(self, request):
+        # A web page can send a cross-origin form POST without asking first, but not a JSON one
+        if not local_origin(request):
+            return 403, {'ok': False, 'error': 'commands are only accepted from local pages'}
+        content_type = request.headers.get('content-type', '').split(';', 1)[0].strip().lower()
+        if content_type != 'application/json':
+            return 415, {'ok': False, 'error': 'send commands as application/json'}
+        try:
+            result = await self.run_command(request.path.lstrip('/'), request.json())
+            return 200, {'ok': True, 'result': result}
+        except (CommandError, ValueError, TypeError) as e:
+            return 409, {'ok': False, 'error': str(e)}
+
+    # --- WebSocket -----------------------------------------------------------------
+
+    async def _websocket(self, request):
+        key = request.headers.get('sec-websocket-key')
+        if request.headers.get('upgrade', '').lower() != 'websocket' or not key:
+            return 400, {'error': 'expected a WebSocket upgrade'}
+        if not local_origin(request):
+            return 403, {'error': 'WebSocket connections are only accepted from local pages'}
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WEBSOCKET_GUID).digest())
+        writer = request.writer
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\n"
+                     b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+        subscriber = Subscriber(writer)
+        self.subscribers.add(subscriber)
+        sender = asyncio.create_task(self._send_loop(subscriber))
+        subscriber.offer(encode_frame(json.dumps({'type': 'status', **self._snapshot()}).encode('utf-8')))
+        try:
+            await self._receive_loop(request.reader, writer)
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+        return None
+
+    async def _send_loop(self, subscriber):
+        try:
+            while True:
+                await subscriber.ready.wait()
+                subscriber.ready.clear()
+                subscriber.writer.write(subscriber.pending)
+                await subscriber.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _receive_loop(self, reader, writer):
+        while True:
+            try:
+                opcode, payload = await read_frame(reader)
+            except ValueError:
+                writer.write(encode_frame(struct.pack('!H', 1009), OP_CLOSE))
+                return
+            if opcode == OP_CLOSE:
+                writer.write(encode_frame(payload[:2], OP_CLOSE))
+                return
+            if opcode == OP_PING:
+                writer.write(encode_frame(payload, OP_PONG))
+            elif opcode == OP_TEXT:
+                writer.write(encode_frame(json.dumps(await self._ws_command(payload)).encode('utf-8')))
+
+    async def _ws_command(self, payload):
+        try:
+            message = json.loads(payload)
+            name = message['command']
+            result = await self.run_command(name, message.get('args'))
+            return {'type': 'result', 'command': name, 'ok': True, 'result': result}
+        except (ValueError, KeyError, TypeError, CommandError) as e:
+            return {'type': 'result', 'ok': False, 'error': str(e)}
+
+
+async def _demo(port):
+    """Serve a fake, ticking status so clients can be tried against localhost"""
+    state = {'title': 'Demo Track', 'artist': 'Demo Artist', 'album': 'Demo Album',
+             'path': '', 'start_time': time.time(), 'duration': 180,
+             'songs_played': 1, 'songs_in_playlist': 10, 'paused': False}
+
+    def skip():
+        state['songs_played'] += 1
+        state['start_time'] = time.time()
+
+    def pause():
+        state['paused'] = True
+
+    def resume():
+        state['paused'] = False
+
+    server = ControlServer(lambda: state, {'skip': skip, 'pause': pause, 'resume': resume},
+                           port=port)
+    await server.start()
+    while True:
+        await asyncio.sleep(1)
+        server.publish()
+
+
+def _masked_frame(payload, opcode=OP_TEXT):
+    """A client-to-server frame, which unlike the server's must be masked"""
+    frame = encode_frame(payload, opcode)
+    header = bytearray(frame[:len(frame) - len(payload)])
+    header[1] |= 0x80
+    mask = os.urandom(4)
+    key = int.from_bytes((mask * (len(payload) // 4 + 1))[:len(payload)], 'big')
+    return bytes(header) + mask + (int.from_bytes(payload, 'big') ^ key).to_bytes(len(payload), 'big')
+
+
+async def _http(host, port, method, path, body=None, headers=''):
+    """One request on its own connection; returns (status, parsed JSON body)"""
+    data = b'' if body is None else json.dumps(body).encode('utf-8')
+    if body is not None:
+        headers += "Content-Type: application/json\r\n"
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n{headers}"
+                     f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ', 2)[1]), json.loads(body or b'null')
+
+
+async def _client(port, host=CONTROL_HOST):
+    """Try a running server (the DJ's or _demo's): GET /status, a WebSocket
+    subscription, and skip over both HTTP and the WebSocket"""
+    status, body = await _http(host, port, 'GET', '/status')
+    print(f"GET /status -> {status} {body}")
+
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16))
+    writer.write(b"GET /ws HTTP/1.1\r\nHost: " + f"{host}:{port}".encode('latin-1') +
+                 b"\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: " + key + b"\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    head = await reader.readuntil(b'\r\n\r\n')
+    expected = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+    if not head.startswith(b"HTTP/1.1 101") or expected not in head:
+        raise RuntimeError(f"WebSocket handshake failed: {head.decode('latin-1').splitlines()[0]}")
+    opcode, payload = await read_frame(reader)
+    print(f"WebSocket /ws -> {json.loads(payload)}")
+
+    writer.write(_masked_frame(json.dumps({'command': 'skip'}).encode('utf-8')))
+    while True:
+        opcode, payload = await asyncio.wait_for(read_frame(reader), 5)
+        message = json.loads(payload)
+        print(f"WebSocket skip -> {message}")
+        if message.get('type') == 'result':
+            break
+
+    status, body = await _http(host, port, 'POST', '/skip', {})
+    print(f"POST /skip -> {status} {body}")
+    opcode, payload = await asyncio.wait_for(read_frame(reader), 5)
+    print(f"WebSocket status push -> {json.loads(payload)}")
+
+    writer.write(_masked_frame(struct.pack('!H', 1000), OP_CLOSE))
+    await writer.drain()
+    writer.close()
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['client']:
+        asyncio.run(_client(int(sys.argv[2]) if len(sys.argv) > 2 else CONTROL_PORT))
+    else:
+        asyncio.run(_demo(int(sys.argv[1]) if len(sys.argv) > 1 else CONTROL_PORT))
@@ -0,0 +1,302 @@
+"""Stand-in ffmpeg, ffprobe, ffplay and OBS for benchmarks on machines without them.
+
+`python fake_tools.py install <dir>` writes executables named after the
+real tools into dir; each runs this file with the tool's name first. The
+fakes behave enough like the real thing for the DJ to run end to end. The
+concat player prints "Opening '...'" lines (only at -loglevel debug, like
+the real one) and progress (-progress blocks or classic size= lines) and
+writes a WAV stream. Decoders write s16le PCM,
+ffprobe reports durations and tags, and the device listing shows a virtual
+cable. Environment variables steer them:
+
+    FAKE_TOOLS_DIR  events.log is appended here; a file named crash-<tool>
+                    makes the next running <tool> crash (and is removed)
+    FAKE_SPEED      how many times faster than real time songs play (default 1)
+    FAKE_DURATION   seconds reported for files that do not name their own (default 180)
+    FAKE_OBS_PORT   port the fake OBS listens on, standing in for its WebSocket server
+
+An audio file whose content starts with "duration=<seconds>" has that
+duration; anything else gets FAKE_DURATION.
+"""
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+
+TOOLS = ('ffmpeg', 'ffprobe', 'ffplay', 'obs')
+PROGRESS_SECONDS = 0.5    # Simulated time between two progress reports, as with the real -progress
+MIN_REPORT_SECONDS = 0.02  # ...but never more often than this in real time
+TICK_SECONDS = 0.05
+SAMPLE_RATE = 44100
+BYTES_PER_SECOND = SAMPLE_RATE * 4
+WAV_BYTES_PER_TICK = 4096  # The concat player writes a token amount of audio; nothing plays it
+LOG_LEVELS = {'quiet': -8, 'panic': 0, 'fatal': 8, 'error': 16, 'warning': 24, 'info': 32,
+              'verbose': 40, 'debug': 48, 'trace': 56}
+DEBUG = LOG_LEVELS['debug']
+CABLE_LISTING = (
+    '[dshow @ 000001d6b8f4a2c0] "CABLE Output (VB-Audio Virtual Cable)" (audio)\n'
+    '[dshow @ 000001d6b8f4a2c0]   Alternative name "@device_cm_{33D9A762-90C8-11D0-BD43-00A0C911CE86}'
+    '\\wave_{8A2B3C4D-0000-4000-8000-000000000001}"\n'
+    '[dshow @ 000001d6b8f4a2c0] "Microphone (Realtek High Definition Audio)" (audio)\n'
+    'dummy: Immediate exit requested\n'
+)
+
+
+def install(directory):
+    """Write one executable per tool into directory; returns {tool: path}"""
+    os.makedirs(directory, exist_ok=True)
+    script = os.path.abspath(__file__)
+    paths = {}
+    for tool in TOOLS:
+        path = os.path.join(directory, tool)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" {tool} "$@"\n')
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        paths[tool] = path
+    return paths
+
+
+class Fake:
+    def __init__(self, tool, args):
+        self.tool = tool
+        self.args = args
+        self.dir = os.environ.get('FAKE_TOOLS_DIR')
+        self.speed = float(os.environ.get('FAKE_SPEED', 1))
+        self.default_duration = float(os.environ.get('FAKE_DURATION', 180))
+
+    def log(self, event, detail='', when=None):
+        if not self.dir:
+            return
+        with open(os.path.join(self.dir, 'events.log'), 'a', encoding='utf-8') as f:
+            f.write(f"{when or time.time():.6f}\t{self.tool}\t{os.getpid()}\t{event}\t{detail}\n")
+
+    def crash_requested(self):
+        """True (once) if the harness asked this tool to crash"""
+        if not self.dir:
+            return False
+        try:
+            os.remove(os.path.join(self.dir, f'crash-{self.tool}'))
+        except OSError:
+            return False
+        self.log('crash')
+        return True
+
+    def option(self, name, default=None):
+        try:
+            return self.args[self.args.index(name) + 1]
+        except (ValueError, IndexError):
+            return default
+
+    def log_level(self):
+        """(numeric level, whether lines carry a [level] prefix) from -loglevel, as FFmpeg parses it"""
+        value = self.option('-loglevel') or self.option('-v') or 'info'
+        prefixed = False
+        level = LOG_LEVELS['info']
+        for token in value.replace('+', ' +').split():
+            flag = token.lstrip('+-')
+            if flag == 'level':
+                prefixed = not token.startswith('-')
+            elif flag in LOG_LEVELS:
+                level = LOG_LEVELS[flag]
+            elif flag.isdigit():
+                level = int(flag)
+        return level, prefixed
+
+    def duration(self, path):
+        try:
+            with open(path, 'rb') as f:
+                head = f.read(64).decode('ascii', 'replace')
+            if head.startswith('duration='):
+                return float(head[9:].split()[0])
+        except (OSError, ValueError, IndexError):
+            pass
+        return self.default_duration
+
+    # --- ffprobe ---------------------------------------------------------------------
+
+    def ffprobe(self):
+        path = self.args[-1]
+        if not os.path.exists(path):
+            sys.stderr.write(f"{path}: No such file or directory\n")
+            return 1
+        parts = os.path.normpath(path).split(os.sep)
+        title = os.path.splitext(parts[-1])[0].split(' - ', 1)[-1]
+        tags = {'title': title}
+        if len(parts) >= 3:
+            tags.update(artist=parts[-3], album=parts[-2])
+        print(json.dumps({
+            'streams': [{'sample_rate': str(SAMPLE_RATE), 'channels': 2}],
+            'format': {'duration': f"{self.duration(path):.6f}", 'tags': tags},
+        }))
+        return 0
+
+    # --- ffmpeg ----------------------------------------------------------------------
+
+    def ffmpeg(self):
+        self.log('start', ' '.join(self.args))
+        if '-list_devices' in self.args or '-list_options' in self.args:
+            sys.stderr.write(CABLE_LISTING)
+            return 1
+        if self.option('-f') == 'concat':
+            return self.play_concat(self.option('-i'))
+        source = self.option('-i')
+        if source and source != '-' and self.args[-1] == '-':
+            return self.decode(source)
+        return self.filter_stdin()
+
+    def play_concat(self, playlist):
+        """The pipe engine's concat decoder: one song after another (forever with -stream_loop -1)"""
+        try:
+            with open(playlist, 'r', encoding='utf-8') as f:
+                entries = [line.strip()[6:-1].replace("'\\''", "'")
+                           for line in f if line.startswith('file ')]
+        except OSError as e:
+            sys.stderr.write(f"[error] {playlist}: {e}\n")
+            return 1
+        level, leveled = self.log_level()
+        progress = self.option('-progress') is not None
+        prefix = '[info] ' if leveled else ''
+        # Concat opens each file as the child context's own URL, which FFmpeg only logs at DEBUG
+        opening = f"[concat @ 0x55d0c1a3f8c0] {'[debug] ' if leveled else ''}Opening '{{}}' for reading\n" \
+            if level >= DEBUG else None
+        err = sys.stderr
+        out = sys.stdout.buffer
+        err.write(f"{prefix}Input #0, concat, from '{playlist}':\n")
+        # RIFF header with "unknown" sizes, as ffmpeg writes when streaming WAV
+        out.write(b'RIFF\xff\xff\xff\xffWAVEfmt ' + struct.pack('<IHHIIHH', 16, 1, 2, SAMPLE_RATE,
+                                                                  BYTES_PER_SECOND, 4, 16)
+                  + b'data\xff\xff\xff\xff')
+        loop = self.option('-stream_loop') == '-1'
+        played = 0.0  # Simulated seconds of output
+        while entries:
+            for path in entries:
+                if not os.path.exists(path):
+                    level = '[error] ' if leveled else ''
+                    err.write(f"[concat @ 0x55d0c1a3f8c0] {level}Impossible to open '{path}'\n")
+                    err.write(f"{level}{playlist}: No such file or directory\n")
+                    err.flush()
+                    return 1
+                opened = time.time()
+                if opening:
+                    err.write(opening.format(path))
+                    err.flush()
+                self.log('open', path, opened)
+                remaining = self.duration(path)
+                while remaining > 0:
+                    step = min(remaining, max(PROGRESS_SECONDS, MIN_REPORT_SECONDS * self.speed))
+                    time.sleep(step / self.speed)
+                    if self.crash_requested():
+                        err.write("[fatal] Error while decoding stream #0:0: Invalid data found "
+                                  "when processing input\n")
+                        err.flush()
+                        return 1
+                    remaining -= step
+                    played += step
+                    try:
+                        out.write(bytes(WAV_BYTES_PER_TICK))
+                        out.flush()
+                    except BrokenPipeError:
+                        return 1
+                    clock = time.strftime('%H:%M:%S', time.gmtime(played)) + f".{int(played * 100) % 100:02d}"
+                    size = int(played * BYTES_PER_SECOND / 1024)
+                    if progress:
+                        err.write(f"bitrate=1411.2kbits/s\ntotal_size={size * 1024}\n"
+                                  f"out_time_us={int(played * 1e6)}\nout_time={clock}0000\n"
+                                  f"speed={self.speed:.3g}x\nprogress=continue\n")
+                    else:
+                        err.write(f"size={size:8d}kB time={clock} bitrate=1411.2kbits/s "
+                                  f"speed={self.speed:.3g}x\r")
+                    err.flush()
+            if not loop:
+                break
+        if progress:
+            err.write("progress=end\n")
+        return 0
+
+    def decode(self, path):
+        """The stream engine's per-track decoder: duration / FAKE_SPEED seconds of silence as s16le"""
+        if not os.path.exists(path):
+            sys.stderr.write(f"{path}: No such file or directory\n")
+            return 1
+        total = int(self.duration(path) / self.speed * BYTES_PER_SECOND) // 4 * 4
+        chunk = bytes(65536)
+        out = sys.stdout.buffer
+        try:
+            while total > 0:
+                if self.crash_requested():
+                    sys.stderr.write("Error while decoding stream #0:0: Invalid data found\n")
+                    return 1
+                out.write(chunk[:min(total, len(chunk))])
+                total -= len(chunk)
+            out.flush()
+        except BrokenPipeError:
+            return 1
+        return 0
+
+    def filter_stdin(self):
+        """Anything else (encoders, transcodes): read stdin to the end, write a little back"""
+        out = sys.stdout.buffer if self.args and self.args[-1] == '-' else None
+        if self.option('-i') != '-':
+            return 0
+        while True:
+            data = sys.stdin.buffer.read1(65536)
+            if not data or self.crash_requested():
+                return 0 if not data else 1
+            if out:
+                try:
+                    out.write(data[:len(data) // 10])
+                    out.flush()
+                except BrokenPipeError:
+                    return 1
+
+    # --- ffplay ----------------------------------------------------------------------
+
+    def ffplay(self):
+        """Consume audio from stdin at real-time speed (FAKE_SPEED is applied by the decoders)"""
+        self.log('start', ' '.join(self.args))
+        started = time.monotonic()
+        consumed = 0
+        while True:
+            data = sys.stdin.buffer.read1(65536)
+            if not data:
+                return 0
+            if self.crash_requested():
+                return 1
+            consumed += len(data)
+            ahead = consumed / BYTES_PER_SECOND - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    # --- OBS -------------------------------------------------------------------------
+
+    def obs(self):
+        self.log('start', ' '.join(self.args))
+        port = int(os.environ.get('FAKE_OBS_PORT', 0))
+        if port:
+            server = socket.create_server(('127.0.0.1', port))
+            threading.Thread(target=self._accept, args=(server,), daemon=True).start()
+        while not self.crash_requested():
+            time.sleep(TICK_SECONDS)
+        return 1
+
+    @staticmethod
+    def _accept(server):
+        while True:
+            connection, _ = server.accept()
+            connection.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == 'install':
+        for name, location in install(sys.argv[2]).items():
+            print(f"{name}: {location}")
+        sys.exit(0)
+    if len(sys.argv) < 2 or sys.argv[1] not in TOOLS:
+        print("Usage: python fake_tools.py install <dir> | <tool> [args...]")
+        sys.exit(2)
+    fake = Fake(sys.argv[1], sys.argv[2:])
+    sys.exit(getattr(fake, fake.tool)())
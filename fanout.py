@@ -0,0 +1,375 @@
+import logging
+import os
+import sys
+import threading
+import time
+import wave
+from collections import deque
+
+from audio_engine import (CommandSink, SAMPLE_RATE, CHANNELS, SAMPLE_WIDTH, BYTES_PER_SECOND,
+                          CHUNK_BYTES)
+
+QUEUE_MS = 2000            # Backlog each extra output may fall behind before it overflows
+CLOCK_QUEUE_CHUNKS = 2     # The first output paces the stream, so it only needs a short queue
+REOPEN_SECONDS = 5         # Wait before reopening an extra output that failed
+CLOCK_RETRY_SECONDS = 1    # First wait before retrying a clock output that will not reopen...
+CLOCK_RETRY_MAX = 30       # ...doubling up to this
+RESYNC_LOG_SECONDS = 10    # Report a lagging output at most this often
+CLOCK_LEAD_SECONDS = 0.25  # How far ahead of real time a ClockSink lets the stream run
+DRAIN_SECONDS = 5          # How long close() lets the extra outputs write out their queues
+HEADER_SECONDS = 10        # A recording's WAV header is brought up to date after this much audio
+OVERFLOW_POLICIES = ('resync', 'drop')
+RECORDING_PATTERN = os.path.join("recordings", "dj-%Y%m%d-%H%M%S.wav")
+
+
+class NullSink:
+    """Discards audio, counting the bytes (for tests and benchmarks)"""
+    def __init__(self, delay=0.0):
+        self.delay = delay  # Seconds per write, to imitate a slow consumer
+        self.bytes = 0
+        self.opened = False
+
+    def open(self):
+        self.opened = True
+
+    def is_alive(self):
+        return self.opened
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        self.bytes += len(data)
+
+    def close(self):
+        self.opened = False
+
+
+class ClockSink:
+    """Discards audio at real-time speed, pacing the stream when no audio device does.
+
+    Keeps at most CLOCK_LEAD_SECONDS ahead of the wall clock. After a pause
+    (or any stall) it starts counting afresh instead of racing to catch up.
+    """
+    def __init__(self):
+        self.started = None
+        self.written = 0
+
+    def open(self):
+        self.started = None
+
+    def is_alive(self):
+        return True
+
+    def write(self, data):
+        now = time.monotonic()
+        behind = self.started is not None and \
+            self.written / BYTES_PER_SECOND < now - self.started - CLOCK_LEAD_SECONDS
+        if self.started is None or behind:
+            self.started = now
+            self.written = 0
+        self.written += len(data)
+        ahead = self.written / BYTES_PER_SECOND - (now - self.started) - CLOCK_LEAD_SECONDS
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    """Records the stream to WAV files, starting a new file every rotate_minutes.
+
+    path is a time.strftime pattern, so each file is named after the moment
+    it was started. The header's sizes are updated every HEADER_SECONDS of
+    audio, so a recording cut short by a crash still plays up to that point.
+    """
+    def __init__(self, path=RECORDING_PATTERN, rotate_minutes=60):
+        self.pattern = path
+        self.rotate_bytes = int(rotate_minutes * 60 * SAMPLE_RATE) * CHANNELS * SAMPLE_WIDTH
+        self.header_bytes = int(HEADER_SECONDS * SAMPLE_RATE) * CHANNELS * SAMPLE_WIDTH
+        self.handle = None
+        self.file = None
+        self.path = None
+        self.written = 0
+        self.patched = 0
+
+    def open(self):
+        self.path = time.strftime(self.pattern)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.handle = open(self.path, 'wb')
+        self.file = wave.open(self.handle, 'wb')
+        self.file.setnchannels(CHANNELS)
+        self.file.setsampwidth(SAMPLE_WIDTH)
+        self.file.setframerate(SAMPLE_RATE)
+        self.written = 0
+        self.patched = 0
+
+    def is_alive(self):
+        return self.file is not None
+
+    def write(self, data):
+        if self.written >= self.rotate_bytes:
+            self.close()
+            self.open()
+        self.written += len(data)
+        if self.written - self.patched >= self.header_bytes:
+            # writeframes also rewrites the header's sizes; writeframesraw leaves them alone
+            self.file.writeframes(data)
+            self.handle.flush()
+            self.patched = self.written
+        else:
+            self.file.writeframesraw(data)
+
+    def close(self):
+        if self.file:
+            try:
+                self.file.close()  # Fills in the final sizes
+            finally:
+                self.handle.close()
+                self.file = None
+                self.handle = None
+
+
+def sink_from_config(spec, registry=None):
+    """Build an extra output from one entry of the outputs.sinks config list"""
+    kind = spec.get('type')
+    if kind == 'file':
+        return FileSink(spec.get('path', RECORDING_PATTERN), spec.get('rotate_minutes', 60))
+    if kind == 'command':
+        return CommandSink(spec['command'], registry, role=spec.get('name', 'sink'))
+    if kind == 'null':
+        return NullSink()
+    raise ValueError(f"Unknown output type: {kind}")
+
+
+class _Output:
+    """One sink behind a bounded queue, written by its own thread"""
+    def __init__(self, sink, name, max_bytes, clock):
+        self.sink = sink
+        self.name = name
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.queue = deque()
+        self.queued = 0
+        self.cond = threading.Condition()
+        self.healthy = False
+        self.closed = False
+        self.draining = False  # Closed, but its queue is still written out
+        self.thread = None
+        # Telemetry
+        self.written = 0
+        self.dropped = 0    # Bytes thrown away to catch up
+        self.resyncs = 0
+        self.failures = 0
+        self.last_report = None
+
+    def stats(self):
+        return {'name': self.name, 'queued': self.queued, 'written': self.written,
+                'dropped': self.dropped, 'resyncs': self.resyncs, 'failures': self.failures,
+                'healthy': self.healthy}
+
+
+class FanOutSink:
+    """One decoded PCM stream written to several sinks at once.
+
+    Behaves like a single sink for the StreamingEngine. Every output gets
+    its own bounded queue and writer thread, so a slow or failing output
+    never holds up the others. The first output is the clock: while it is
+    healthy, write() waits for room in its short queue, so the stream runs
+    at the pace of the real audio device. While the clock is down, write()
+    blocks until it is back, so the stream never runs unpaced. Any other output that falls more
+    than queue_ms behind overflows. With on_overflow='resync' its backlog
+    is dropped so it carries on from live audio. With 'drop' it is closed
+    and left out from then on. An output whose write fails is closed and
+    reopened: the clock straight away and then with growing backoff until it
+    opens, any other after REOPEN_SECONDS.
+    """
+    def __init__(self, sinks, queue_ms=QUEUE_MS, on_overflow='resync', names=None):
+        if on_overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {on_overflow}")
+        self.logger = logging.getLogger('FanOutSink')
+        self.on_overflow = on_overflow
+        queue_bytes = max(int(queue_ms / 1000 * BYTES_PER_SECOND), CHUNK_BYTES)
+        names = names or [type(sink).__name__ for sink in sinks]
+        self.outputs = [_Output(sink, name, CLOCK_QUEUE_CHUNKS * CHUNK_BYTES if i == 0 else queue_bytes,
+                                clock=i == 0)
+                        for i, (sink, name) in enumerate(zip(sinks, names))]
+
+    def open(self):
+        for output in self.outputs:
+            output.closed = False
+            self._open(output)
+            output.thread = threading.Thread(target=self._writer, args=(output,), daemon=True)
+            output.thread.start()
+
+    def _open(self, output):
+        try:
+            output.sink.open()
+            output.healthy = True
+        except (OSError, ValueError) as e:
+            output.healthy = False
+            output.failures += 1
+            self.logger.error(f"Could not open output {output.name}: {e}")
+
+    def is_alive(self):
+        return self.outputs[0].healthy
+
+    def write(self, data):
+        chunk = bytes(data)  # One copy shared by every queue; the caller reuses its buffer
+        for output in self.outputs:
+            with output.cond:
+                if output.closed:
+                    continue
+                if output.clock:
+                    # Wait for room, and for the clock itself while it is being reopened
+                    while (output.queued + len(chunk) > output.max_bytes or not output.healthy) \
+                            and not output.closed:
+                        output.cond.wait(0.1)
+                    if output.closed:
+                        continue
+                elif output.queued + len(chunk) > output.max_bytes:
+                    self._overflow(output)
+                    if output.closed:
+                        continue
+                output.queue.append(chunk)
+                output.queued += len(chunk)
+                output.cond.notify_all()
+
+    def _overflow(self, output):
+        """A slow output is a full queue behind (called with its lock held)"""
+        if self.on_overflow == 'drop' and not output.clock:
+            self.logger.warning(f"Output {output.name} cannot keep up, dropping it")
+            output.closed = True
+            output.cond.notify_all()
+            return
+        behind = output.queued
+        output.dropped += behind
+        output.resyncs += 1
+        output.queue.clear()
+        output.queued = 0
+        now = time.monotonic()
+        if output.last_report is None or now - output.last_report >= RESYNC_LOG_SECONDS:
+            output.last_report = now
+            self.logger.warning(f"Output {output.name} fell {behind / BYTES_PER_SECOND * 1000:.0f} ms "
+                                f"behind, skipped ahead to live audio ({output.resyncs} resyncs, "
+                                f"{output.dropped / BYTES_PER_SECOND:.1f}s dropped so far)")
+
+    def _writer(self, output):
+        while True:
+            if output.clock and not output.healthy:
+                self._reopen_clock(output)
+            with output.cond:
+                while not output.queue and not output.closed:
+                    output.cond.wait()
+                if output.closed and not (output.draining and output.queue):
+                    break
+                chunk = output.queue.popleft()
+                output.queued -= len(chunk)
+                output.cond.notify_all()
+            if not output.healthy:
+                continue  # Still waiting to reopen; this audio is lost for it
+            try:
+                output.sink.write(chunk)
+                output.written += len(chunk)
+            except (OSError, ValueError) as e:
+                output.failures += 1
+                output.healthy = False
+                self._close_sink(output)
+                if output.clock:
+                    self.logger.warning(f"Output {output.name} failed ({e}), reopening")
+                else:
+                    self.logger.warning(f"Output {output.name} failed ({e}), reopening in {REOPEN_SECONDS}s")
+                    threading.Timer(REOPEN_SECONDS, self._reopen, args=(output,)).start()
+        self._close_sink(output)
+
+    def _reopen(self, output):
+        if not output.closed:
+            self._open(output)
+
+    def _reopen_clock(self, output):
+        """Reopen the clock until it works, backing off between attempts; write() waits meanwhile"""
+        delay = CLOCK_RETRY_SECONDS
+        while not output.closed:
+            self._open(output)
+            if output.healthy:
+                with output.cond:
+                    output.cond.notify_all()
+                return
+            self.logger.warning(f"Output {output.name} is down, retrying in {delay}s")
+            with output.cond:
+                output.cond.wait_for(lambda: output.closed, delay)
+            delay = min(delay * 2, CLOCK_RETRY_MAX)
+
+    def _close_sink(self, output):
+        try:
+            output.sink.close()
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not close output {output.name}: {e}")
+
+    def close(self):
+        """Stop every output. The extra outputs (a recording, say) get up to
+        DRAIN_SECONDS to write what is still queued; the clock's short queue
+        is dropped, since nobody is listening any more."""
+        for output in self.outputs:
+            with output.cond:
+                output.draining = not output.clock and not output.closed  # Not one dropped for lagging
+                output.closed = True
+                if output.clock:
+                    self._discard(output)
+                output.cond.notify_all()
+        deadline = time.monotonic() + DRAIN_SECONDS
+        for output in self.outputs:
+            if output.thread:
+                output.thread.join(max(deadline - time.monotonic(), 0))
+                if output.thread.is_alive():
+                    self.logger.warning(f"Output {output.name} did not finish writing, "
+                                        f"dropping {output.queued / BYTES_PER_SECOND:.1f}s of audio")
+                    with output.cond:
+                        output.draining = False
+                        self._discard(output)
+                        output.cond.notify_all()
+                    output.thread.join(timeout=5)
+                output.thread = None
+
+    @staticmethod
+    def _discard(output):
+        """Empty an output's queue (called with its lock held)"""
+        output.queue.clear()
+        output.queued = 0
+
+    def stats(self):
+        return [output.stats() for output in self.outputs]
+
+
+def _demo(seconds, speed):
+    """Fan `seconds` of silence out to a WAV file and a sink that is too slow to keep up.
+
+    The clock sink plays at `speed` times real time; the slow one manages a
+    quarter of that and gets resynced, while the file keeps up in full.
+    """
+    logging.basicConfig(level=logging.WARNING, format='%(name)s: %(message)s')
+    path = os.path.join("recordings", "fanout-demo.wav")
+    chunk_seconds = CHUNK_BYTES / BYTES_PER_SECOND
+    sinks = [NullSink(delay=chunk_seconds / speed), FileSink(path), NullSink(delay=4 * chunk_seconds / speed)]
+    fanout = FanOutSink(sinks, queue_ms=2000, names=['clock', 'file', 'slow'])
+    fanout.open()
+    chunk = bytes(CHUNK_BYTES)
+    total = int(seconds / chunk_seconds)
+    start = time.perf_counter()
+    for _ in range(total):
+        fanout.write(chunk)
+    elapsed = time.perf_counter() - start
+    fanout.close()  # Writes out the file's queue
+    print(f"{total * chunk_seconds:.0f}s of audio fanned out in {elapsed:.2f}s ({speed:g}x real time)")
+    for stats in fanout.stats():
+        print(f"{stats['name']:>6}: wrote {stats['written'] / BYTES_PER_SECOND:6.1f}s, "
+              f"dropped {stats['dropped'] / BYTES_PER_SECOND:6.1f}s in {stats['resyncs']} resyncs")
+    with wave.open(path, 'rb') as recorded:
+        print(f"{path}: {recorded.getnframes() / SAMPLE_RATE:.1f}s recorded")
+
+
+if __name__ == "__main__":
+    _demo(float(sys.argv[1]) if len(sys.argv) > 1 else 60,
+          float(sys.argv[2]) if len(sys.argv) > 2 else 20)
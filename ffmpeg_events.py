@@ -0,0 +1,193 @@
+import io
+import os
+import sys
+import time
+from collections import namedtuple
+
+TRACK_OPEN = 'track-open'
+PROGRESS = 'progress'
+ERROR = 'error'
+EOF = 'eof'
+
+FFmpegEvent = namedtuple('FFmpegEvent', ['kind', 'data'])
+
+# Arguments that make FFmpeg's stderr cheap to parse. Concat opens each file
+# through avformat_open_input, and FFmpeg logs "Opening '...' for reading" for
+# a context's own URL only at DEBUG, so debug it has to be; the parser skips
+# the other debug lines inside bytes.find. Every line carries its level, and
+# progress comes as -progress key=value blocks instead of the \r stats line.
+STDERR_ARGS = ['-loglevel', 'level+debug', '-nostats', '-progress', 'pipe:2']
+
+OPENING = b"Opening '"
+ERROR_MARKERS = (b'[error] ', b'[fatal] ', b'[panic] ')
+NEWLINE = b'\n'
+
+
+class FFmpegEventParser:
+    """Turn raw FFmpeg stderr bytes into typed events.
+
+    Input is fed in arbitrary chunks and searched as a whole rather than split
+    into lines, so only the few records that matter are ever decoded.
+    """
+    def __init__(self, extensions=('.mp3', '.wav', '.flac')):
+        self.extensions = tuple(ext.encode() for ext in extensions)
+        self.partial = b''
+        self.out_time_us = None
+
+    def feed(self, data):
+        """Parse a chunk of stderr, returning the events it completed"""
+        data = self.partial + data
+        end = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+        self.partial = data[end:]
+        return self._scan(data, end)
+
+    def close(self):
+        """Flush any trailing partial record and signal end of stream"""
+        events = self._scan(self.partial, len(self.partial))
+        self.partial = b''
+        events.append(FFmpegEvent(EOF, None))
+        return events
+
+    def _scan(self, data, end):
+        # Every search below is a bytes.find over the whole chunk, so the cost of
+        # the lines we ignore stays in C; only matches are touched from Python.
+        found = []
+
+        pos = data.find(OPENING, 0, end)
+        while pos != -1:
+            start = pos + len(OPENING)
+            line_end = self._line_end(data, start, end)
+            # Paths may contain quotes themselves, so anchor on the "' for reading" suffix
+            close = data.rfind(b"' for ", start, line_end)
+            if close == -1:
+                close = data.find(b"'", start, line_end)
+            path = data[start:close]
+            if close != -1 and path.lower().endswith(self.extensions):
+                found.append((pos, FFmpegEvent(TRACK_OPEN, path.decode('utf-8', 'replace'))))
+            pos = data.find(OPENING, line_end, end)
+
+        for marker in ERROR_MARKERS:
+            pos = data.find(marker, 0, end)
+            while pos != -1:
+                line_start = max(data.rfind(b'\n', 0, pos), data.rfind(b'\r', 0, pos)) + 1
+                line_end = self._line_end(data, pos, end)
+                found.append((line_start, FFmpegEvent(ERROR, data[line_start:line_end].decode('utf-8', 'replace'))))
+                pos = data.find(marker, line_end, end)
+
+        for pos in self._line_starts(data, b'progress=', end, (b'\n',)):
+            time_pos = data.rfind(b'out_time_us=', 0, pos)
+            if time_pos != -1:
+                value = data[time_pos + 12:self._line_end(data, time_pos, end)]
+                self.out_time_us = int(value) if value.lstrip(b'-').isdigit() else None
+            state = data[pos + 9:self._line_end(data, pos, end)]
+            found.append((pos, FFmpegEvent(PROGRESS, {
+                'progress': state.decode(),
+                'out_time_us': self.out_time_us,
+            })))
+
+        for pos in self._line_starts(data, b'size=', end):
+            # Classic stats line, when -progress is not in use
+            line = data[pos:self._line_end(data, pos, end)]
+            found.append((pos, FFmpegEvent(PROGRESS, {'stats': line.decode('utf-8', 'replace')})))
+
+        found.sort(key=lambda item: item[0])
+        return [event for _, event in found]
+
+    @staticmethod
+    def _line_starts(data, prefix, end, separators=(b'\n', b'\r')):
+        """Positions where a record starts with prefix"""
+        if data.startswith(prefix):
+            yield 0
+        for separator in separators:
+            needle = separator + prefix
+            pos = data.find(needle, 0, end)
+            while pos != -1:
+                yield pos + 1
+                pos = data.find(needle, pos + 1, end)
+
+    @staticmethod
+    def _line_end(data, pos, end):
+        newline = data.find(b'\n', pos, end)
+        if newline == -1:
+            newline = end
+        carriage = data.find(b'\r', pos, newline)
+        return newline if carriage == -1 else carriage
+
+
+def read_events(stream, chunk_size=65536, parser=None):
+    """Yield events from a binary stream (e.g. Popen.stderr) until it closes"""
+    parser = parser or FFmpegEventParser()
+    read = getattr(stream, 'read1', None)
+    if read is None:
+        fd = stream.fileno()
+        read = lambda size: os.read(fd, size)
+    while True:
+        data = read(chunk_size)
+        if not data:
+            break
+        yield from parser.feed(data)
+    yield from parser.close()
+
+
+def _legacy_scan(data):
+    """The old per-line approach from monitor_ffmpeg_output, for comparison"""
+    opens = progress = 0
+    stream = io.BytesIO(data)
+    while True:
+        raw = stream.readline()
+        if not raw:
+            break
+        line = raw.decode().strip()
+        if not line:
+            continue
+        if "Opening '" in line:
+            file_path = line.split("'")[1]
+            if file_path.endswith(('.mp3', '.wav', '.flac')):
+                opens += 1
+        if "size=" in line:
+            progress += 1
+    return opens, progress
+
+
+def _parse_time(data, parse, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = parse(data)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def _parse_events(data):
+    events = list(read_events(io.BufferedReader(io.BytesIO(data))))
+    return (sum(1 for e in events if e.kind == TRACK_OPEN),
+            sum(1 for e in events if e.kind == PROGRESS))
+
+
+def _benchmark(log_paths, repeat=5):
+    """Compare per-line decoding with the event parser on recorded stderr logs.
+
+    The first log should be captured with the old -loglevel debug command; an
+    optional second log captured with STDERR_ARGS shows the effect of -nostats
+    and -progress for the same playback.
+    """
+    with open(log_paths[0], 'rb') as f:
+        data = f.read()
+    print(f"{log_paths[0]}: {len(data)} bytes, {data.count(NEWLINE)} lines")
+    elapsed, (opens, progress) = _parse_time(data, _legacy_scan, repeat)
+    print(f"  per-line decode: {elapsed * 1000:.1f} ms ({opens} opens, {progress} progress lines)")
+    elapsed, (opens, progress) = _parse_time(data, _parse_events, repeat)
+    print(f"  event parser:    {elapsed * 1000:.1f} ms ({opens} opens, {progress} progress events)")
+
+    if len(log_paths) > 1:
+        with open(log_paths[1], 'rb') as f:
+            lean = f.read()
+        print(f"{log_paths[1]}: {len(lean)} bytes, {lean.count(NEWLINE)} lines "
+              f"({len(data) / max(len(lean), 1):.0f}x less stderr)")
+        elapsed, (opens, progress) = _parse_time(lean, _parse_events, repeat)
+        print(f"  event parser:    {elapsed * 1000:.1f} ms ({opens} opens, {progress} progress events)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python ffmpeg_events.py <debug stderr log> [<level+debug/-progress stderr log>]")
+        sys.exit(1)
+    _benchmark(sys.argv[1:3])
@@ -0,0 +1,191 @@
+import logging
+import os
+import sqlite3
+import threading
+
+LIBRARY_INDEX_FILE = "library.db"
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac')
+
+
+class LibraryIndex:
+    """Persistent on-disk index of the audio files in the configured sources.
+
+    Directories are tracked by mtime so a rescan only lists folders whose
+    contents changed; files inside unchanged folders are never touched.
+    """
+    def __init__(self, db_path=LIBRARY_INDEX_FILE):
+        self.logger = logging.getLogger('LibraryIndex')
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                source TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                source TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+            CREATE INDEX IF NOT EXISTS files_source ON files (source);
+        """)
+        self.conn.commit()
+
+    def scan(self, sources):
+        """Bring the index up to date with the given sources.
+
+        Returns a dict with the number of added, changed and removed files and
+        the number of directories that had to be listed.
+        """
+        stats = {'added': 0, 'changed': 0, 'removed': 0, 'dirs_listed': 0}
+        with self.lock:
+            for source in sources:
+                root = os.path.abspath(source)
+                if not os.path.isdir(root):
+                    self.logger.warning(f"Source folder not found: {source}")
+                    continue
+                self._scan_source(root, stats)
+
+            # Drop anything that belonged to a source no longer configured
+            configured = [os.path.abspath(s) for s in sources]
+            placeholders = ",".join("?" * len(configured)) or "''"
+            cur = self.conn.execute(
+                f"DELETE FROM files WHERE source NOT IN ({placeholders})", configured)
+            stats['removed'] += cur.rowcount
+            self.conn.execute(
+                f"DELETE FROM dirs WHERE source NOT IN ({placeholders})", configured)
+            self.conn.commit()
+
+        self.logger.info(
+            f"Library scan: +{stats['added']} ~{stats['changed']} -{stats['removed']} "
+            f"({stats['dirs_listed']} folders listed)")
+        return stats
+
+    def update_dirs(self, dirs, sources):
+        """Reconcile just the given folders (and any new folders below them).
+
+        Used by the filesystem watcher, which knows exactly what changed, so
+        nothing else in the library is touched.
+        """
+        stats = {'added': 0, 'changed': 0, 'removed': 0, 'dirs_listed': 0}
+        roots = [os.path.abspath(s) for s in sources]
+        with self.lock:
+            for path in sorted(set(os.path.abspath(d) for d in dirs)):
+                root = next((r for r in roots if path == r or path.startswith(r + os.sep)), None)
+                if root is None:
+                    continue
+                parent = None if path == root else os.path.dirname(path)
+                self._scan_tree(path, parent, root, None, stats, force=True)
+            self.conn.commit()
+        return stats
+
+    def _scan_source(self, root, stats):
+        known_dirs = dict(self.conn.execute(
+            "SELECT path, mtime_ns FROM dirs WHERE source = ?", (root,)))
+        self._scan_tree(root, None, root, known_dirs, stats)
+
+    def _scan_tree(self, start, start_parent, root, known_dirs, stats, force=False):
+        """Walk from start, listing folders whose mtime differs from known_dirs.
+
+        known_dirs=None looks each folder up on the way instead of preloading a
+        whole source. With force, start itself is always listed (its files may
+        have changed without touching the folder mtime).
+        """
+        stack = [(start, start_parent)]
+        while stack:
+            path, parent = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                self._forget_dir(path, stats)
+                continue
+
+            if known_dirs is None:
+                row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE path = ?", (path,)).fetchone()
+                known = row[0] if row else None
+            else:
+                known = known_dirs.get(path)
+            if known == mtime_ns and not (force and path == start):
+                # Unchanged folder: only descend into the subfolders we know about
+                stack.extend((child, path) for (child,) in self.conn.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (path,)))
+                continue
+
+            stats['dirs_listed'] += 1
+            subdirs = self._list_dir(path, root, stats)
+            for (child,) in self.conn.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (path,)).fetchall():
+                if child not in subdirs:
+                    self._forget_dir(child, stats)
+            stack.extend((child, path) for child in subdirs)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, parent, source, mtime_ns) VALUES (?, ?, ?, ?)",
+                (path, parent, root, mtime_ns))
+
+    def _list_dir(self, path, root, stats):
+        """Reconcile the files of one changed folder, returning its subfolders"""
+        subdirs = set()
+        seen = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            subdirs.add(entry.path)
+                        elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                            st = entry.stat()
+                            seen[entry.path] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError as e:
+            self.logger.warning(f"Could not list {path}: {e}")
+            return subdirs
+
+        known = {p: (size, mtime) for p, size, mtime in self.conn.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE dir = ?", (path,))}
+        for file_path, (size, mtime) in seen.items():
+            previous = known.pop(file_path, None)
+            if previous == (size, mtime):
+                continue
+            stats['changed' if previous else 'added'] += 1
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files (path, dir, source, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                (file_path, path, root, size, mtime))
+        if known:
+            stats['removed'] += len(known)
+            self.conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in known])
+        return subdirs
+
+    def _forget_dir(self, path, stats):
+        """Remove a folder and everything below it from the index"""
+        pending = [path]
+        while pending:
+            current = pending.pop()
+            pending.extend(child for (child,) in self.conn.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (current,)))
+            cur = self.conn.execute("DELETE FROM files WHERE dir = ?", (current,))
+            stats['removed'] += cur.rowcount
+            self.conn.execute("DELETE FROM dirs WHERE path = ?", (current,))
+
+    def tracks(self, sources=None):
+        """Return every indexed audio file, optionally limited to some sources"""
+        with self.lock:
+            if sources is None:
+                rows = self.conn.execute("SELECT path FROM files ORDER BY path")
+            else:
+                roots = [os.path.abspath(s) for s in sources]
+                placeholders = ",".join("?" * len(roots)) or "''"
+                rows = self.conn.execute(
+                    f"SELECT path FROM files WHERE source IN ({placeholders}) ORDER BY path", roots)
+            return [path for (path,) in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,291 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from library_index import AUDIO_EXTENSIONS
+
+DEBOUNCE_SECONDS = 5.0   # A folder must be quiet this long before it is re-read
+POLL_SECONDS = 10.0      # Folder mtime check interval when inotify is unavailable
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(root):
+    """root and every folder below it"""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        yield path
+        try:
+            with os.scandir(path) as entries:
+                stack.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+
+
+class InotifyBackend:
+    """Folder change notifications from Linux inotify, one watch per folder"""
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> folder
+        self.roots = []
+
+    def add_tree(self, root):
+        self.roots.append(root)
+        self._watch_tree(root)
+
+    def _watch_tree(self, root):
+        """Watch root and every folder below it; returns the folders now watched"""
+        added = []
+        for path in _walk_dirs(root):
+            wd = self.add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno == 28:  # ENOSPC: out of inotify watches
+                    raise OSError(errno, "inotify watch limit reached "
+                                         "(raise fs.inotify.max_user_watches)")
+                continue  # Folder vanished or is unreadable
+            self.watches[wd] = path
+            added.append(path)
+        return added
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds; returns the set of folders that changed"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost; re-read everything we watch
+                changed.update(self.roots)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(os.path.dirname(folder))
+                continue
+            changed.add(folder)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Folders inside it may have appeared before the watch did
+                changed.update(self._watch_tree(os.path.join(folder, os.fsdecode(name))))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """Portable fallback: compare folder mtimes every interval"""
+    def __init__(self, interval=POLL_SECONDS, stopped=None):
+        self.interval = interval
+        self.stopped = stopped or threading.Event()
+        self.mtimes = {}
+        self.roots = []
+
+    def add_tree(self, root):
+        self.roots.append(root)
+        self._record_tree(root)
+
+    def _record_tree(self, root):
+        """Remember the mtime of root and every folder below it; returns those folders"""
+        recorded = []
+        for path in _walk_dirs(root):
+            try:
+                self.mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            recorded.append(path)
+        return recorded
+
+    def poll(self, timeout):
+        if self.stopped.wait(min(timeout, self.interval) if timeout else self.interval):
+            return set()
+        changed = set()
+        for path, mtime_ns in list(self.mtimes.items()):
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                del self.mtimes[path]
+                changed.add(os.path.dirname(path))
+                continue
+            if current != mtime_ns:
+                self.mtimes[path] = current
+                changed.add(path)
+                # Pick up folders that were created or moved in
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False) and entry.path not in self.mtimes:
+                                changed.update(self._record_tree(entry.path))
+                except OSError:
+                    pass
+        return changed
+
+    def close(self):
+        pass
+
+
+class LibraryWatcher:
+    """Streams folder changes under the audio sources into the library index.
+
+    Changed folders wait until they have been quiet for `debounce` seconds
+    and hold no audio file modified within that time, so a download still
+    being written never enters rotation. Settled folders are re-read with
+    LibraryIndex.update_dirs and on_change(stats) is called if any track
+    was added, changed or removed.
+    """
+    def __init__(self, library, sources, on_change, debounce=DEBOUNCE_SECONDS,
+                 poll_interval=POLL_SECONDS):
+        self.logger = logging.getLogger('LibraryWatcher')
+        self.library = library
+        self.sources = list(sources)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.pending = {}  # folder -> time of its last event
+        self.backend = None
+        self.thread = None
+
+    def _open_backend(self):
+        roots = [os.path.abspath(s) for s in self.sources if os.path.isdir(s)]
+        if sys.platform.startswith('linux'):
+            try:
+                backend = InotifyBackend()
+                try:
+                    for root in roots:
+                        backend.add_tree(root)
+                    return backend
+                except OSError:
+                    backend.close()
+                    raise
+            except (OSError, AttributeError) as e:
+                self.logger.warning(f"inotify unavailable ({e}), polling folders instead")
+        backend = PollingBackend(self.poll_interval, self.stopped)
+        for root in roots:
+            backend.add_tree(root)
+        return backend
+
+    def start(self):
+        # Adding a watch per folder walks the whole tree, so it happens on the thread
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout=self.poll_interval + 1)
+
+    def set_sources(self, sources):
+        """Watch a new list of sources (restarts the backend)"""
+        self.stop()
+        self.sources = list(sources)
+        self.stopped = threading.Event()
+        self.pending = {}
+        self.start()
+
+    def _run(self):
+        self.backend = self._open_backend()
+        self.logger.info(f"Watching {len(self.sources)} sources with {type(self.backend).__name__}")
+        try:
+            while not self.stopped.is_set():
+                # Wake when the next folder has been quiet long enough; folders
+                # already quiet but held back by a busy subfolder wait on that one
+                now = time.monotonic()
+                due = [last + self.debounce for last in self.pending.values()
+                       if last + self.debounce > now]
+                timeout = max(0.1, min(due) - now) if due else 1.0
+                changed = self.backend.poll(timeout)
+                now = time.monotonic()
+                for folder in changed:
+                    self.pending[folder] = now
+                self._flush_settled(now)
+        finally:
+            self.backend.close()
+
+    def _flush_settled(self, now):
+        quiet = []
+        for folder, last_event in list(self.pending.items()):
+            if now - last_event < self.debounce:
+                continue
+            if self._has_fresh_audio(folder):
+                self.pending[folder] = now  # Still being written; check again later
+                continue
+            quiet.append(folder)
+        # Re-reading a folder also walks new folders below it, so a folder
+        # waits until nothing underneath it is still busy
+        busy = [folder for folder in self.pending if folder not in quiet]
+        settled = [folder for folder in quiet
+                   if not any(other.startswith(folder + os.sep) for other in busy)]
+        for folder in settled:
+            del self.pending[folder]
+        if not settled:
+            return
+        try:
+            stats = self.library.update_dirs(settled, self.sources)
+        except Exception as e:
+            self.logger.error(f"Could not update library for {len(settled)} folders: {e}")
+            return
+        if stats['added'] or stats['changed'] or stats['removed']:
+            self.logger.info(f"Library changed: +{stats['added']} ~{stats['changed']} "
+                             f"-{stats['removed']}")
+            try:
+                self.on_change(stats)
+            except Exception as e:
+                self.logger.error(f"Library change handler failed: {e}")
+
+    def _has_fresh_audio(self, folder):
+        """True if an audio file in folder was modified within the debounce window"""
+        cutoff = time.time() - self.debounce
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                        try:
+                            if entry.stat().st_mtime > cutoff:
+                                return True
+                        except OSError:
+                            continue
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+TARGET_LOUDNESS = -16.0   # LUFS
+MAX_GAIN = 12.0           # dB, either direction
+PEAK_CEILING = -1.0       # dBTP a boosted track may reach
+
+SUMMARY_PATTERN = re.compile(
+    r"Summary:.*?\bI:\s*(?P<integrated>-?[\d.]+|-?inf)\s*LUFS"
+    r".*?True peak:\s*Peak:\s*(?P<peak>-?[\d.]+|-?inf)\s*dBFS",
+    re.DOTALL)
+
+
+def analyze_loudness(path, ffmpeg_path='ffmpeg'):
+    """Measure EBU R128 integrated loudness (LUFS) and true peak (dBTP) of a file"""
+    result = subprocess.run([
+        ffmpeg_path,
+        '-hide_banner',
+        '-nostats',
+        '-nostdin',
+        '-i', path,
+        '-vn',
+        '-af', 'ebur128=peak=true:framelog=verbose',
+        '-f', 'null',
+        '-'
+    ], capture_output=True, text=True, errors='replace',
+        creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip()
+                           else f"ffmpeg exited with {result.returncode}")
+    match = SUMMARY_PATTERN.search(result.stderr)
+    if not match:
+        raise RuntimeError("No ebur128 summary in ffmpeg output")
+    return float(match.group('integrated')), float(match.group('peak'))
+
+
+def track_gain(loudness, true_peak, target=TARGET_LOUDNESS, max_gain=MAX_GAIN,
+               peak_ceiling=PEAK_CEILING):
+    """Static gain in dB that brings a track to the target without clipping"""
+    if loudness is None:
+        return 0.0
+    gain = target - loudness
+    if true_peak is not None:
+        gain = min(gain, peak_ceiling - true_peak)
+    return max(-max_gain, min(max_gain, gain))
+
+
+class LoudnessAnalyzer:
+    """Offline loudness pass over the library, one ffmpeg per worker.
+
+    Results go into the metadata cache next to duration and tags, so playback
+    only has to look up a number and apply a fixed volume per track. Only
+    files with fresh metadata and no measurement yet are analysed.
+    """
+    def __init__(self, cache, ffmpeg_path='ffmpeg', workers=None):
+        self.logger = logging.getLogger('LoudnessAnalyzer')
+        self.cache = cache
+        self.ffmpeg_path = ffmpeg_path
+        # Every worker decodes a whole file; leave a core for the live stream
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.busy = threading.Lock()
+        self.stopped = threading.Event()
+
+    def pending(self, paths):
+        """Paths whose metadata is current but whose loudness is not measured yet"""
+        todo = []
+        for path in paths:
+            entry = self.cache.lookup(path)
+            if entry and entry.get('loudness') is None and self.cache.is_fresh(path):
+                todo.append(path)
+        return todo
+
+    def analyze(self, paths):
+        """Measure every pending path, storing results in the cache. Returns (ok, failed)"""
+        with self.busy:
+            todo = self.pending(paths)
+            if not todo:
+                return 0, 0
+            self.logger.info(f"Analysing loudness of {len(todo)} files")
+            ok = failed = 0
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._analyze_one, path): path for path in todo}
+                for future in as_completed(futures):
+                    if future.result():
+                        ok += 1
+                    else:
+                        failed += 1
+            self.logger.info(f"Loudness analysis done: {ok} measured, {failed} failed")
+            return ok, failed
+
+    def stop(self):
+        """Skip whatever a running analyze() has not started yet (the interpreter waits for its workers)"""
+        self.stopped.set()
+
+    def _analyze_one(self, path):
+        if self.stopped.is_set():
+            return False
+        try:
+            st = os.stat(path)
+            loudness, true_peak = analyze_loudness(path, self.ffmpeg_path)
+            self.cache.store_loudness(path, st, loudness, true_peak)
+            return True
+        except Exception as e:
+            self.logger.warning(f"Could not analyse loudness of {path}: {e}")
+            return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python loudness.py <file> [<file> ...]")
+        sys.exit(1)
+    ffmpeg = os.environ.get('FFMPEG', 'ffmpeg')
+    for path in sys.argv[1:]:
+        start = time.perf_counter()
+        loudness, true_peak = analyze_loudness(path, ffmpeg)
+        print(f"{path}: {loudness:.1f} LUFS, {true_peak:.1f} dBTP, "
+              f"gain {track_gain(loudness, true_peak):+.1f} dB ({time.perf_counter() - start:.1f}s)")
@@ -1,19 +1,13 @@
 import logging
 import signal
-import psutil
 import time
 import os
 import subprocess
-import json
 import sys
 from pathlib import Path
 from playback_watchdog import PlaybackWatchdog
-
-try:
-    import requests
-except ImportError:
-    subprocess.run([sys.executable, "-m", "pip", "install", "requests"])
-    import requests
+from config_service import get_config
+from process_registry import get_registry, PID_FILE, SCAN_INTERVAL
 
 class PlaybackManager:
     def __init__(self):
@@ -25,31 +19,54 @@ class PlaybackManager:
         self.find_obs_path()
         
         # Initialize components
-        self.watchdog = PlaybackWatchdog(timeout_seconds=10, max_skips=3)
+        watchdog = self.config.get('watchdog', {})
+        self.watchdog = PlaybackWatchdog(timeout_seconds=watchdog.get('timeout_seconds', 10),
+                                         max_skips=watchdog.get('max_skips', 3))
         self.watchdog.initialize()
+        self.config.subscribe(self._on_config_changed, ['watchdog', 'obs', 'obs_path'])
+        self.config.watch()
         
         # Setup OBS parameters
         self.obs_process = None
-        self.ws = None  # WebSocket connection
+        processes = self.config.get('processes', {})
+        self.registry = get_registry(processes.get('pid_file', PID_FILE),
+                                     processes.get('scan_interval', SCAN_INTERVAL))
         
         # Register shutdown handlers
         signal.signal(signal.SIGINT, self.handle_shutdown)
         signal.signal(signal.SIGTERM, self.handle_shutdown)
 
     def load_config(self):
-        """Load configuration file"""
+        """Use the shared configuration service"""
         try:
-            with open('config.json', 'r') as f:
-                self.config = json.load(f)
-            self.scene_name = self.config.get('scene_name', 'Scene')
-            self.profile_name = self.config.get('profile_name', 'Default')
+            self.config = get_config()
+            self._apply_obs_settings()
         except Exception as e:
             self.logger.error(f"Error loading config: {e}")
             raise
 
+    def _apply_obs_settings(self):
+        obs = self.config.get('obs', {})
+        self.scene_name = obs.get('scene_name', 'Scene')
+        self.profile_name = obs.get('profile_name', 'Default')
+
+    def _on_config_changed(self, changes, config):
+        """Apply watchdog and OBS settings live; OBS picks up scene/profile and path on its next start"""
+        if 'obs' in changes:
+            self._apply_obs_settings()
+        if 'obs_path' in changes:
+            self.find_obs_path()
+        if 'watchdog' in changes:
+            watchdog = config.get('watchdog', {})
+            self.watchdog.configure(timeout_seconds=watchdog.get('timeout_seconds', 10),
+                                    max_skips=watchdog.get('max_skips', 3))
+            self.logger.info(f"Watchdog now {self.watchdog.timeout_seconds}s timeout, "
+                             f"{self.watchdog.max_skips} max skips")
+
     def find_obs_path(self):
         """Locate OBS installation"""
         paths = [
+            *([self.config['obs_path']] if 'obs_path' in self.config else []),
             r"C:\Program Files\obs-studio\bin\64bit\obs64.exe",
             r"C:\Program Files (x86)\obs-studio\bin\64bit\obs64.exe",
             os.path.expandvars(r"%PROGRAMFILES%\obs-studio\bin\64bit\obs64.exe"),
@@ -90,6 +107,7 @@ class PlaybackManager:
                 cwd=self.obs_dir,
                 creationflags=subprocess.CREATE_NO_WINDOW
             )
+            self.registry.register('obs', self.obs_process.pid)
             
             time.sleep(5)  # Wait for OBS to start
             return self.obs_process is not None
@@ -101,15 +119,12 @@ class PlaybackManager:
     def shutdown(self):
         """Safely shutdown OBS"""
         try:
-            if self.ws:
-                try:
-                    self.ws.call(requests.StopStreaming())
-                    time.sleep(2)
-                except:
-                    pass
-                self.ws.disconnect()
-
-            if self._is_obs_running():
+            ours = self.registry.alive('obs')
+            if ours:
+                # Waits only as long as OBS takes to exit
+                self.registry.kill(ours)
+            elif self._is_obs_running():
+                # An OBS we did not start: fall back to killing it by name
                 os.system("taskkill /f /im obs64.exe")
                 time.sleep(2)
 
@@ -126,8 +141,8 @@ class PlaybackManager:
         sys.exit(0)
 
     def _is_obs_running(self):
-        """Check if OBS is running"""
-        return any('obs64.exe' in p.name().lower() for p in psutil.process_iter(['name'], exclude_access_denied=True))
+        """Check if OBS is running: our own OBS by PID, any other by a rate-limited scan"""
+        return self.registry.is_running('obs') or bool(self.registry.scan(['obs64.exe']))
 
     def process_cmd(self):
         try:
@@ -173,14 +188,13 @@ class PlaybackManager:
         while True:
             try:
                 # ...existing code...
-                watchdog_status = self.watchdog.check_status()
+                # Sleeps until the next watchdog deadline or timestamp update
+                watchdog_status = self.watchdog.wait_for_check()
                 if not watchdog_status:
                     self.logger.warning("Watchdog detected playback issue")
                     self.stop()
                     self.reset_playback()
                     self.watchdog.reset_timestamps()
-                # Check status more frequently
-                time.sleep(0.1)
             except Exception as e:
                 self.logger.error(f"Error in main loop: {e}")
                 time.sleep(1)  # Prevent rapid error loops
@@ -0,0 +1,235 @@
+import json
+import logging
+import os
+from collections import deque
+import sqlite3
+import subprocess
+import threading
+import time
+
+import metrics
+
+METADATA_CACHE_FILE = "metadata.db"  # Not the library index's file: its scan holds one long write transaction
+LEGACY_CACHE_FILE = "library.db"     # Where older versions kept the metadata table
+STOP_TIMEOUT = 5                     # Longest wait at shutdown for a probe that is already running
+
+PROBE_SECONDS = metrics.histogram('dj_ffprobe_seconds', "Time spent in one ffprobe call")
+PROBE_FAILURES = metrics.counter('dj_ffprobe_failures_total', "ffprobe calls that failed")
+
+
+def probe_file(path, ffprobe_path='ffprobe'):
+    """Read duration, tags, sample rate and channel count with a single ffprobe call"""
+    started = time.perf_counter()
+    result = subprocess.run([
+        ffprobe_path,
+        '-v', 'error',
+        '-select_streams', 'a:0',
+        '-show_entries', 'format=duration:format_tags:stream=sample_rate,channels',
+        '-of', 'json',
+        path
+    ], capture_output=True, text=True,
+        creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0))
+    PROBE_SECONDS.observe(time.perf_counter() - started)
+    if result.returncode != 0:
+        PROBE_FAILURES.inc()
+        raise RuntimeError(result.stderr.strip() or f"ffprobe exited with {result.returncode}")
+
+    data = json.loads(result.stdout or '{}')
+    fmt = data.get('format', {})
+    stream = (data.get('streams') or [{}])[0]
+    return {
+        'duration': float(fmt.get('duration', 0) or 0),
+        'sample_rate': int(stream.get('sample_rate', 0) or 0),
+        'channels': int(stream.get('channels', 0) or 0),
+        'tags': {k.lower(): v for k, v in fmt.get('tags', {}).items()},
+    }
+
+
+class MetadataCache:
+    """Track metadata keyed by (path, size, mtime).
+
+    All entries are held in memory so lookups at track change are a dict hit.
+    Missing or stale entries are probed on a background thread, never inline.
+    """
+    def __init__(self, db_path=METADATA_CACHE_FILE, ffprobe_path='ffprobe'):
+        self.logger = logging.getLogger('MetadataCache')
+        self.ffprobe_path = ffprobe_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duration REAL,
+                sample_rate INTEGER,
+                channels INTEGER,
+                tags TEXT,
+                probed_at REAL,
+                loudness REAL,
+                true_peak REAL
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(metadata)")}
+        for column in ('loudness', 'true_peak'):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE metadata ADD COLUMN {column} REAL")
+        self.conn.commit()
+        self._import_legacy(db_path)
+
+        self.entries = {}
+        for (path, size, mtime_ns, duration, sample_rate, channels, tags,
+             loudness, true_peak) in self.conn.execute(
+                "SELECT path, size, mtime_ns, duration, sample_rate, channels, tags, "
+                "loudness, true_peak FROM metadata"):
+            self.entries[path] = {
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'duration': duration or 0,
+                'sample_rate': sample_rate or 0,
+                'channels': channels or 0,
+                'tags': json.loads(tags or '{}'),
+                'loudness': loudness,
+                'true_peak': true_peak,
+            }
+
+        self.pending = deque()
+        self.pending_ready = threading.Condition(self.lock)
+        self.queued = set()
+        self.callbacks = {}
+        self.stopped = False
+        self.worker = threading.Thread(target=self._refresh_worker, daemon=True)
+        self.worker.start()
+
+    def _import_legacy(self, db_path):
+        """Copy the entries of a metadata table left in LEGACY_CACHE_FILE into a new, empty cache"""
+        if (db_path == ':memory:' or not os.path.exists(LEGACY_CACHE_FILE)
+                or os.path.abspath(db_path) == os.path.abspath(LEGACY_CACHE_FILE)
+                or self.conn.execute("SELECT 1 FROM metadata LIMIT 1").fetchone()):
+            return
+        try:
+            self.conn.execute("ATTACH DATABASE ? AS legacy", (LEGACY_CACHE_FILE,))
+            try:
+                columns = [row[1] for row in self.conn.execute("PRAGMA legacy.table_info(metadata)")]
+                if columns:
+                    names = ", ".join(columns)
+                    self.conn.execute(f"INSERT OR IGNORE INTO metadata ({names}) "
+                                      f"SELECT {names} FROM legacy.metadata")
+                    self.conn.commit()
+                    self.logger.info(f"Imported the metadata cache from {LEGACY_CACHE_FILE}")
+            finally:
+                self.conn.execute("DETACH DATABASE legacy")
+        except sqlite3.Error as e:
+            self.logger.warning(f"Could not import the metadata cache from {LEGACY_CACHE_FILE}: {e}")
+
+    def lookup(self, path):
+        """Return the cached entry for a path (possibly stale) or None"""
+        return self.entries.get(path)
+
+    def refresh(self, path, callback=None):
+        """Queue a background check of one file, calling back when it is done.
+
+        Requests with a callback come from a track change and jump the queue.
+        """
+        with self.lock:
+            if callback:
+                self.callbacks.setdefault(path, []).append(callback)
+            if path in self.queued:
+                if callback:
+                    self.pending.remove(path)
+                    self.pending.appendleft(path)
+                return
+            self.queued.add(path)
+            if callback:
+                self.pending.appendleft(path)
+            else:
+                self.pending.append(path)
+            self.pending_ready.notify()
+
+    def is_fresh(self, path, st=None):
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+        return entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+
+    def store(self, path, st, info):
+        """Record a probe result for a file with the given stat result"""
+        return self.store_many([(path, st, info)])[0]
+
+    def store_many(self, results):
+        """Record (path, stat, info) probe results in one transaction; returns their entries"""
+        entries = [{
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'duration': info.get('duration', 0),
+            'sample_rate': info.get('sample_rate', 0),
+            'channels': info.get('channels', 0),
+            'tags': info.get('tags', {}),
+            'loudness': None,
+            'true_peak': None,
+        } for _, st, info in results]
+        probed_at = time.time()
+        with self.lock:
+            for (path, _, _), entry in zip(results, entries):
+                self.entries[path] = entry
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata "
+                "(path, size, mtime_ns, duration, sample_rate, channels, tags, probed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(path, entry['size'], entry['mtime_ns'], entry['duration'], entry['sample_rate'],
+                  entry['channels'], json.dumps(entry['tags']), probed_at)
+                 for (path, _, _), entry in zip(results, entries)])
+            self.conn.commit()
+        return entries
+
+    def store_loudness(self, path, st, loudness, true_peak):
+        """Attach a loudness measurement to the entry it was taken from"""
+        with self.lock:
+            entry = self.entries.get(path)
+            if not entry or entry['size'] != st.st_size or entry['mtime_ns'] != st.st_mtime_ns:
+                return None  # File changed since; it will be re-probed and re-measured
+            entry['loudness'] = loudness
+            entry['true_peak'] = true_peak
+            self.conn.execute(
+                "UPDATE metadata SET loudness = ?, true_peak = ? WHERE path = ?",
+                (loudness, true_peak, path))
+            self.conn.commit()
+        return entry
+
+    def stop(self):
+        """Drop queued refreshes and wait for the running one, so no ffprobe outlives the DJ"""
+        with self.lock:
+            self.stopped = True
+            self.pending.clear()
+            self.queued.clear()
+            self.pending_ready.notify_all()
+        self.worker.join(STOP_TIMEOUT)
+
+    def _refresh_worker(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopped:
+                    self.pending_ready.wait()
+                if self.stopped:
+                    return
+                path = self.pending.popleft()
+                self.queued.discard(path)
+                callbacks = self.callbacks.pop(path, [])
+            try:
+                st = os.stat(path)
+                entry = self.entries.get(path)
+                if not self.is_fresh(path, st):
+                    entry = self.store(path, st, probe_file(path, self.ffprobe_path))
+            except Exception as e:
+                self.logger.warning(f"Could not probe {path}: {e}")
+                continue
+            for callback in callbacks:
+                try:
+                    callback(path, entry)
+                except Exception as e:
+                    self.logger.error(f"Metadata callback failed: {e}")
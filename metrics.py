@@ -0,0 +1,307 @@
+"""Counters and histograms for the DJ's hot paths.
+
+Modules register their metrics once at import time and update them inline;
+an update is a dict lookup and a short locked addition, cheap enough to
+leave on in production. The shared registry renders the Prometheus text
+format (GET /metrics) and a JSON snapshot (GET /metrics.json and the
+periodic metrics.json dump). `python metrics.py [iterations]` measures the
+cost of an update.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+METRICS_FILE = "metrics.json"
+METRICS_PORT = 9108
+DUMP_INTERVAL = 60
+RATE_WINDOW_SECONDS = 60  # Snapshot rates are taken over roughly this much recent time
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, from sub-millisecond event handling up to a restart that took a minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _CounterValue:
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _HistogramValue:
+    __slots__ = ('lock', 'buckets', 'counts', 'sum', 'count', 'max')
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    @contextmanager
+    def time(self):
+        """Observe how long the with-block took"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def read(self):
+        """(cumulative bucket counts, sum, count, max), taken consistently"""
+        with self.lock:
+            counts, total, count, peak = list(self.counts), self.sum, self.count, self.max
+        cumulative, running = [], 0
+        for n in counts:
+            running += n
+            cumulative.append(running)
+        return cumulative, total, count, peak
+
+
+class _Metric:
+    """A named metric with fixed label names; each label combination has its own value"""
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_value()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(tuple(str(v) for v in values), self._new_value())
+        return child
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def _label_text(self, values, extra=''):
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _items(self):
+        with self.lock:
+            return sorted(self.children.items())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def value(self, *labels):
+        child = self.children.get(labels)
+        return child.value if child else 0
+
+    def render(self):
+        return [f"{self.name}{self._label_text(values)} {child.value}" for values, child in self._items()]
+
+    def snapshot(self):
+        return {','.join(values) or 'total': child.value for values, child in self._items()}
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        return self.children[()].time()
+
+    def render(self):
+        lines = []
+        for values, child in self._items():
+            cumulative, total, count, _ = child.read()
+            bounds = [f'le="{bound:g}"' for bound in self.buckets] + ['le="+Inf"']
+            for le, n in zip(bounds, cumulative):
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {n}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {total:.6f}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {count}")
+        return lines
+
+    def snapshot(self):
+        result = {}
+        for values, child in self._items():
+            cumulative, total, count, peak = child.read()
+            result[','.join(values) or 'total'] = {
+                'count': count,
+                'sum': round(total, 6),
+                'mean': round(total / count, 6) if count else 0,
+                'max': round(peak, 6),
+                'p50': _quantile(self.buckets, cumulative, 0.5),
+                'p95': _quantile(self.buckets, cumulative, 0.95),
+                'p99': _quantile(self.buckets, cumulative, 0.99),
+            }
+        return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _quantile(buckets, cumulative, q):
+    """Upper bound of the bucket holding the q-quantile (None past the last bucket)"""
+    if not cumulative[-1]:
+        return None
+    rank = q * cumulative[-1]
+    for bound, n in zip(buckets, cumulative):
+        if n >= rank:
+            return bound
+    return None
+
+
+class MetricsRegistry:
+    """Every metric of the process, exportable as Prometheus text or a JSON snapshot"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.started = time.monotonic()
+        self.samples = deque()  # (time, {counter: {labels: value}}) for snapshot rates
+
+    def _register(self, cls, name, help, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered differently")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def _sorted(self):
+        with self.lock:
+            return sorted(self.metrics.values(), key=lambda metric: metric.name)
+
+    def render(self):
+        """The Prometheus text exposition format (version 0.0.4)"""
+        lines = ["# HELP dj_uptime_seconds Seconds since the DJ started",
+                 "# TYPE dj_uptime_seconds gauge",
+                 f"dj_uptime_seconds {time.monotonic() - self.started:.3f}"]
+        for metric in self._sorted():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Plain-dict view of every metric; counters also get a recent per-second rate"""
+        now = time.monotonic()
+        counters, histograms = {}, {}
+        for metric in self._sorted():
+            if metric.kind == 'counter':
+                counters[metric.name] = metric.snapshot()
+            else:
+                histograms[metric.name] = metric.snapshot()
+        with self.lock:
+            # Keep one sample at least RATE_WINDOW_SECONDS old as the baseline
+            while len(self.samples) > 1 and now - self.samples[1][0] >= RATE_WINDOW_SECONDS:
+                self.samples.popleft()
+            since, baseline = self.samples[0] if self.samples else (self.started, {})
+            self.samples.append((now, counters))
+        elapsed = max(now - since, 1e-9)
+        rates = {name: {labels: round((value - baseline.get(name, {}).get(labels, 0)) / elapsed, 3)
+                        for labels, value in values.items()}
+                 for name, values in counters.items()}
+        return {'time': time.time(), 'uptime': round(now - self.started, 3),
+                'rate_window': round(elapsed, 3), 'counters': counters, 'rates': rates,
+                'histograms': histograms}
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, help, labelnames=()):
+    """Register (or fetch) a counter in the shared registry"""
+    return REGISTRY.counter(name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Register (or fetch) a histogram in the shared registry"""
+    return REGISTRY.histogram(name, help, labelnames, buckets)
+
+
+def _benchmark(iterations):
+    """Time counter and histogram updates, alone and with four threads contending"""
+    registry = MetricsRegistry()
+    hits = registry.counter('bench_total', 'Benchmark counter')
+    labelled = registry.counter('bench_labelled_total', 'Benchmark counter', ('kind',))
+    latency = registry.histogram('bench_seconds', 'Benchmark histogram')
+
+    def measure(label, update):
+        start = time.perf_counter()
+        for i in range(iterations):
+            update(i)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<28} {elapsed / iterations * 1e9:7.0f} ns per update")
+
+    measure("(empty loop)", lambda i: None)
+    measure("counter.inc()", lambda i: hits.inc())
+    measure("counter.labels(...).inc()", lambda i: labelled.labels('crash').inc())
+    measure("histogram.observe()", lambda i: latency.observe(i % 100 / 1000))
+
+    def timed(i):
+        with latency.time():
+            pass
+    measure("with histogram.time()", timed)
+
+    threads = [threading.Thread(target=lambda: [hits.inc() for _ in range(iterations)]) for _ in range(4)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{'counter.inc(), 4 threads':<28} {elapsed / (4 * iterations) * 1e9:7.0f} ns per update")
+    assert hits.value() == 5 * iterations
+
+    start = time.perf_counter()
+    text = registry.render()
+    print(f"render(): {(time.perf_counter() - start) * 1000:.2f} ms for {len(text)} bytes")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
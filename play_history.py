@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from playlist_source import iterate_order
+
+HISTORY_FILE = "played_songs.log"
+RECENT_HOURS = 24    # Plays older than this no longer push a track back
+RECENCY_WEIGHT = 1.0  # 1.0 moves a track played just now from anywhere to the end
+COMPACT_MIN_LINES = 1000
+
+
+class PlayHistory:
+    """Append-only log of plays with an in-memory index of path -> (last played, count).
+
+    Each play appends one `timestamp<TAB>count<TAB>path` line. Once the log
+    holds twice as many lines as distinct tracks, it is rewritten with one
+    line per track, so its size is bounded by the library rather than uptime.
+    The play before the last is kept too while it is recent (as a count-0
+    line), so a shuffle built before a replay can be rebuilt exactly.
+    """
+    def __init__(self, path=HISTORY_FILE):
+        self.logger = logging.getLogger('PlayHistory')
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}  # path -> [last_played, count, previous_played]
+        self.lines = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self.lines += 1
+                    try:
+                        played, count, track = line.rstrip('\n').split('\t', 2)
+                        self._add(track, float(played), int(count))
+                    except ValueError:
+                        continue  # Torn write from a crash, or a foreign line
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.error(f"Could not read play history: {e}")
+
+    def _add(self, track, played, count):
+        entry = self.entries.get(track)
+        if entry is None:
+            self.entries[track] = [played, count, None]
+            return
+        if played > entry[0]:
+            entry[0], entry[2] = played, entry[0]
+        elif entry[2] is None or played > entry[2]:
+            entry[2] = played
+        entry[1] += count
+
+    def record(self, track, played=None):
+        # Whole seconds, as in the file, so a reloaded history compares the same
+        played = int(time.time() if played is None else played)
+        with self.lock:
+            self._add(track, played, 1)
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(f"{played:.0f}\t1\t{track}\n")
+                self.lines += 1
+            except OSError as e:
+                self.logger.error(f"Could not append to play history: {e}")
+            if self.lines > max(COMPACT_MIN_LINES, 2 * len(self.entries)):
+                self._compact()
+
+    def last_played(self, track):
+        entry = self.entries.get(track)
+        return entry[0] if entry else None
+
+    def play_count(self, track):
+        entry = self.entries.get(track)
+        return entry[1] if entry else 0
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        recent = time.time() - RECENT_HOURS * 3600
+        lines = 0
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for track, (played, count, previous) in self.entries.items():
+                    if previous is not None and previous > recent:
+                        f.write(f"{previous:.0f}\t0\t{track}\n")
+                        lines += 1
+                    f.write(f"{played:.0f}\t{count}\t{track}\n")
+                    lines += 1
+            os.replace(tmp_path, self.path)
+            self.logger.info(f"Compacted play history from {self.lines} to {lines} lines")
+            self.lines = lines
+        except OSError as e:
+            self.logger.error(f"Could not compact play history: {e}")
+
+    def recency_order(self, tracks, order, cutoff, upcoming=(), recent_hours=RECENT_HOURS,
+                      weight=RECENCY_WEIGHT):
+        """Reorder a shuffle so recently played tracks move towards its end.
+
+        Each track keeps its shuffled rank (as a fraction of the playlist)
+        plus a penalty that fades linearly from `weight` for a play at
+        `cutoff` to nothing after recent_hours. Only plays before cutoff count,
+        so the same cutoff always gives the same order. Indices in `upcoming`
+        are due to play before this order starts and get the full penalty.
+        `tracks` must be sorted. Only the penalized tracks are keyed; the
+        result is a RecencyOrder view over `order`, not a new list.
+        """
+        count = len(tracks)
+        horizon = recent_hours * 3600
+        penalties = dict.fromkeys(upcoming, weight) if weight else {}
+        if weight:
+            with self.lock:
+                entries = list(self.entries.items())
+            for track, (last, _, previous) in entries:
+                played = last if last < cutoff else previous
+                if played is None or cutoff - played >= horizon:
+                    continue
+                index = bisect_left(tracks, track)
+                if index < count and tracks[index] == track and index not in penalties:
+                    penalties[index] = weight * (1 - (cutoff - played) / horizon)
+        return RecencyOrder(order, count, penalties)
+
+
+class RecencyOrder:
+    """A shuffle with a few tracks pushed back, readable by position without sorting it all.
+
+    Tracks without a penalty keep their relative order, so the result is a
+    merge of the underlying order (minus the moved tracks) with the moved
+    ones sorted by their new key. Looking up a position costs a few bisects
+    over the moved set, whatever the size of the library.
+    """
+    def __init__(self, order, count, penalties):
+        self.order = order
+        self.count = count
+        ranks = _ranks(order, penalties)
+        moved = sorted((rank / count + penalties[index], rank, index) for index, rank in ranks.items())
+        self.moved_keys = [key for key, _, _ in moved]
+        self.moved = [index for _, _, index in moved]
+        self.moved_ranks = sorted(rank for _, rank, _ in moved)
+        self.moved_rank_set = set(self.moved_ranks)
+        self.kept = count - len(moved)
+
+    def __len__(self):
+        return self.count
+
+    def _kept_rank(self, k):
+        """Rank in the underlying order of the k-th track that was not moved"""
+        lo, hi = k, k + len(self.moved_ranks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mid + 1 - bisect_right(self.moved_ranks, mid) > k:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _moved_before(self, position):
+        """How many moved tracks come before position"""
+        lo, hi = max(0, position - self.kept), min(position, len(self.moved))
+        while lo < hi:
+            j = (lo + hi) // 2
+            if self.moved_keys[j] < self._kept_rank(position - j - 1) / self.count:
+                lo = j + 1
+            else:
+                hi = j
+        return lo
+
+    def __getitem__(self, position):
+        return next(self.iter_from(position))
+
+    def iter_from(self, start):
+        """Indices from position start on; after the first, each costs O(1)"""
+        if not self.moved:
+            yield from iterate_order(self.order, start)
+            return
+        j = self._moved_before(start)
+        k = start - j
+        rank = self._kept_rank(k) if k < self.kept else None
+        for _ in range(start, self.count):
+            if j < len(self.moved) and (rank is None or self.moved_keys[j] < rank / self.count):
+                yield self.moved[j]
+                j += 1
+                continue
+            yield self.order[rank]
+            k += 1
+            if k >= self.kept:
+                rank = None
+                continue
+            rank += 1
+            while rank in self.moved_rank_set:
+                rank += 1
+
+
+def _ranks(order, indices):
+    """Position of each of indices in order"""
+    if hasattr(order, 'rank_of'):
+        return {index: order.rank_of(index) for index in indices}
+    # A materialised order (e.g. the smart shuffle's list): one pass finds them all
+    return {index: rank for rank, index in enumerate(order) if index in indices}
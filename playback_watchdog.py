@@ -1,12 +1,23 @@
 import logging
+import threading
 import time
-from datetime import datetime, timedelta
+
+import metrics
+
+WATCHDOG_TRIPS = metrics.counter('dj_watchdog_trips_total', "Failed playback health checks", ('reason',))
 
 class PlaybackWatchdog:
+    """Playback health checks driven by deadlines on the monotonic clock.
+
+    All timestamps come from time.monotonic(), so NTP corrections and DST
+    changes cannot trip (or hide) a timeout. Instead of being polled, callers
+    block in wait_for_check(), which sleeps until the earliest deadline or
+    until one of the timestamps is updated.
+    """
     def __init__(self, timeout_seconds=10, max_skips=3):
         self.timeout_seconds = timeout_seconds
-        self.last_cmd_update = datetime.now()  # Initialize with current time
-        self.last_now_playing_update = datetime.now()  # Initialize with current time
+        self.last_cmd_update = time.monotonic()  # Initialize with current time
+        self.last_now_playing_update = time.monotonic()  # Initialize with current time
         self.is_playing = False
         self.is_initialized = False
         self.logger = logging.getLogger('PlaybackWatchdog')
@@ -15,65 +26,108 @@ class PlaybackWatchdog:
         self.skip_count = 0
         self.max_skips = max_skips
         self.expected_end_time = None
-        
+        self.changed = threading.Condition()
+
     def initialize(self):
         self.is_initialized = True
         self.reset_timestamps()
         self.logger.info("Watchdog initialized")
 
+    def configure(self, timeout_seconds=None, max_skips=None):
+        """Change limits while running; waiters recompute their deadline"""
+        if timeout_seconds is not None:
+            self.timeout_seconds = timeout_seconds
+        if max_skips is not None:
+            self.max_skips = max_skips
+        self._notify()
+
+    def _notify(self):
+        with self.changed:
+            self.changed.notify_all()
+
     def update_cmd_timestamp(self):
         if not self.is_initialized:
             self.initialize()
-        self.last_cmd_update = datetime.now()
-        self.logger.debug(f"CMD timestamp updated: {self.last_cmd_update}")
+        self.last_cmd_update = time.monotonic()
+        self.logger.debug(f"CMD timestamp updated: {self.last_cmd_update:.3f}")
+        self._notify()
 
     def update_now_playing_timestamp(self):
         if not self.is_initialized:
             self.initialize()
-        self.last_now_playing_update = datetime.now()
-        self.logger.debug(f"Now Playing timestamp updated: {self.last_now_playing_update}")
+        self.last_now_playing_update = time.monotonic()
+        self.logger.debug(f"Now Playing timestamp updated: {self.last_now_playing_update:.3f}")
+        self._notify()
 
     def set_playing_status(self, is_playing):
         self.is_playing = is_playing
+        self._notify()
 
     def update_song(self, song_info, duration_seconds):
         if self.current_song != song_info:
             if self.current_song is not None:
                 self._check_premature_skip()
-            
+
             self.current_song = song_info
-            self.song_start_time = datetime.now()
-            self.expected_end_time = self.song_start_time + \
-                timedelta(seconds=duration_seconds)
+            self.song_start_time = time.monotonic()
+            self.expected_end_time = self.song_start_time + duration_seconds if duration_seconds else None
             self.logger.info(f"New song: {song_info}, Duration: {duration_seconds}s")
+            self._notify()
 
     def _check_premature_skip(self):
-        if self.expected_end_time and datetime.now() < self.expected_end_time:
-            time_remaining = (self.expected_end_time - datetime.now()).total_seconds()
+        now = time.monotonic()
+        if self.expected_end_time and now < self.expected_end_time:
+            time_remaining = self.expected_end_time - now
             if time_remaining > 5:  # Only count as skip if more than 5 seconds remaining
                 self.skip_count += 1
                 self.logger.warning(f"Premature skip detected! {time_remaining:.1f}s remaining. Skip count: {self.skip_count}")
         else:
             self.skip_count = 0
 
+    def next_deadline(self):
+        """Monotonic time of the next moment check_status() could change its answer, or None"""
+        if not self.is_playing:
+            return None
+        deadlines = []
+        if self.last_cmd_update and self.last_now_playing_update:
+            deadlines.append(self.last_cmd_update + self.timeout_seconds)
+            deadlines.append(self.last_now_playing_update + self.timeout_seconds)
+        if self.expected_end_time and self.expected_end_time + self.timeout_seconds > time.monotonic():
+            # Only a wake-up: durations are estimates, so running past one is not a failure
+            deadlines.append(self.expected_end_time + self.timeout_seconds)
+        return min(deadlines) if deadlines else None
+
+    def wait_for_check(self, max_wait=None):
+        """Sleep until the next deadline or an update, then return check_status()"""
+        with self.changed:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if max_wait is not None:
+                timeout = max_wait if timeout is None else min(timeout, max_wait)
+            if timeout is None or timeout > 0:
+                self.changed.wait(timeout)
+        return self.check_status()
+
     def check_status(self):
         if not self.is_playing:
             return True
 
-        now = datetime.now()
-        
+        now = time.monotonic()
+
         # Check for too many consecutive skips
         if self.skip_count >= self.max_skips:
             self.logger.error(f"Too many consecutive skips ({self.skip_count})!")
+            WATCHDOG_TRIPS.labels('skips').inc()
             return False
 
         # Check for timeouts
         if self.last_cmd_update and self.last_now_playing_update:
-            cmd_diff = (now - self.last_cmd_update).total_seconds()
-            now_playing_diff = (now - self.last_now_playing_update).total_seconds()
+            cmd_diff = now - self.last_cmd_update
+            now_playing_diff = now - self.last_now_playing_update
 
             if cmd_diff > self.timeout_seconds or now_playing_diff > self.timeout_seconds:
                 self.logger.warning(f"Watchdog timeout! CMD: {cmd_diff:.1f}s, Now Playing: {now_playing_diff:.1f}s")
+                WATCHDOG_TRIPS.labels('timeout').inc()
                 return False
 
         return True
@@ -86,3 +140,4 @@ class PlaybackWatchdog:
         self.song_start_time = None
         self.skip_count = 0
         self.expected_end_time = None
+        self._notify()
@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from itertools import islice
+
+PLAYLIST_STATE_FILE = "playlist_state.json"
+COMMITTED_SUFFIX = ".committed"  # Sidecar listing the tracks handed out before a library change
+FEISTEL_ROUNDS = 4
+
+
+def _round_function(value, key):
+    """Cheap 32-bit integer mixer used as the Feistel round function"""
+    x = (value * 0x9E3779B1 + key) & 0xFFFFFFFF
+    x ^= x >> 15
+    x = (x * 0x85EBCA6B) & 0xFFFFFFFF
+    x ^= x >> 13
+    return x
+
+
+class SeededPermutation:
+    """Random-access pseudo-random permutation of range(size).
+
+    A small Feistel network over the next even power of two, with cycle-walking
+    to stay inside range(size), so position -> item costs O(1) and nothing of
+    size n is ever built.
+    """
+    def __init__(self, size, seed):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(32) for _ in range(FEISTEL_ROUNDS)]
+
+    def _encrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (_round_function(right, key) & self.mask)
+        return (left << self.half) | right
+
+    def _decrypt(self, value):
+        left, right = value >> self.half, value & self.mask
+        for key in reversed(self.keys):
+            left, right = right ^ (_round_function(left, key) & self.mask), left
+        return (left << self.half) | right
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, position):
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def rank_of(self, value):
+        """Position of value, the inverse of indexing, also in O(1)"""
+        position = self._decrypt(value)
+        while position >= self.size:
+            position = self._decrypt(position)
+        return position
+
+
+def iterate_order(order, start=0):
+    """Indices of an order from position start on, through iter_from when it has one"""
+    if hasattr(order, 'iter_from'):
+        return order.iter_from(start)
+    return (order[position] for position in range(start, len(order)))
+
+
+def _index_of(tracks, track):
+    """Position of track in the sorted tracks list, or None"""
+    index = bisect_left(tracks, track)
+    return index if index < len(tracks) and tracks[index] == track else None
+
+
+class CommittedFirst:
+    """The current cycle's order after the library changed mid-cycle.
+
+    Tracks already handed out come first, in the order they went out; the
+    new shuffle follows with those tracks left out. New tracks therefore
+    land somewhere in the unplayed part and removed ones simply drop out,
+    so each track still plays once per cycle. The remainder is filtered
+    lazily, as far as it is read.
+    """
+    def __init__(self, tracks, order, committed):
+        self.count = len(tracks)
+        self.prefix = [index for index in (_index_of(tracks, track) for track in committed)
+                       if index is not None]
+        skip = set(self.prefix)
+        self.rest = (index for index in iterate_order(order) if index not in skip)
+        self.cache = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        return next(self.iter_from(position))
+
+    def iter_from(self, start):
+        for position in range(start, self.count):
+            if position < len(self.prefix):
+                yield self.prefix[position]
+                continue
+            k = position - len(self.prefix)
+            if k >= len(self.cache):
+                with self.lock:
+                    while len(self.cache) <= k:
+                        self.cache.append(next(self.rest))
+            yield self.cache[k]
+
+
+class PlaylistSource:
+    """Lazy shuffled playlist that remembers where it is across restarts.
+
+    Tracks come from a seeded permutation of the library, so only the seed and
+    the position need to be stored. `index` counts songs actually started in
+    the current cycle; `cursor` runs ahead of it for tracks handed out but not
+    started yet (e.g. the engine's lookahead). Positions past the end of the
+    cycle read from the next cycle's seed, which is chosen up front.
+
+    `order(tracks, seed)` may replace the default permutation with any
+    deterministic, indexable ordering (e.g. the smart shuffle). With a play
+    history, each cycle's order is then pushed around by recency as of the
+    moment the cycle was first built; that moment is saved with the seed so
+    a restart rebuilds the same order.
+
+    When the library changes mid-cycle, the tracks handed out so far are
+    kept as the start of the cycle (see CommittedFirst) and saved next to
+    the state file, so the once-per-cycle guarantee survives the change and
+    a restart.
+    """
+    def __init__(self, state_file=PLAYLIST_STATE_FILE, order=None, history=None,
+                 recency=None):
+        self.logger = logging.getLogger('PlaylistSource')
+        self.state_file = state_file
+        self.order = order
+        self.history = history
+        self.recency = recency or {}
+        self.cutoff = None       # History cutoff of the current cycle's order
+        self.next_cutoff = None  # ...and of the next cycle's
+        self.next_from = None    # Position in this cycle when the next one's order was built
+        self.committed = None    # Tracks handed out this cycle before the library last changed
+        self.tracks = []
+        self.seed = None
+        self.next_seed = None
+        self.index = 0
+        self.cursor = 0
+        self.permutations = {}
+        # next() runs on the decoding thread, advance() on the output thread and
+        # set_tracks() on the library watcher's
+        self.lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self.seed = state['seed']
+            self.next_seed = state['next_seed']
+            self.index = self.cursor = state['index']
+            self.cutoff = state.get('cutoff')
+            self.next_cutoff = state.get('next_cutoff')
+            self.next_from = state.get('next_from')
+            if state.get('committed'):
+                self.committed = self._load_committed()
+            self.logger.info(f"Resuming playlist at position {self.index} (seed {self.seed})")
+        except (OSError, ValueError, KeyError):
+            self.seed = random.getrandbits(64)
+            self.next_seed = random.getrandbits(64)
+
+    def _load_committed(self):
+        try:
+            with open(self.state_file + COMMITTED_SUFFIX, 'r', encoding='utf-8') as f:
+                return [line.rstrip('\n') for line in f]
+        except OSError as e:
+            self.logger.error(f"Could not read the tracks played before the library changed: {e}")
+            return None
+
+    def _save_committed(self):
+        path = self.state_file + COMMITTED_SUFFIX
+        try:
+            if self.committed is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(f"{track}\n" for track in self.committed)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            self.logger.error(f"Could not save the tracks played before the library changed: {e}")
+
+    def save(self):
+        state = {'seed': self.seed, 'next_seed': self.next_seed, 'index': self.index,
+                 'cutoff': self.cutoff, 'next_cutoff': self.next_cutoff, 'next_from': self.next_from,
+                 'committed': self.committed is not None}
+        tmp_path = self.state_file + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            self.logger.error(f"Could not save playlist position: {e}")
+
+    def set_tracks(self, tracks):
+        """Use a new library listing (sorted, so the permutation is stable between runs).
+
+        If the library changed while a cycle was under way, the tracks handed
+        out so far stay at its start and only the unplayed remainder is
+        reshuffled with the new listing.
+        """
+        with self.lock:
+            if tracks == self.tracks:
+                return
+            if self.tracks and self.cursor:
+                self._commit_handed_out(tracks)
+            self.permutations = {}
+            self.tracks = tracks
+            if self.index > len(tracks):
+                self.index = self.cursor = 0
+            self.cursor = max(self.cursor, self.index)
+
+    def _commit_handed_out(self, tracks):
+        """Remember this cycle's tracks up to the cursor, minus any the new listing dropped"""
+        count = len(self.tracks)
+        index, cursor = min(self.index, count), min(self.cursor, count)
+        order = self._permutation(self.seed)
+        handed = [self.tracks[i] for i in islice(iterate_order(order), cursor)]
+        started = [track for track in handed[:index] if _index_of(tracks, track) is not None]
+        waiting = [track for track in handed[index:] if _index_of(tracks, track) is not None]
+        self.committed = started + waiting
+        # Anything handed out from the next cycle is dealt again from its new order
+        self.index, self.cursor = len(started), len(self.committed)
+        self._save_committed()
+        self.save()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def _permutation(self, seed):
+        permutation = self.permutations.get(seed)
+        if permutation is None:
+            if self.order:
+                permutation = self.order(self.tracks, seed)
+            else:
+                permutation = SeededPermutation(len(self.tracks), seed)
+            if self.history:
+                cutoff, upcoming = self._cutoff(seed)
+                permutation = self.history.recency_order(
+                    self.tracks, permutation, cutoff, upcoming=upcoming, **self.recency)
+            if seed == self.seed and self.committed:
+                permutation = CommittedFirst(self.tracks, permutation, self.committed)
+            self.permutations[seed] = permutation
+        return permutation
+
+    def _cutoff(self, seed):
+        """History cutoff for a seed's order, fixed the first time the order is built.
+
+        The next cycle is built before this one ends, so the rest of this
+        cycle is passed along as about to be played.
+        """
+        if seed == self.seed:
+            if self.cutoff is None:
+                self.cutoff = int(time.time())
+                self.save()
+            return self.cutoff, ()
+        if self.next_cutoff is None:
+            self.next_cutoff = int(time.time())
+            self.next_from = self.index
+            self.save()
+        current = self._permutation(self.seed)
+        return self.next_cutoff, set(iterate_order(current, min(self.next_from, len(self.tracks))))
+
+    def track_at(self, position):
+        """Track at a position of the current cycle (positions past the end spill into the next)"""
+        count = len(self.tracks)
+        if position < count:
+            return self.tracks[self._permutation(self.seed)[position]]
+        return self.tracks[self._permutation(self.next_seed)[position - count]]
+
+    def peek(self, count):
+        """The next count tracks after the last one started, without consuming them"""
+        with self.lock:
+            count = min(count, len(self.tracks))
+            return list(islice(self._tracks_from(self.index), count))
+
+    def queue(self, count):
+        """Like peek, but the tracks count as handed out (for a playlist written ahead of playback)"""
+        with self.lock:
+            window = self.peek(count)
+            self.cursor = max(self.cursor, self.index + len(window))
+            return window
+
+    def _tracks_from(self, position):
+        """Tracks in play order from a position of the current cycle on, into the next cycle"""
+        count = len(self.tracks)
+        if position < count:
+            for index in iterate_order(self._permutation(self.seed), position):
+                yield self.tracks[index]
+        for index in iterate_order(self._permutation(self.next_seed), max(0, position - count)):
+            yield self.tracks[index]
+
+    def next(self):
+        """Hand out the next track not yet handed out, or None if the library is empty"""
+        with self.lock:
+            if not self.tracks:
+                return None
+            if self.cursor - self.index >= len(self.tracks):
+                # Never run more than one full cycle ahead of playback
+                self.cursor = self.index
+            track = self.track_at(self.cursor)
+            self.cursor += 1
+            return track
+
+    def advance(self, track=None):
+        """Record that the next song has started playing and persist the position.
+
+        A track that left the library after it was handed out does not count
+        toward the cycle, as it was already dropped from the order.
+        """
+        with self.lock:
+            if track is not None and _index_of(self.tracks, track) is None:
+                return
+            if self.index >= len(self.tracks):
+                self._next_cycle()
+            self.index += 1
+            self.cursor = max(self.cursor, self.index)
+            self.save()
+
+    def reshuffle(self):
+        """Throw away the current order and start a fresh shuffle from the top"""
+        with self.lock:
+            self.logger.info("Reshuffling playlist")
+            self.permutations = {}
+            self.seed = random.getrandbits(64)
+            self.next_seed = random.getrandbits(64)
+            self.cutoff = self.next_cutoff = self.next_from = None
+            self.committed = None
+            self._save_committed()
+            self.index = self.cursor = 0
+            self.save()
+
+    def _next_cycle(self):
+        count = len(self.tracks)
+        self.logger.info("All songs have been played, starting a new shuffle")
+        self.permutations.pop(self.seed, None)
+        self.seed = self.next_seed
+        self.next_seed = random.getrandbits(64)
+        self.cutoff, self.next_cutoff, self.next_from = self.next_cutoff, None, None
+        if self.committed is not None:
+            self.committed = None
+            self._save_committed()
+        self.index -= count
+        self.cursor -= count
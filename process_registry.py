@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import psutil
+
+from status_output import atomic_write
+
+PID_FILE = "virtual_dj.pids"
+SCAN_INTERVAL = 30.0  # Minimum seconds between two full process-table scans
+
+
+class ProcessRegistry:
+    """PIDs of the processes the DJ started, persisted in a pidfile.
+
+    Every entry records the role, the process name, its create time and the
+    DJ process that started it. A PID reused by an unrelated process is
+    therefore never mistaken for ours, and a restart can tell the leftovers
+    of a crashed run from processes another running instance still owns
+    (those are kept in the file but otherwise left alone).
+    Liveness checks only look at the recorded PIDs (one lookup each).
+    Walking the whole process table is a separate fallback, scan(), limited
+    to one walk per scan_interval.
+    """
+    def __init__(self, path=PID_FILE, scan_interval=SCAN_INTERVAL):
+        self.logger = logging.getLogger('ProcessRegistry')
+        self.path = path
+        self.scan_interval = scan_interval
+        self.lock = threading.Lock()
+        self.owner = os.getpid()
+        self.owner_created = psutil.Process().create_time()
+        self.scans = {}     # names -> (monotonic time, processes found)
+        # pid -> {'role', 'name', 'created', 'owner', 'owner_created'} for our own
+        # processes and those of ended runs; other live instances keep theirs
+        self.entries = {pid: e for pid, e in self._read().items() if not self._other_owner_running(e)}
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable {self.path}: {e}")
+            return {}
+        entries = {}
+        for pid, entry in data.items():
+            try:
+                entries[int(pid)] = entry
+            except ValueError:
+                continue
+        return entries
+
+    def _save(self):
+        merged = {pid: e for pid, e in self._read().items() if self._other_owner_running(e)}
+        merged.update(self.entries)
+        try:
+            atomic_write(self.path, json.dumps({str(pid): e for pid, e in merged.items()}))
+        except OSError as e:
+            self.logger.warning(f"Could not write {self.path}: {e}")
+
+    def _other_owner_running(self, entry):
+        """True if the entry belongs to another DJ process that is still running"""
+        if entry.get('owner') == self.owner:
+            return False
+        try:
+            owner = psutil.Process(entry['owner'])
+            return abs(owner.create_time() - entry['owner_created']) <= 0.01
+        except (psutil.Error, KeyError, TypeError):
+            return False
+
+    def register(self, role, pid):
+        """Record a process this DJ just started"""
+        try:
+            process = psutil.Process(pid)
+            entry = {'role': role, 'name': process.name(), 'created': process.create_time(),
+                     'owner': self.owner, 'owner_created': self.owner_created}
+        except psutil.Error:
+            return  # Already gone
+        with self.lock:
+            self.entries[pid] = entry
+            self._save()
+
+    def unregister(self, pid):
+        with self.lock:
+            if self.entries.pop(pid, None) is not None:
+                self._save()
+
+    @staticmethod
+    def _lookup(pid, entry):
+        """The live process behind an entry, or None if it exited or the PID was reused"""
+        try:
+            process = psutil.Process(pid)
+            if abs(process.create_time() - entry['created']) > 0.01:
+                return None
+            if process.status() == psutil.STATUS_ZOMBIE:
+                return None
+            return process
+        except (psutil.Error, KeyError, TypeError):
+            return None
+
+    def alive(self, role=None, leftovers=False):
+        """Live recorded processes, optionally of one role.
+
+        leftovers=True selects processes whose owning DJ is no longer running
+        (what a crashed run left behind) instead of this DJ's own.
+        Entries for processes that have exited are dropped.
+        """
+        found = []
+        with self.lock:
+            dead = []
+            for pid, entry in self.entries.items():
+                process = self._lookup(pid, entry)
+                if process is None:
+                    dead.append(pid)
+                    continue
+                if role is not None and entry.get('role') != role:
+                    continue
+                if (entry.get('owner') == self.owner) == leftovers:
+                    continue
+                found.append(process)
+            for pid in dead:
+                del self.entries[pid]
+            if dead:
+                self._save()
+        return found
+
+    def is_running(self, role):
+        return bool(self.alive(role))
+
+    def kill(self, processes, timeout=5):
+        """Kill processes and wait (at most timeout seconds) for them to exit; returns those still alive"""
+        for process in processes:
+            try:
+                process.kill()
+            except psutil.Error:
+                continue
+        _, still_alive = psutil.wait_procs(processes, timeout=timeout)
+        with self.lock:
+            for process in processes:
+                if process not in still_alive:
+                    self.entries.pop(process.pid, None)
+            self._save()
+        return still_alive
+
+    def scan(self, names):
+        """Fallback: every process on the host whose name is in names.
+
+        This walks the whole process table, so a repeat call within
+        scan_interval returns the previous result (minus the processes that
+        have exited since) instead of walking it again.
+        """
+        key = tuple(sorted(n.lower() for n in names))
+        now = time.monotonic()
+        cached = self.scans.get(key)
+        if cached and now - cached[0] < self.scan_interval:
+            return [p for p in cached[1] if p.is_running()]
+        found = []
+        for process in psutil.process_iter(['name']):
+            if (process.info['name'] or '').lower() in key:
+                found.append(process)
+        self.scans[key] = (now, found)
+        return found
+
+
+class AdoptedProcess:
+    """A process found running (not started by us) behind the subprocess.Popen
+    calls used to watch one: poll, wait, terminate, kill and communicate"""
+    def __init__(self, process):
+        self.process = process
+        self.pid = process.pid
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                if self.process.status() != psutil.STATUS_ZOMBIE:
+                    return None
+            except psutil.Error:
+                pass
+            self.returncode = -1  # Not our child, so its exit code is unknown
+        return self.returncode
+
+    def wait(self, timeout=None):
+        try:
+            self.process.wait(timeout)
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(self.process.pid, timeout)
+        except psutil.Error:
+            pass
+        self.returncode = -1
+        return self.returncode
+
+    def terminate(self):
+        try:
+            self.process.terminate()
+        except psutil.Error:
+            pass
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except psutil.Error:
+            pass
+
+    def communicate(self):
+        return None, None
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_registry(path=PID_FILE, scan_interval=SCAN_INTERVAL):
+    """The process-wide ProcessRegistry, created on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ProcessRegistry(path, scan_interval)
+        return _shared
@@ -0,0 +1,122 @@
+import threading
+import time
+
+STALL_SECONDS = 1.0  # A producer blocked this long means the consumer stopped draining
+
+
+class PCMRingBuffer:
+    """Fixed-size single-producer/single-consumer ring buffer for PCM.
+
+    Storage is one preallocated bytearray. The producer only ever advances
+    write_pos and the consumer only ever advances read_pos, so neither side
+    takes a lock; the events are just there to sleep instead of spin.
+    """
+    def __init__(self, capacity, stall_seconds=STALL_SECONDS):
+        self.capacity = capacity
+        self.stall_seconds = stall_seconds
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.write_pos = 0  # Total bytes ever written
+        self.read_pos = 0   # Total bytes ever consumed
+        self.closed = False
+        self.data_ready = threading.Event()
+        self.space_ready = threading.Event()
+
+        # Telemetry
+        self.underruns = 0   # Consumer needed audio and the buffer was empty
+        self.full_waits = 0  # Producer found the buffer full and waited (normal backpressure)
+        self.overruns = 0    # ...and was still waiting after stall_seconds
+        self.high_water = 0  # Highest fill level seen, in bytes
+
+    def fill(self):
+        return self.write_pos - self.read_pos
+
+    def write(self, data):
+        """Copy all of data into the buffer, waiting for space while it is full.
+
+        Returns False if the buffer was closed before everything was written.
+        """
+        data = memoryview(data).cast('B')
+        waiting_since = None
+        stalled = False
+        while len(data):
+            if self.closed:
+                return False
+            free = self.capacity - self.fill()
+            if not free:
+                # Decoding runs ahead of real time, so waiting for space is expected;
+                # only a wait longer than stall_seconds counts as an overrun
+                now = time.monotonic()
+                if waiting_since is None:
+                    self.full_waits += 1
+                    waiting_since = now
+                elif not stalled and now - waiting_since >= self.stall_seconds:
+                    self.overruns += 1
+                    stalled = True
+                self.space_ready.clear()
+                if self.capacity - self.fill() == 0 and not self.closed:
+                    self.space_ready.wait(0.05)
+                continue
+
+            waiting_since = None
+            stalled = False
+            size = min(free, len(data))
+            start = self.write_pos % self.capacity
+            first = min(size, self.capacity - start)
+            self.view[start:start + first] = data[:first]
+            if size > first:
+                self.view[:size - first] = data[first:size]
+            self.write_pos += size
+            data = data[size:]
+
+            level = self.fill()
+            if level > self.high_water:
+                self.high_water = level
+            self.data_ready.set()
+        return True
+
+    def peek(self, size):
+        """Return a zero-copy view of up to size contiguous buffered bytes, or None if empty.
+
+        Call consume() once the view has been used.
+        """
+        available = self.fill()
+        if not available:
+            return None
+        start = self.read_pos % self.capacity
+        return self.view[start:start + min(size, available, self.capacity - start)]
+
+    def consume(self, size):
+        self.read_pos += size
+        self.space_ready.set()
+
+    def wait_for_data(self, minimum, timeout):
+        """Sleep until at least minimum bytes are buffered; returns whether they are"""
+        if self.fill() >= minimum:
+            return True
+        self.data_ready.clear()
+        if self.fill() < minimum and not self.closed:
+            self.data_ready.wait(timeout)
+        return self.fill() >= minimum
+
+    def record_underrun(self):
+        self.underruns += 1
+
+    def clear(self):
+        """Drop everything buffered (consumer side only)"""
+        self.consume(self.fill())
+
+    def close(self):
+        self.closed = True
+        self.data_ready.set()
+        self.space_ready.set()
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'fill': self.fill(),
+            'high_water': self.high_water,
+            'underruns': self.underruns,
+            'full_waits': self.full_waits,
+            'overruns': self.overruns,
+        }
@@ -0,0 +1,196 @@
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict, deque
+
+ARTIST_GAP = 5    # At least this many other tracks between two by the same artist
+ALBUM_GAP = 10    # ...and between two from the same album
+JITTER = 0.15     # How far (in slots) a track may stray from its evenly spread position
+MAX_DEFERRED = 64
+
+
+def path_artist_album(path):
+    """Artist and album folders of AudioSource/Artist/Album/XX - Title.mp3, or (None, None)"""
+    parts = os.path.normpath(path).split(os.sep)
+    if len(parts) >= 4:
+        return parts[-3], parts[-2]
+    return None, None
+
+
+def _spread(groups, rng):
+    """Interleave groups so each one is spaced evenly over the whole result.
+
+    Item i of a group of k lands at (i + offset) / k plus a little jitter,
+    with a random offset per group; one sort merges everything.
+    """
+    placed = []
+    for items in groups:
+        k = len(items)
+        offset = rng.random()
+        for i, item in enumerate(items):
+            placed.append(((i + offset + rng.uniform(-JITTER, JITTER)) / k, item))
+    placed.sort(key=lambda entry: entry[0])
+    return [item for _, item in placed]
+
+
+def _reachable_gaps(keys, gap):
+    """Gap per key, capped at what its share of the playlist allows.
+
+    A key on c of n tracks has only n - c others to go between its c tracks,
+    so an artist on 400 of 1000 tracks gets a gap of 1 instead of the
+    configured 5 that it could never keep.
+    """
+    counts = Counter(key for key in keys if key is not None)
+    total = len(keys)
+    return {key: min(gap, (total - count) // count) for key, count in counts.items()}
+
+
+def _enforce_spacing(order, artists, albums, artist_gap, album_gap):
+    """Single greedy pass that holds back tracks placed too close to their artist/album.
+
+    Held-back tracks go in first as soon as they fit. Each artist and album
+    gets the widest gap its share of the playlist allows. If the backlog still
+    passes MAX_DEFERRED with nothing held fitting, all gaps are lowered one
+    step (and raised again once the backlog has halved), so the pass stays
+    linear without dropping the spacing altogether.
+    """
+    artist_gaps = _reachable_gaps(artists, artist_gap)
+    album_gaps = _reachable_gaps(albums, album_gap)
+    last_artist = {}
+    last_album = {}
+    deferred = deque()
+    result = []
+    relaxed = 0  # How many steps the gaps are currently lowered by
+
+    def fits(index):
+        position = len(result)
+        artist, album = artists[index], albums[index]
+        if artist is not None:
+            gap = max(artist_gaps[artist] - relaxed, 0)
+            if position - last_artist.get(artist, -gap - 1) <= gap:
+                return False
+        if album is not None:
+            gap = max(album_gaps[album] - relaxed, 0)
+            if position - last_album.get(album, -gap - 1) <= gap:
+                return False
+        return True
+
+    def place(index):
+        if artists[index] is not None:
+            last_artist[artists[index]] = len(result)
+        if albums[index] is not None:
+            last_album[albums[index]] = len(result)
+        result.append(index)
+
+    def place_held():
+        for held in deferred:
+            if fits(held):
+                deferred.remove(held)
+                place(held)
+                return True
+        return False
+
+    for index in order:
+        placed_held = place_held()
+        if fits(index):
+            place(index)
+        else:
+            deferred.append(index)
+            if len(deferred) > MAX_DEFERRED and not placed_held:
+                relaxed += 1
+        if relaxed and len(deferred) <= MAX_DEFERRED // 2:
+            relaxed -= 1
+    while deferred:
+        # Nothing left to put in between: lower the gaps until something fits
+        while not place_held():
+            relaxed += 1
+    return result
+
+
+def smart_shuffle(tracks, seed, artist_gap=ARTIST_GAP, album_gap=ALBUM_GAP, keys=path_artist_album):
+    """Deterministic artist/album-aware shuffle of tracks; returns a list of indices.
+
+    Albums are interleaved within each artist, artists across the whole
+    playlist, then a spacing pass enforces the minimum gaps. O(n log n) for
+    the sort plus a linear pass, so 100k tracks take well under a second.
+    """
+    rng = random.Random(seed)
+    artists = []
+    albums = []
+    by_artist = defaultdict(lambda: defaultdict(list))
+    loose = []
+    for index, track in enumerate(tracks):
+        artist, album = keys(track)
+        artists.append(artist)
+        albums.append((artist, album) if album is not None else None)
+        if artist is None:
+            loose.append([index])
+        else:
+            by_artist[artist][album].append(index)
+
+    groups = loose
+    for artist in sorted(by_artist):
+        album_groups = []
+        for album in sorted(by_artist[artist], key=str):
+            items = by_artist[artist][album]
+            rng.shuffle(items)
+            album_groups.append(items)
+        groups.append(_spread(album_groups, rng))
+
+    order = _spread(groups, rng)
+    return _enforce_spacing(order, artists, albums, artist_gap, album_gap)
+
+
+def spacing_report(keys_in_order):
+    """Back-to-back repeats and smallest gap between equal keys (None keys ignored)"""
+    last = {}
+    repeats = 0
+    min_gap = None
+    for position, key in enumerate(keys_in_order):
+        if key is None:
+            continue
+        if key in last:
+            gap = position - last[key] - 1
+            repeats += gap == 0
+            min_gap = gap if min_gap is None else min(min_gap, gap)
+        last[key] = position
+    return {'repeats': repeats, 'min_gap': min_gap}
+
+
+def _benchmark(count):
+    """Build a skewed synthetic library and compare plain and smart shuffles"""
+    rng = random.Random(1)
+    tracks = []
+    artist = 0
+    while len(tracks) < count:
+        # Long-tailed: a few artists with hundreds of tracks, many with a handful
+        size = min(int(rng.paretovariate(1.2) * 4), 400)
+        for track in range(size):
+            tracks.append(os.path.join('AudioSource', f'artist{artist}', f'album{track // 12}',
+                                       f'{track:02d} - Track.mp3'))
+        artist += 1
+    tracks = sorted(tracks[:count])
+    print(f"{len(tracks)} tracks, {artist} artists")
+
+    def report(label, order, elapsed):
+        keys = [path_artist_album(tracks[i]) for i in order]
+        by_artist = spacing_report([k[0] for k in keys])
+        by_album = spacing_report(keys)
+        print(f"{label:>7}: {elapsed:.2f}s, artist repeats {by_artist['repeats']}, "
+              f"min artist gap {by_artist['min_gap']}, album repeats {by_album['repeats']}, "
+              f"min album gap {by_album['min_gap']}")
+
+    order = list(range(len(tracks)))
+    start = time.perf_counter()
+    random.Random(2).shuffle(order)
+    report("random", order, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    order = smart_shuffle(tracks, 2)
+    report("smart", order, time.perf_counter() - start)
+    assert sorted(order) == list(range(len(tracks))), "smart shuffle lost or duplicated tracks"
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
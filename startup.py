@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from status_output import atomic_write
+
+DEVICE_CACHE_FILE = "device_cache.json"
+DEVICE_CACHE_HOURS = 24     # Re-run device detection at least this often
+PROBE_INTERVAL = 0.1
+
+
+def wait_until(probe, timeout, interval=PROBE_INTERVAL, stopped=None):
+    """Call probe() until it returns something truthy or timeout seconds pass.
+
+    Returns the probe's result, or None on timeout (or when `stopped` is set).
+    Replaces fixed sleeps: the wait is only as long as the thing takes.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = probe()
+        if result:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        if stopped is not None:
+            if stopped.wait(min(interval, remaining)):
+                return None
+        else:
+            time.sleep(min(interval, remaining))
+
+
+def port_open(host, port, timeout=0.2):
+    """True if something accepts TCP connections on host:port"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class StartupTimer:
+    """Wall-clock time of each startup phase, measured from construction.
+
+    Phases may run on several threads at once; each is reported as it ends
+    and summary() lists them in the order they started.
+    """
+    def __init__(self, report=print):
+        self.report = report
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.phases = []  # [name, start offset, duration or None]
+
+    @contextmanager
+    def phase(self, name):
+        with self.lock:
+            entry = [name, time.monotonic() - self.started, None]
+            self.phases.append(entry)
+        try:
+            yield
+        finally:
+            entry[2] = time.monotonic() - self.started - entry[1]
+            self.report(f"[{entry[2]:.2f}s] {name}")
+
+    def run(self, name, func, *args, **kwargs):
+        """Call func as a timed phase (handy with executor.submit)"""
+        with self.phase(name):
+            return func(*args, **kwargs)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def summary(self):
+        with self.lock:
+            parts = [f"{name} {duration:.2f}s" if duration is not None else f"{name} (running)"
+                     for name, _, duration in self.phases]
+        return f"Startup {self.elapsed():.2f}s: " + ", ".join(parts)
+
+
+class DeviceCache:
+    """Remembers the detected audio device between runs.
+
+    Device detection spawns several ffmpeg and powershell processes; the
+    result only changes when ffmpeg, the configured cable name or the
+    hardware changes. Entries are keyed on the first two and expire after
+    max_age_hours to catch the third.
+    """
+    def __init__(self, path=DEVICE_CACHE_FILE, max_age_hours=DEVICE_CACHE_HOURS):
+        self.logger = logging.getLogger('DeviceCache')
+        self.path = path
+        self.max_age = max_age_hours * 3600
+
+    @staticmethod
+    def key(ffmpeg_path, cable_name):
+        try:
+            st = os.stat(ffmpeg_path)
+            binary = [ffmpeg_path, st.st_size, st.st_mtime_ns]
+        except OSError:
+            binary = [ffmpeg_path, None, None]
+        return binary + [cable_name]
+
+    def lookup(self, key):
+        """The cached device name for key, or None if missing, stale or for another setup"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('key') != key:
+            return None
+        if time.time() - entry.get('detected', 0) > self.max_age:
+            return None
+        return entry.get('device')
+
+    def store(self, key, device):
+        content = json.dumps({'key': key, 'device': device, 'detected': int(time.time())})
+        try:
+            atomic_write(self.path, content)
+        except OSError as e:
+            self.logger.warning(f"Could not save {self.path}: {e}")
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.warning(f"Could not remove {self.path}: {e}")
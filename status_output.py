@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+STATUS_FILE = "now_playing.txt"
+
+STATUS_WRITES = metrics.counter('dj_status_writes_total', "Status files rewritten")
+STATUS_UNCHANGED = metrics.counter('dj_status_writes_skipped_total',
+                                   "Status file writes skipped because the content had not changed")
+STATUS_ERRORS = metrics.counter('dj_status_write_errors_total', "Status file writes that failed")
+
+
+def atomic_write(path, content, retries=3):
+    """Replace a file's contents in one step so readers never see it half-written"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        f.write(content)
+    for attempt in range(retries):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # On Windows the rename fails while a reader (OBS) has the file open
+            if attempt == retries - 1:
+                raise
+            time.sleep(0.05)
+
+
+class TextStatusOutput:
+    """The two-line title / artist // album file read by the OBS text source"""
+    def __init__(self, path=STATUS_FILE):
+        self.path = path
+
+    def render(self, status):
+        return f"{status['title']}\n{status['artist']} // {status['album']}\n"
+
+
+class JsonStatusOutput:
+    """Machine-readable status; only changes when the track or progress changes"""
+    def __init__(self, path):
+        self.path = path
+
+    def render(self, status):
+        return json.dumps(status, indent=2)
+
+
+class CountdownStatusOutput:
+    """Remaining time only, rounded down to `resolution` seconds to bound disk writes"""
+    def __init__(self, path, resolution=15):
+        self.path = path
+        self.resolution = max(1, int(resolution))
+
+    def render(self, status):
+        if not status.get('start_time'):
+            return ""
+        remaining = max(0, status['duration'] - (time.time() - status['start_time']))
+        remaining = int(remaining) // self.resolution * self.resolution
+        return f"{remaining // 60}:{remaining % 60:02d}\n"
+
+
+class StatusWriter:
+    """Fan status updates out to file outputs, writing only what changed.
+
+    Updates arriving within min_interval of the last write are coalesced into
+    one trailing write. Each output keeps the last content it wrote and is only
+    rewritten (atomically) when its rendered text differs.
+    """
+    def __init__(self, outputs=None, min_interval=0.5):
+        self.logger = logging.getLogger('StatusWriter')
+        self.outputs = outputs if outputs is not None else [TextStatusOutput()]
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.status = None
+        self.written = {}
+        self.last_flush = 0.0
+        self.timer = None
+        self.writes = 0
+
+    def add_output(self, output):
+        with self.lock:
+            self.outputs.append(output)
+
+    def update(self, status):
+        """Record the latest status; it is written now or at the end of the current burst"""
+        with self.lock:
+            self.status = status
+            if self.timer:
+                return
+            delay = self.last_flush + self.min_interval - time.monotonic()
+            if delay > 0:
+                self.timer = threading.Timer(delay, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            status = self.status
+            self.last_flush = time.monotonic()
+            if status is None:
+                return
+            for output in self.outputs:
+                try:
+                    content = output.render(status)
+                    if self.written.get(output.path) == content:
+                        STATUS_UNCHANGED.inc()
+                        continue
+                    atomic_write(output.path, content)
+                    self.written[output.path] = content
+                    self.writes += 1
+                    STATUS_WRITES.inc()
+                except Exception as e:
+                    STATUS_ERRORS.inc()
+                    self.logger.error(f"Error writing {output.path}: {e}")
@@ -0,0 +1,483 @@
+import asyncio
+import logging
+import socket
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from audio_engine import CommandSink, SAMPLE_RATE, CHANNELS
+from control_server import ControlServer
+
+STREAM_HOST = "0.0.0.0"
+STREAM_PORT = 8000
+MOUNT = "/stream"
+BITRATE = 128          # kbit/s
+ICY_METAINT = 16000    # Audio bytes between two ICY metadata blocks
+BURST_SECONDS = 2      # Audio sent at once to a new listener so its player starts straight away
+BACKLOG_SECONDS = 10   # Encoded audio kept for listeners that fall behind
+MAX_LISTENERS = 500
+STALL_SECONDS = 10     # A listener that accepts nothing for this long is disconnected
+READ_BYTES = 4096
+STATION_NAME = "Virtual DJ"
+
+FORMATS = {
+    'mp3': {'content_type': 'audio/mpeg', 'args': ['-c:a', 'libmp3lame', '-f', 'mp3']},
+    # Short Ogg pages keep the latency down; every page is a point a listener can join at
+    'opus': {'content_type': 'audio/ogg', 'args': ['-c:a', 'libopus', '-f', 'ogg',
+                                                   '-page_duration', '200000']},
+}
+
+
+def encoder_command(ffmpeg_path='ffmpeg', fmt='mp3', bitrate=BITRATE):
+    """ffmpeg reading the engine's raw PCM on stdin and writing the encoded stream to stdout"""
+    return [
+        ffmpeg_path,
+        '-hide_banner', '-loglevel', 'error',
+        '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS),
+        '-i', '-',
+        *FORMATS[fmt]['args'],
+        '-b:a', f'{bitrate}k',
+        '-flush_packets', '1',
+        '-'
+    ]
+
+
+def icy_block(title):
+    """An ICY metadata block: a length byte (in 16-byte units) and the padded StreamTitle"""
+    text = f"StreamTitle='{title.replace(chr(39), chr(8217))}';".encode('utf-8')[:255 * 16]
+    blocks = (len(text) + 15) // 16
+    return bytes([blocks]) + text.ljust(blocks * 16, b'\0')
+
+
+class OggPages:
+    """Splits an Ogg byte stream into whole pages"""
+    def __init__(self):
+        self.pending = b''
+
+    def feed(self, data):
+        self.pending += data
+        pages = []
+        while True:
+            start = self.pending.find(b'OggS')
+            if start < 0:
+                self.pending = self.pending[-3:]
+                return pages
+            if len(self.pending) - start < 27:
+                break
+            segments = self.pending[start + 26]
+            header_end = start + 27 + segments
+            if len(self.pending) < header_end:
+                break
+            page_end = header_end + sum(self.pending[start + 27:header_end])
+            if len(self.pending) < page_end:
+                break
+            pages.append(self.pending[start:page_end])
+            self.pending = self.pending[page_end:]
+        self.pending = self.pending[start:]
+        return pages
+
+    @staticmethod
+    def granule(page):
+        return struct.unpack_from('<q', page, 6)[0]
+
+
+class StreamBuffer:
+    """The encoded stream, kept once for every listener.
+
+    Chunks are numbered; each listener only holds the number of the next
+    chunk it needs. The oldest chunks are dropped beyond max_bytes, and a
+    listener whose next chunk has been dropped skips ahead to the burst
+    position. Used from the event loop only.
+    """
+    def __init__(self, max_bytes, burst_bytes):
+        self.max_bytes = max_bytes
+        self.burst_bytes = burst_bytes
+        self.chunks = deque()  # (number, data)
+        self.size = 0
+        self.next = 0
+        self.header = b''      # Sent to every listener before its first audio (Ogg headers)
+        self.generation = 0    # Bumped whenever the header changes
+        self.closed = False
+        self.changed = asyncio.Event()
+
+    def append(self, data):
+        self.chunks.append((self.next, data))
+        self.next += 1
+        self.size += len(data)
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            self.size -= len(self.chunks.popleft()[1])
+        self.changed.set()
+        self.changed.clear()
+
+    def restart(self, header):
+        """The encoder started over: audio from before cannot follow the new header"""
+        self.chunks.clear()
+        self.size = 0
+        self.header = header
+        self.generation += 1
+
+    def burst_start(self):
+        """Number of the oldest chunk within burst_bytes of the live end"""
+        position = self.next
+        total = 0
+        for number, data in reversed(self.chunks):
+            total += len(data)
+            if total > self.burst_bytes and position != self.next:
+                break
+            position = number
+        return position
+
+    def read(self, position, max_bytes):
+        """(up to max_bytes of chunks from position on, the position after them,
+        whether the listener was skipped ahead)"""
+        if not self.chunks:
+            return [], self.next, False
+        skipped = False
+        first = self.chunks[0][0]
+        if position < first:
+            position = self.burst_start()
+            skipped = True
+        chunks = []
+        size = 0
+        for number, data in islice(self.chunks, position - first, None):
+            if chunks and size + len(data) > max_bytes:
+                break
+            chunks.append(data)
+            size += len(data)
+            position = number + 1
+        return chunks, position, skipped
+
+    async def wait(self, position):
+        while position >= self.next and not self.closed:
+            await self.changed.wait()
+
+    def close(self):
+        self.closed = True
+        self.changed.set()
+
+
+class Listener:
+    """One HTTP listener: how it is served and where it is in the metadata cycle"""
+    def __init__(self, writer, icy, chunked, metaint):
+        self.writer = writer
+        self.icy = icy
+        self.chunked = chunked
+        self.until_meta = metaint  # Audio bytes left before the next metadata block
+        self.title_sent = None
+        self.generation = None
+        self.sent = 0
+
+
+class StreamServer:
+    """Serves the encoded DJ output to any number of HTTP listeners.
+
+    The engine's PCM is encoded once (EncoderSink) and the result is shared
+    by every listener through one StreamBuffer; listeners are coroutines on
+    an asyncio loop, so a slow one only ever delays itself. Clients asking
+    for Icy-MetaData get the now-playing title every metaint bytes, HTTP/1.1
+    clients without it get a chunked response, and everything else a plain
+    close-delimited stream.
+    """
+    def __init__(self, status, fmt='mp3', bitrate=BITRATE, host=STREAM_HOST, port=STREAM_PORT,
+                 mount=MOUNT, metaint=ICY_METAINT, burst_seconds=BURST_SECONDS,
+                 max_listeners=MAX_LISTENERS, name=STATION_NAME):
+        self.logger = logging.getLogger('StreamServer')
+        self.format = fmt
+        self.bitrate = bitrate
+        self.mount = mount
+        self.metaint = metaint
+        self.max_listeners = max_listeners
+        self.name = name
+        byte_rate = bitrate * 1000 // 8
+        self.buffer = StreamBuffer(BACKLOG_SECONDS * byte_rate, burst_seconds * byte_rate)
+        self.batch_bytes = byte_rate  # Written to a listener between two drains
+        # Public (0.0.0.0 by default): only the mount and /listeners, never the status or controls
+        self.http = ControlServer(status, {}, host, port, name="Audio stream", control=False)
+        self.http.add_route('GET', mount, self._listen)
+        self.http.add_route('GET', '/listeners', self._get_stats)
+        self.loop = None
+        self.listeners = set()
+        self.title = icy_block('')
+        # Telemetry
+        self.peak_listeners = 0
+        self.total_listeners = 0
+        self.stalls = 0
+        self.resyncs = 0
+        self.encoded = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.http.start()
+
+    async def close(self):
+        self.buffer.close()
+        for listener in self.listeners:
+            listener.writer.transport.abort()  # Also ends those stuck waiting for a stalled client
+        await self.http.close()
+        self.loop = None
+
+    # --- input, from the encoder thread ------------------------------------------------
+
+    def _call(self, func, *args):
+        """Run func on the server's loop; safe to call from any thread"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            if asyncio.get_running_loop() is loop:
+                func(*args)
+                return
+        except RuntimeError:
+            pass
+        loop.call_soon_threadsafe(func, *args)
+
+    def feed(self, data):
+        """Append encoded audio for every listener"""
+        self.encoded += len(data)
+        self._call(self.buffer.append, data)
+
+    def restart(self, header=b''):
+        """The encoder was (re)started; header is what a decoder needs before any audio"""
+        self._call(self.buffer.restart, header)
+
+    def publish(self, status):
+        """Take the ICY title from a now-playing status"""
+        parts = [status.get('artist'), status.get('title')]
+        block = icy_block(" - ".join(p for p in parts if p))
+        if block != self.title:
+            self.title = block  # A new object, so every listener sends it once
+
+    # --- listeners -----------------------------------------------------------------
+
+    async def _listen(self, request):
+        if len(self.listeners) >= self.max_listeners:
+            return 503, {'error': 'listener limit reached'}
+        icy = request.headers.get('icy-metadata') == '1' and self.metaint > 0
+        # ICY players count raw bytes between metadata blocks, so they never get chunked encoding
+        chunked = request.version == 'HTTP/1.1' and not icy
+        headers = [
+            f"{'HTTP/1.1' if chunked else 'HTTP/1.0'} 200 OK",
+            f"Content-Type: {FORMATS[self.format]['content_type']}",
+            "Cache-Control: no-cache, no-store",
+            "Connection: close",
+            f"icy-name: {self.name}",
+            f"icy-br: {self.bitrate}",
+        ]
+        if icy:
+            headers.append(f"icy-metaint: {self.metaint}")
+        if chunked:
+            headers.append("Transfer-Encoding: chunked")
+        writer = request.writer
+        # Keep what a stalled listener holds in its own buffers small: the backlog lives,
+        # once for everybody, in the StreamBuffer
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.batch_bytes)
+        writer.transport.set_write_buffer_limits(high=self.batch_bytes)
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode('latin-1'))
+
+        listener = Listener(writer, icy, chunked, self.metaint)
+        self.listeners.add(listener)
+        self.total_listeners += 1
+        self.peak_listeners = max(self.peak_listeners, len(self.listeners))
+        position = self.buffer.burst_start()
+        try:
+            while not self.buffer.closed:
+                await self.buffer.wait(position)
+                # In batches, so a listener that lags is noticed (and skipped ahead) between them
+                chunks, position, skipped = self.buffer.read(position, self.batch_bytes)
+                if skipped:
+                    self.resyncs += 1
+                if listener.generation != self.buffer.generation:
+                    listener.generation = self.buffer.generation
+                    if self.buffer.header:
+                        chunks.insert(0, self.buffer.header)
+                for data in chunks:
+                    self._send(writer, listener, data)
+                try:
+                    await asyncio.wait_for(writer.drain(), STALL_SECONDS)
+                except asyncio.TimeoutError:
+                    self.stalls += 1
+                    self.logger.info(f"Dropping a listener that stopped reading for {STALL_SECONDS}s")
+                    break
+            if chunked and not writer.is_closing():
+                writer.write(b"0\r\n\r\n")
+        finally:
+            self.listeners.discard(listener)
+        return None
+
+    def _send(self, writer, listener, data):
+        if listener.icy:
+            parts = []
+            while len(data) >= listener.until_meta:
+                parts.append(data[:listener.until_meta])
+                data = data[listener.until_meta:]
+                # The full title only when it changed; an empty block otherwise
+                title = self.title
+                parts.append(title if title is not listener.title_sent else b'\0')
+                listener.title_sent = title
+                listener.until_meta = self.metaint
+            parts.append(data)
+            listener.until_meta -= len(data)
+            data = b''.join(parts)
+        if not data:
+            return
+        if listener.chunked:
+            writer.write(f"{len(data):x}\r\n".encode('latin-1') + data + b"\r\n")
+        else:
+            writer.write(data)
+        listener.sent += len(data)
+
+    def stats(self):
+        return {'listeners': len(self.listeners), 'peak_listeners': self.peak_listeners,
+                'total_listeners': self.total_listeners, 'stalls': self.stalls,
+                'resyncs': self.resyncs, 'encoded_bytes': self.encoded,
+                'format': self.format, 'bitrate': self.bitrate}
+
+    async def _get_stats(self, request):
+        return 200, self.stats()
+
+
+class EncoderSink(CommandSink):
+    """Fan-out output that encodes the PCM once with ffmpeg and feeds the StreamServer"""
+    def __init__(self, server, ffmpeg_path='ffmpeg', registry=None):
+        super().__init__(encoder_command(ffmpeg_path, server.format, server.bitrate),
+                         registry, role='encoder')
+        self.stdout = subprocess.PIPE
+        self.server = server
+        self.reader = None
+
+    def open(self):
+        super().open()
+        self.reader = threading.Thread(target=self._read, args=(self.process,), daemon=True)
+        self.reader.start()
+
+    def _read(self, process):
+        pages = OggPages() if self.server.format == 'opus' else None
+        header = []
+        starting = True
+        if pages is None:
+            self.server.restart()
+        while True:
+            data = process.stdout.read1(READ_BYTES)
+            if not data:
+                break
+            if pages is None:
+                self.server.feed(data)
+                continue
+            for page in pages.feed(data):
+                # OpusHead and OpusTags come first, with granule position 0
+                if starting and OggPages.granule(page) == 0:
+                    header.append(page)
+                    continue
+                if starting:
+                    self.server.restart(b''.join(header))
+                    starting = False
+                self.server.feed(page)
+        process.stdout.close()
+
+    def close(self):
+        super().close()
+        if self.reader:
+            self.reader.join(timeout=2)
+            self.reader = None
+
+
+async def _load_test(listeners, seconds, bitrate=BITRATE):
+    """Serve a synthetic stream to `listeners` local clients and one that reads too slowly.
+
+    Half the clients ask for ICY metadata and check the titles they get; the
+    rest read a chunked HTTP/1.1 response. No ffmpeg is needed: the feed is
+    made-up bytes at the stream's bitrate.
+    """
+    titles = [f"Track {i}" for i in range(int(seconds) + 1)]
+    status = {'artist': 'Load Test', 'title': titles[0]}
+    server = StreamServer(lambda: status, bitrate=bitrate, host='127.0.0.1', port=0,
+                          max_listeners=listeners + 1)
+    await server.start()
+    port = server.http.port
+    byte_rate = bitrate * 1000 // 8
+    stop = asyncio.Event()
+
+    async def feed():
+        tick = 0.05
+        chunk = bytes(int(byte_rate * tick))
+        started = time.monotonic()
+        sent = 0
+        while not stop.is_set():
+            server.feed(chunk)
+            sent += 1
+            if sent % int(1 / tick) == 0:
+                status['title'] = titles[min(int(sent * tick), len(titles) - 1)]
+                server.publish(status)
+            await asyncio.sleep(max(0.0, started + sent * tick - time.monotonic()))
+
+    async def client(icy, slow=False):
+        sock = socket.socket()
+        if slow:
+            # Small buffers on the client side too, or they soak up the whole test
+            # (the receive buffer must be set before connecting to shrink the TCP window)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock, limit=4096 if slow else 2 ** 16)
+        version = 'HTTP/1.0' if icy else 'HTTP/1.1'
+        writer.write(f"GET {MOUNT} {version}\r\nHost: localhost\r\n"
+                     f"Icy-MetaData: {1 if icy else 0}\r\n\r\n".encode('latin-1'))
+        head = await reader.readuntil(b'\r\n\r\n')
+        if b' 200 ' not in head.split(b'\r\n', 1)[0]:
+            writer.close()
+            return 0, set()
+        received = 0
+        seen = set()
+        try:
+            while not stop.is_set():
+                if slow:
+                    data = await reader.read(4096)
+                    await asyncio.sleep(0.5)
+                elif icy:
+                    data = await reader.readexactly(ICY_METAINT)
+                    length = (await reader.readexactly(1))[0] * 16
+                    if length:
+                        seen.add((await reader.readexactly(length)).rstrip(b'\0').decode('utf-8'))
+                else:
+                    data = await reader.read(65536)
+                if not data:
+                    break
+                received += len(data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        writer.close()
+        return received, seen
+
+    feeder = asyncio.create_task(feed())
+    await asyncio.sleep(BURST_SECONDS)  # Something to burst to the first listeners
+    cpu = time.process_time()
+    tasks = [asyncio.create_task(client(icy=i % 2 == 0)) for i in range(listeners)]
+    slow = asyncio.create_task(client(icy=False, slow=True))
+    await asyncio.sleep(seconds)
+    stats = server.stats()
+    stop.set()
+    await feeder
+    await server.close()  # Ends every listener's stream
+    results = await asyncio.gather(*tasks)
+    slow_received, _ = await slow
+    cpu = time.process_time() - cpu
+
+    rates = sorted(received / seconds / byte_rate for received, _ in results)
+    icy_titles = [len(seen) for i, (_, seen) in enumerate(results) if i % 2 == 0]
+    print(f"{listeners} listeners for {seconds:g}s at {bitrate} kbit/s: "
+          f"{sum(r for r, _ in results) / 1e6:.1f} MB sent, CPU {cpu:.2f}s "
+          f"({cpu / seconds * 100:.1f}% of one core)")
+    print(f"Per listener: slowest {rates[0]:.2f}x, median {rates[len(rates) // 2]:.2f}x real time; "
+          f"ICY titles seen: {min(icy_titles, default=0)}-{max(icy_titles, default=0)}")
+    print(f"Slow listener: {slow_received / seconds / byte_rate:.2f}x real time, "
+          f"{stats['resyncs']} resyncs, {stats['stalls']} dropped; peak {stats['peak_listeners']} connected")
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(_load_test(int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+                           float(sys.argv[2]) if len(sys.argv) > 2 else 10))
@@ -0,0 +1,447 @@
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import time
+
+import metrics
+from control_server import ControlServer, CommandError, CONTROL_HOST, CONTROL_PORT
+from ffmpeg_events import FFmpegEventParser, TRACK_OPEN, PROGRESS, ERROR
+from metrics import METRICS_FILE, METRICS_PORT, DUMP_INTERVAL, PROMETHEUS_CONTENT_TYPE
+from status_output import atomic_write
+
+CREATE_NO_WINDOW = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+QUICK_CRASH_SECONDS = 10   # A pipeline that dies sooner than this counts as a failed start
+MAX_QUICK_CRASHES = 3      # ...and this many in a row triggers a playlist rebuild
+DRAIN_SECONDS = 15         # Longest wait for ffplay to play out its buffer once the queue has been decoded
+SHUTDOWN_TIMEOUT = 5
+
+STDERR_LINES = metrics.counter('dj_ffmpeg_stderr_lines_total', "Lines (and progress updates) read from FFmpeg's stderr")
+STDERR_BYTES = metrics.counter('dj_ffmpeg_stderr_bytes_total', "Bytes read from FFmpeg's stderr")
+FFMPEG_ERRORS = metrics.counter('dj_ffmpeg_errors_total', "Error lines reported by FFmpeg")
+RESTARTS = metrics.counter('dj_restarts_total', "Restarts of a supervised component", ('component', 'reason'))
+DOWNTIME = metrics.histogram('dj_downtime_seconds', "From a component going down to it running again",
+                             ('component',))
+
+
+class DJSupervisor:
+    """Event-driven supervision of the DJ's child processes.
+
+    Replaces the polling watchdog threads: process exits and FFmpeg's stderr are
+    awaited directly on one asyncio loop, so a crash is handled the moment it
+    happens and nothing wakes up while everything is healthy.
+    """
+    def __init__(self, dj, stream_commands):
+        self.dj = dj
+        self.stream_commands = stream_commands
+        self.ffmpeg = None
+        self.ffplay = None
+        self.stopping = None
+        self.restart_requested = None
+        self.control = None
+        self.metrics_server = None
+        self.metrics_dump = None
+        self.failed = False
+        self.stream_mode = dj.config.get('audio_engine', 'pipe') == 'stream'
+
+    async def run(self):
+        """Supervise until SIGINT/SIGTERM, then shut everything down in order"""
+        self.stopping = asyncio.Event()
+        self.restart_requested = asyncio.Event()
+        self._install_signal_handlers()
+        await self._start_control()
+        await self._start_metrics()
+        await self._start_stream_server()
+
+        if self.stream_mode:
+            audio = asyncio.create_task(self._engine_loop())
+        else:
+            audio = asyncio.create_task(self._pipeline_loop())
+        obs = asyncio.create_task(self._obs_loop())
+
+        await self.stopping.wait()
+        print("\nShutting down...")
+        self.dj.running = False
+        await asyncio.gather(audio, obs, return_exceptions=True)
+        await self._shutdown()
+        print("Stream stopped.")
+
+    def stop(self):
+        if self.stopping and not self.stopping.is_set():
+            self.stopping.set()
+
+    def _install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops have no add_signal_handler
+                signal.signal(sig, lambda signum, frame: loop.call_soon_threadsafe(self.stop))
+
+    async def _wait_first(self, *aws):
+        """Wait for the first awaitable to finish, cancelling the rest; returns its index"""
+        tasks = [asyncio.ensure_future(aw) for aw in aws]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        return next(i for i, task in enumerate(tasks) if task in done)
+
+    # --- control API -------------------------------------------------------------
+
+    async def _start_control(self):
+        settings = self.dj.config.get('control_api')
+        if not settings:
+            return
+        commands = {'skip': self.skip, 'pause': self.pause,
+                    'resume': self.resume, 'reshuffle': self.reshuffle}
+        self.control = ControlServer(self.dj._status, commands,
+                                     host=settings.get('host', CONTROL_HOST),
+                                     port=settings.get('port', CONTROL_PORT))
+        self._add_metrics_routes(self.control)
+        try:
+            await self.control.start()
+            self.dj.control = self.control
+        except OSError as e:
+            print(f"[X] Could not start control API: {e}")
+            self.control = None
+
+    # --- metrics -------------------------------------------------------------------
+
+    def _add_metrics_routes(self, server):
+        server.add_route('GET', '/metrics', self._get_metrics)
+        server.add_route('GET', '/metrics.json', self._get_metrics_json)
+
+    async def _get_metrics(self, request):
+        return 200, metrics.REGISTRY.render(), PROMETHEUS_CONTENT_TYPE
+
+    async def _get_metrics_json(self, request):
+        return 200, metrics.REGISTRY.snapshot()
+
+    async def _start_metrics(self):
+        """A metrics-only listener for scrapers, and the periodic JSON dump"""
+        settings = self.dj.config.get('metrics')
+        if not settings:
+            return
+        if settings.get('dump_interval', DUMP_INTERVAL):
+            self.metrics_dump = asyncio.create_task(self._dump_metrics_loop(settings))
+        if not settings.get('port', METRICS_PORT):
+            return
+        self.metrics_server = ControlServer(self.dj._status, {}, host=settings.get('host', CONTROL_HOST),
+                                            port=settings.get('port', METRICS_PORT), name="Metrics")
+        self._add_metrics_routes(self.metrics_server)
+        try:
+            await self.metrics_server.start()
+        except OSError as e:
+            print(f"[X] Could not start metrics endpoint: {e}")
+            self.metrics_server = None
+
+    async def _dump_metrics_loop(self, settings):
+        while True:
+            try:
+                await asyncio.wait_for(self.stopping.wait(), settings.get('dump_interval', DUMP_INTERVAL))
+                return  # _shutdown writes the last dump once everything has stopped
+            except asyncio.TimeoutError:
+                await self._dump_metrics(settings)
+
+    @staticmethod
+    async def _dump_metrics(settings):
+        content = json.dumps(metrics.REGISTRY.snapshot(), indent=2)
+        try:
+            await asyncio.to_thread(atomic_write, settings.get('dump_file', METRICS_FILE), content)
+        except OSError as e:
+            print(f"[X] Could not write metrics: {e}")
+
+    async def _start_stream_server(self):
+        server = self.dj.stream_server
+        if not server:
+            return
+        try:
+            await server.start()
+        except OSError as e:
+            print(f"[X] Could not start audio stream server: {e}")
+            self.dj.stream_server = None
+            if self.dj.audio_only:
+                # Nothing else would carry the audio anywhere
+                self.failed = True
+                self.stop()
+
+    async def skip(self):
+        if self.stream_mode:
+            if not self.dj.engine:
+                raise CommandError("Streaming engine is not running")
+            self.dj.engine.skip()
+        else:
+            # The concat playlist cannot jump ahead; rewrite it from the next song and restart
+            await asyncio.to_thread(self.dj._generate_playlist)
+            self.restart_requested.set()
+        return 'skipped'
+
+    async def pause(self):
+        if not self.stream_mode or not self.dj.engine:
+            raise CommandError("Pause needs audio_engine 'stream'")
+        self.dj.pause()
+        return 'paused'
+
+    async def resume(self):
+        if not self.stream_mode or not self.dj.engine:
+            raise CommandError("Resume needs audio_engine 'stream'")
+        self.dj.resume()
+        return 'resumed'
+
+    async def reshuffle(self):
+        self.dj.playlist_source.reshuffle()
+        await asyncio.to_thread(self.dj._generate_playlist)
+        if not self.stream_mode:
+            self.restart_requested.set()
+        return 'reshuffled'
+
+    # --- ffmpeg -> ffplay pipeline -------------------------------------------------
+
+    async def _spawn_pipeline(self):
+        ffmpeg_cmd, ffplay_cmd = self.stream_commands()
+        read_fd, write_fd = os.pipe()
+        try:
+            self.ffmpeg = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdout=write_fd,
+                stderr=asyncio.subprocess.PIPE,
+                creationflags=CREATE_NO_WINDOW
+            )
+            self.ffplay = await asyncio.create_subprocess_exec(
+                *ffplay_cmd,
+                stdin=read_fd,
+                creationflags=CREATE_NO_WINDOW
+            )
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+        self.dj.registry.register('ffmpeg', self.ffmpeg.pid)
+        self.dj.registry.register('ffplay', self.ffplay.pid)
+
+    async def _pipeline_loop(self):
+        quick_crashes = 0
+        down_since = None
+        while not self.stopping.is_set():
+            self.restart_requested.clear()
+            try:
+                await self._spawn_pipeline()
+            except OSError as e:
+                print(f"Error starting stream: {e}")
+                RESTARTS.labels('pipeline', 'start_failed').inc()
+                await self._stop_pipeline()
+                if await self._backoff(quick_crashes):
+                    return
+                quick_crashes += 1
+                continue
+            print("\n[OK] FFmpeg stream running")
+
+            started = time.monotonic()
+            if down_since is not None:
+                DOWNTIME.labels('pipeline').observe(started - down_since)
+            monitor = asyncio.create_task(self._monitor_stderr(self.ffmpeg))
+            reason = await self._wait_first(
+                self.ffmpeg.wait(),
+                self.ffplay.wait(),
+                self.restart_requested.wait(),
+                self.stopping.wait()
+            )
+            # A clean exit means concat reached the end of the queued songs
+            finished = reason == 0 and self.ffmpeg.returncode == 0
+            if finished and await self._wait_first(
+                    self.ffplay.wait(),  # -autoexit: gone once the last song has been heard
+                    asyncio.sleep(DRAIN_SECONDS),
+                    self.stopping.wait()) == 2:
+                reason = 3
+            down_since = time.monotonic()
+            await self._stop_pipeline()
+            monitor.cancel()
+
+            if reason == 3:
+                return
+            if finished:
+                print("\n=== Queued songs have been played! Queuing the next ones... ===")
+                RESTARTS.labels('pipeline', 'window').inc()
+                await asyncio.to_thread(self.dj._generate_playlist)
+                quick_crashes = 0
+                continue
+            if reason == 2:
+                RESTARTS.labels('pipeline', 'requested').inc()
+                quick_crashes = 0
+                continue
+
+            crashed = "FFmpeg" if reason == 0 else "ffplay"
+            RESTARTS.labels('pipeline', f'{crashed.lower()}_exit').inc()
+            print(f"\n{crashed} exited, restarting audio pipeline! Attempt {quick_crashes + 1}")
+            if time.monotonic() - started < QUICK_CRASH_SECONDS:
+                quick_crashes += 1
+            else:
+                quick_crashes = 0
+
+            # If too many failures, regenerate playlist
+            if quick_crashes >= MAX_QUICK_CRASHES:
+                print("Multiple FFmpeg failures, regenerating playlist...")
+                await asyncio.to_thread(self.dj._generate_playlist)
+                quick_crashes = 0
+            elif await self._backoff(quick_crashes):
+                return
+
+    async def _backoff(self, failures):
+        """Sleep before a restart; returns True if shutdown was requested meanwhile"""
+        delay = min(failures * 2, 30)  # Max 30 second delay
+        if not delay:
+            return self.stopping.is_set()
+        try:
+            await asyncio.wait_for(self.stopping.wait(), delay)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _monitor_stderr(self, process):
+        """Turn FFmpeg's stderr into song changes and status updates"""
+        parser = FFmpegEventParser()
+        while True:
+            data = await process.stderr.read(65536)
+            if not data:
+                break
+            received = time.monotonic()
+            STDERR_BYTES.inc(len(data))
+            STDERR_LINES.inc(data.count(b'\n') + data.count(b'\r'))
+            for event in parser.feed(data):
+                await self._handle_event(event, received)
+
+    async def _handle_event(self, event, received=None):
+        if event.kind == TRACK_OPEN:
+            self.dj._on_song_started(event.data, received)
+        elif event.kind == PROGRESS:
+            self.dj._on_progress()
+        elif event.kind == ERROR:
+            FFMPEG_ERRORS.inc()
+            print(f"\nFFmpeg error: {event.data}")
+
+    async def _stop_pipeline(self):
+        """Stop ffmpeg first so nothing is left writing into ffplay, then ffplay"""
+        for process in (self.ffmpeg, self.ffplay):
+            if process is not None:
+                await self._terminate(process)
+                self.dj.registry.unregister(process.pid)
+        self.ffmpeg = self.ffplay = None
+
+    @staticmethod
+    async def _terminate(process):
+        if process.returncode is not None:
+            return
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        except ProcessLookupError:
+            pass
+
+    # --- in-process streaming engine -----------------------------------------------
+
+    async def _engine_loop(self):
+        quick_crashes = 0
+        down_since = None
+        while not self.stopping.is_set():
+            try:
+                await asyncio.to_thread(self.dj._start_engine)
+            except (OSError, ValueError) as e:
+                # e.g. ffplay missing, or an unknown transition mode
+                print(f"Error starting streaming engine: {e}")
+                RESTARTS.labels('engine', 'start_failed').inc()
+                quick_crashes += 1
+                if await self._backoff(quick_crashes):
+                    return
+                continue
+            started = time.monotonic()
+            if down_since is not None:
+                DOWNTIME.labels('engine').observe(started - down_since)
+            engine = self.dj.engine
+            reason = await self._wait_first(
+                asyncio.to_thread(engine.thread.join),
+                self.stopping.wait()
+            )
+            if reason == 1:
+                return
+            down_since = time.monotonic()
+            RESTARTS.labels('engine', 'crash').inc()
+            print(f"\nStreaming engine stopped! Restarting... Attempt {quick_crashes + 1}")
+            if down_since - started < QUICK_CRASH_SECONDS:
+                quick_crashes += 1
+            else:
+                quick_crashes = 0
+            if await self._backoff(quick_crashes):
+                return
+
+    # --- OBS -----------------------------------------------------------------------
+
+    async def _obs_loop(self):
+        if self.dj.obs_startup is not None:
+            # Audio is already playing while OBS finishes starting up
+            reason = await self._wait_first(
+                asyncio.wrap_future(self.dj.obs_startup),
+                self.stopping.wait()
+            )
+            if reason == 1:
+                return
+            if not self.dj.obs_startup.result():
+                print("[X] Failed to start OBS after 3 attempts")
+                self.failed = True
+                self.stop()
+                return
+        while not self.stopping.is_set():
+            process = self.dj.obs_process
+            if process is None:
+                return
+            reason = await self._wait_first(
+                asyncio.to_thread(process.wait),
+                self.stopping.wait()
+            )
+            if reason == 1:
+                return
+            down_since = time.monotonic()
+            RESTARTS.labels('obs', 'crash').inc()
+            print("\nOBS crashed! Restarting...")
+            if await asyncio.to_thread(self.dj._start_obs):
+                DOWNTIME.labels('obs').observe(time.monotonic() - down_since)
+
+    async def _shutdown(self):
+        """Ordered shutdown: stream listeners, control API, audio producer, audio output, then OBS"""
+        server = self.dj.stream_server
+        if server:
+            await server.close()
+            stats = server.stats()
+            print(f"Audio stream: {stats['total_listeners']} listeners (peak {stats['peak_listeners']}), "
+                  f"{stats['resyncs']} resyncs, {stats['stalls']} dropped")
+        if self.control:
+            await self.control.close()
+            self.dj.control = None
+        if self.metrics_server:
+            await self.metrics_server.close()
+        await self._stop_pipeline()
+        if self.dj.engine:
+            await asyncio.to_thread(self.dj.engine.stop)
+            stats = self.dj.engine.buffer.stats()
+            print(f"Audio buffer: {stats['underruns']} underruns, {stats['overruns']} overruns "
+                  f"(output stalled over {self.dj.engine.buffer.stall_seconds:g}s), "
+                  f"high-water {stats['high_water']}/{stats['capacity']} bytes")
+            if hasattr(self.dj.engine.sink, 'stats'):
+                for output in self.dj.engine.sink.stats():
+                    print(f"Output {output['name']}: {output['resyncs']} resyncs, "
+                          f"{output['failures']} failures")
+        obs = self.dj.obs_process
+        if obs and obs.poll() is None:
+            obs.terminate()
+            try:
+                await asyncio.to_thread(obs.wait, SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                obs.kill()
+        if obs:
+            self.dj.registry.unregister(obs.pid)
+        if self.metrics_dump:
+            await self.metrics_dump
+            await self._dump_metrics(self.dj.config.get('metrics'))
@@ -0,0 +1,57 @@
+import os
+
+from smart_shuffle import smart_shuffle, path_artist_album
+
+
+def _library(total, dominant):
+    """`dominant` tracks by one artist, the rest by artists with 1-8 tracks each"""
+    tracks = [os.path.join('AudioSource', 'Big', f'album{i // 12}', f'{i:03d} - Track.mp3')
+              for i in range(dominant)]
+    artist = 0
+    while len(tracks) < total:
+        for i in range(1 + artist % 8):
+            tracks.append(os.path.join('AudioSource', f'artist{artist}', f'album{i // 4}',
+                                       f'{i:02d} - Track.mp3'))
+        artist += 1
+    return tracks[:total]
+
+
+def _artist_gaps(tracks, order):
+    """Tracks between consecutive songs of each artist, by artist"""
+    last = {}
+    gaps = {}
+    for position, index in enumerate(order):
+        artist = path_artist_album(tracks[index])[0]
+        if artist in last:
+            gaps.setdefault(artist, []).append(position - last[artist] - 1)
+        last[artist] = position
+    return gaps
+
+
+def test_keeps_the_artist_gap():
+    tracks = _library(2000, 0)
+    order = smart_shuffle(tracks, 7)
+    assert sorted(order) == list(range(len(tracks)))
+    gaps = [gap for artist_gaps in _artist_gaps(tracks, order).values() for gap in artist_gaps]
+    assert min(gaps) >= 5
+    assert sum(gaps) / len(gaps) > 50
+
+
+def test_over_represented_artist_is_still_spread():
+    tracks = _library(1000, 400)
+    for artist_gap in (1, 2, 5):
+        order = smart_shuffle(tracks, 3, artist_gap=artist_gap)
+        assert sorted(order) == list(range(len(tracks)))
+        gaps = _artist_gaps(tracks, order)
+        # 600 other tracks for 399 spaces: at least one in each, 1.5 on average
+        big = gaps.pop('Big')
+        assert min(big) >= 1
+        assert sum(big) / len(big) >= 1.45
+        # ...and the other artists keep the configured gap
+        assert min(gap for artist_gaps in gaps.values() for gap in artist_gaps) >= artist_gap
+
+
+def test_same_seed_same_order():
+    tracks = _library(500, 100)
+    assert smart_shuffle(tracks, 1) == smart_shuffle(tracks, 1)
+    assert smart_shuffle(tracks, 1) != smart_shuffle(tracks, 2)
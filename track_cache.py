@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict, deque
+
+from audio_engine import SAMPLE_RATE, CHANNELS, CREATE_NO_WINDOW
+
+TRACK_CACHE_DIR = "track_cache"
+CACHE_FORMATS = {
+    # Raw PCM in the engine's own format: nothing left to decode at playback
+    'pcm': {
+        'extension': '.pcm',
+        'encode': ['-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE), '-f', 's16le'],
+        'input': ['-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', str(CHANNELS)],
+    },
+    # About a tenth of the size, still far cheaper to decode than FLAC
+    'opus': {
+        'extension': '.opus',
+        'encode': ['-ac', str(CHANNELS), '-c:a', 'libopus', '-b:a', '160k', '-f', 'opus'],
+        'input': [],
+    },
+}
+
+
+class TrackCache:
+    """Local, size-capped copies of upcoming tracks in a fast-to-read format.
+
+    Entries are keyed by source path, size, mtime and the gain baked into
+    them, so an edited file or a new loudness measurement simply misses.
+    Transcodes run on one background thread; the least recently played
+    entries are evicted once the cache grows past max_bytes. File mtimes
+    double as the LRU order, so it survives restarts.
+    """
+    def __init__(self, directory=TRACK_CACHE_DIR, max_bytes=5 * 1024 ** 3, fmt='pcm',
+                 ffmpeg_path='ffmpeg', gain_of=None):
+        self.logger = logging.getLogger('TrackCache')
+        if fmt not in CACHE_FORMATS:
+            raise ValueError(f"Unknown track cache format: {fmt}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.format = fmt
+        self.extension = CACHE_FORMATS[fmt]['extension']
+        self.input_args = CACHE_FORMATS[fmt]['input']
+        self.ffmpeg_path = ffmpeg_path
+        self.gain_of = gain_of
+        self.lock = threading.Lock()
+        self.pending = deque()
+        self.pending_ready = threading.Condition(self.lock)
+        self.queued = set()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.entries = OrderedDict()  # name -> size, least recently used first
+        self.total_bytes = 0
+        existing = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)  # Left over from an interrupted transcode
+            elif entry.name.endswith(self.extension):
+                st = entry.stat()
+                existing.append((st.st_mtime, entry.name, st.st_size))
+        for _, name, size in sorted(existing):
+            self.entries[name] = size
+            self.total_bytes += size
+        threading.Thread(target=self._transcode_worker, daemon=True).start()
+
+    def _key(self, path, gain_db):
+        st = os.stat(path)
+        digest = hashlib.sha1(
+            f"{path}\0{st.st_size}\0{st.st_mtime_ns}\0{gain_db:.1f}".encode('utf-8')).hexdigest()
+        return digest + self.extension
+
+    def _gain(self, path):
+        return self.gain_of(path) if self.gain_of else 0.0
+
+    def lookup(self, path, gain_db=None):
+        """Cached file for a track (with its gain baked in), or None"""
+        try:
+            name = self._key(path, self._gain(path) if gain_db is None else gain_db)
+        except OSError:
+            return None
+        with self.lock:
+            if name not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+        cached = os.path.join(self.directory, name)
+        try:
+            os.utime(cached)
+        except OSError:
+            pass
+        return cached
+
+    def prefetch(self, paths):
+        """Queue tracks for transcoding in the order given"""
+        with self.lock:
+            for path in paths:
+                if path not in self.queued:
+                    self.queued.add(path)
+                    self.pending.append(path)
+            self.pending_ready.notify()
+
+    def _transcode_worker(self):
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.pending_ready.wait()
+                path = self.pending.popleft()
+                self.queued.discard(path)
+            try:
+                gain_db = self._gain(path)
+                name = self._key(path, gain_db)
+                with self.lock:
+                    if name in self.entries:
+                        continue
+                self._transcode(path, name, gain_db)
+            except Exception as e:
+                self.logger.warning(f"Could not cache {path}: {e}")
+
+    def _transcode(self, path, name, gain_db):
+        target = os.path.join(self.directory, name)
+        tmp_path = target + '.tmp'
+        gain = ['-af', f'volume={gain_db:.2f}dB'] if abs(gain_db) >= 0.01 else []
+        result = subprocess.run(
+            [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y',
+             '-i', path, '-vn', *gain, *CACHE_FORMATS[self.format]['encode'], tmp_path],
+            capture_output=True, text=True, creationflags=CREATE_NO_WINDOW)
+        if result.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(result.stderr.strip() or f"ffmpeg exited with {result.returncode}")
+        os.replace(tmp_path, target)
+        size = os.path.getsize(target)
+        with self.lock:
+            self.entries[name] = size
+            self.total_bytes += size
+        self.logger.info(f"Cached {os.path.basename(path)} ({size / 1024 ** 2:.1f} MB)")
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits its cap again"""
+        with self.lock:
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    # Most likely still open for playback (Windows); retry on the next eviction
+                    self.logger.debug(f"Could not evict {name}: {e}")
+                    self.entries[name] = size
+                    self.entries.move_to_end(name, last=False)
+                    self.total_bytes += size
+                    break
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes,
+                    'hits': self.hits, 'misses': self.misses}
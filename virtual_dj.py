@@ -1,14 +1,33 @@
+import asyncio
 import os
-import random
-import json
 import time
 import subprocess
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 import psutil
-from threading import Thread
-
-# CONFIGURATION
-AUDIO_SOURCE = "AudioSource"
+from library_index import LibraryIndex, LIBRARY_INDEX_FILE
+from metadata_cache import MetadataCache, METADATA_CACHE_FILE, probe_file
+from bulk_probe import BulkProber
+from loudness import LoudnessAnalyzer, track_gain, TARGET_LOUDNESS, MAX_GAIN
+from track_cache import TrackCache, TRACK_CACHE_DIR
+from audio_engine import StreamingEngine, FFplaySink, CREATE_NO_WINDOW
+from fanout import FanOutSink, ClockSink, sink_from_config, QUEUE_MS
+from stream_server import StreamServer, EncoderSink
+from ffmpeg_events import STDERR_ARGS
+from supervisor import DJSupervisor
+from playlist_source import PlaylistSource, PLAYLIST_STATE_FILE
+from smart_shuffle import smart_shuffle, ARTIST_GAP, ALBUM_GAP
+from play_history import PlayHistory
+from config_service import get_config, ConfigError
+from library_watcher import LibraryWatcher, DEBOUNCE_SECONDS, POLL_SECONDS
+from process_registry import get_registry, AdoptedProcess, PID_FILE, SCAN_INTERVAL
+from startup import StartupTimer, DeviceCache, DEVICE_CACHE_HOURS, wait_until, port_open
+from status_output import (StatusWriter, TextStatusOutput, JsonStatusOutput,
+                           CountdownStatusOutput, STATUS_FILE)
+import metrics
+
+# CONFIGURATION (defaults; config.json overrides the paths and cable name)
 PLAYLIST_FILE = "Playlist.m3u"
 LOG_FILE = "played_songs.log"
 VIRTUAL_CABLE_NAME = "CABLE Input (VB-Audio Virtual Cable)"
@@ -25,17 +44,43 @@ VIRTUAL_CABLE_VARIANTS = [
     "VB-Cable",
     "CABLE Output (VB-Audio Virtual Cable)"
 ]
+KILL_WAIT_SECONDS = 5      # Longest wait for leftover processes to exit
+OBS_READY_TIMEOUT = 15     # Longest wait for OBS to come up before carrying on anyway
+OBS_WEBSOCKET_PORT = 4455  # OBS counts as ready once its WebSocket server accepts connections
+OBS_MIN_ALIVE = 2          # ...or, with the WebSocket probe disabled, once it has stayed up this long
+EARLY_CHANGE_SECONDS = 5   # A song replaced this long before its end was skipped, not finished
+
+SONG_CHANGE_LATENCY = metrics.histogram(
+    'dj_song_change_seconds', "From a track change being reported to the new status being published")
+TRACK_GAP = metrics.histogram('dj_track_gap_seconds', "Silence between the end of a song and the next one")
+SONGS_STARTED = metrics.counter('dj_songs_started_total', "Songs that started playing")
+EARLY_CHANGES = metrics.counter('dj_songs_cut_short_total', "Songs replaced well before their end")
+
+def ffmpeg_path():
+    return get_config().get('ffmpeg_path', FFMPEG_PATH)
+
+def ffmpeg_tool(name):
+    """Path of ffplay/ffprobe, installed next to the configured ffmpeg"""
+    return os.path.join(os.path.dirname(ffmpeg_path()), name)
+
+def obs_path():
+    return get_config().get('obs_path', OBS_PATH)
+
+def cable_variants():
+    """Device names to look for, the configured cable name first"""
+    configured = get_config().get('virtual_cable_name', VIRTUAL_CABLE_NAME)
+    return [configured] + [v for v in VIRTUAL_CABLE_VARIANTS if v != configured]
 
 class AudioDevices:
     """Class to handle audio device management"""
     def __init__(self):
-        self.device_name = "CABLE Input (VB-Audio Virtual Cable)"
+        self.device_name = None  # Until detected, the configured cable name
         
     def set_device(self, name):
         self.device_name = name
         
     def get_device(self):
-        return self.device_name
+        return self.device_name or cable_variants()[0]
 
 # Create global instance
 audio_devices = AudioDevices()
@@ -49,7 +94,7 @@ def check_dependencies():
         print("Checking FFmpeg devices...")
         dshow_check = subprocess.run(
             [
-                FFMPEG_PATH,
+                ffmpeg_path(),
                 '-hide_banner',
                 '-f', 'dshow',
                 '-list_devices', 'true',
@@ -61,21 +106,19 @@ def check_dependencies():
         
         # The "Error opening input file dummy" is expected and normal
         # We just need to verify that devices were listed before that error
-        if '"CABLE Output (VB-Audio Virtual Cable)" (audio)' in dshow_check.stderr:
-            print("[OK] Found VB-Audio Virtual Cable")
-            print("[OK] DirectShow support verified")
-            
-            # Extract the exact device name and ID
+        device = None
+        for variant in cable_variants():
             for line in dshow_check.stderr.split('\n'):
-                if 'CABLE Output (VB-Audio Virtual Cable)' in line:
-                    if 'Alternative name' in line:
-                        # Use the device ID for better compatibility
-                        device_id = line.split('"')[1]
-                        audio_devices.set_device(device_id)
-                    else:
-                        # Use the friendly name as fallback
-                        audio_devices.set_device("CABLE Output (VB-Audio Virtual Cable)")
+                if variant.lower() in line.lower() and '(audio)' in line and '"' in line:
+                    device = line.split('"')[1]
                     break
+            if device:
+                break
+
+        if device:
+            print("[OK] Found VB-Audio Virtual Cable")
+            print("[OK] DirectShow support verified")
+            audio_devices.set_device(device)
         else:
             print("[X] VB-Audio Virtual Cable not found")
             print("\nAvailable audio devices:")
@@ -92,18 +135,9 @@ def check_dependencies():
 def check_audio_device():
     """Enhanced audio device detection without global variables"""
     try:
-        # Windows PowerShell device listing
-        ps_cmd = 'Get-WmiObject Win32_SoundDevice | Select-Object Name, Status | Format-List'
-        ps_process = subprocess.run(['powershell', '-Command', ps_cmd], 
-                                  capture_output=True, 
-                                  text=True)
-        
-        print("\nWindows Audio Devices:")
-        print(ps_process.stdout)
-        
         # FFmpeg device listing
-        cmd1 = [FFMPEG_PATH, '-list_devices', 'true', '-f', 'dshow', '-i', 'dummy']
-        cmd2 = [FFMPEG_PATH, '-f', 'dshow', '-list_options', 'true', '-i', 'audio=dummy']
+        cmd1 = [ffmpeg_path(), '-list_devices', 'true', '-f', 'dshow', '-i', 'dummy']
+        cmd2 = [ffmpeg_path(), '-f', 'dshow', '-list_options', 'true', '-i', 'audio=dummy']
         
         for cmd in [cmd1, cmd2]:
             try:
@@ -113,7 +147,7 @@ def check_audio_device():
                     print(result.stderr)
                     
                     stderr_lower = result.stderr.lower()
-                    for variant in VIRTUAL_CABLE_VARIANTS:
+                    for variant in cable_variants():
                         if variant.lower() in stderr_lower:
                             lines = result.stderr.split('\n')
                             for line in lines:
@@ -132,6 +166,15 @@ def check_audio_device():
                 continue
         
         print("\n[X] VB-Audio Cable not found!")
+
+        # Windows PowerShell device listing, only needed to troubleshoot
+        ps_cmd = 'Get-WmiObject Win32_SoundDevice | Select-Object Name, Status | Format-List'
+        ps_process = subprocess.run(['powershell', '-Command', ps_cmd],
+                                  capture_output=True,
+                                  text=True)
+        print("\nWindows Audio Devices:")
+        print(ps_process.stdout)
+
         print("\nTroubleshooting steps:")
         print("1. Open Windows Sound settings")
         print("2. Check if 'CABLE Input' appears in both Playback and Recording")
@@ -139,7 +182,7 @@ def check_audio_device():
         print("4. Try setting it as the default device")
         print("5. Restart your computer if recently installed")
         print("\nExpected device names:")
-        for variant in VIRTUAL_CABLE_VARIANTS:
+        for variant in cable_variants():
             print(f"- {variant}")
         return False
         
@@ -147,17 +190,30 @@ def check_audio_device():
         print(f"Error checking audio devices: {e}")
         return False
 
-def start_stream(playlist_file):
-    """Start audio stream with basic settings"""
-    if not check_audio_device():
-        return False, False
+def detect_audio_device(cache=None, list_variants=True):
+    """check_dependencies (and check_audio_device), skipped while a cached result is valid"""
+    key = DeviceCache.key(ffmpeg_path(), cable_variants()[0])
+    if cache:
+        device = cache.lookup(key)
+        if device:
+            audio_devices.set_device(device)
+            print(f"[OK] Using audio device: {device} (cached)")
+            return True
+    if not check_dependencies() or (list_variants and not check_audio_device()):
+        if cache:
+            cache.invalidate()
+        return False
+    if cache:
+        cache.store(key, audio_devices.get_device())
+    return True
 
+def stream_commands(playlist_file):
+    """Build the ffmpeg (concat decoder) and ffplay (output) command lines"""
     # Use simple, working FFmpeg command
     command = [
-        FFMPEG_PATH,
+        ffmpeg_path(),
         '-hide_banner',
-        '-loglevel', 'debug',
-        '-stream_loop', '-1',
+        *STDERR_ARGS,         # Debug logs (for the Opening lines) plus -progress blocks on stderr
         '-f', 'concat',
         '-safe', '0',
         '-i', playlist_file,
@@ -170,92 +226,86 @@ def start_stream(playlist_file):
         '-'
     ]
 
-    try:
-        ffmpeg_process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        
-        # Pipe to ffplay
-        ffplay_cmd = [
-            os.path.join(os.path.dirname(FFMPEG_PATH), 'ffplay'),
-            '-f', 'wav',
-            '-nodisp',
-            '-autoexit',
-            '-loglevel', 'quiet',
-            '-'
-        ]
-        
-        ffplay_process = subprocess.Popen(
-            ffplay_cmd,
-            stdin=ffmpeg_process.stdout,
-            creationflags=subprocess.CREATE_NO_WINDOW
-        )
-        
-        return ffmpeg_process, ffplay_process
-        
-    except Exception as e:
-        print(f"Error starting stream: {e}")
-        return False, False
-
-def kill_existing_processes():
-    """Kill any existing FFmpeg or OBS processes"""
-    killed = False
-    try:
-        for proc in psutil.process_iter(['name', 'pid']):
+    # Pipe to ffplay
+    ffplay_cmd = [
+        ffmpeg_tool('ffplay'),
+        '-f', 'wav',
+        '-nodisp',
+        '-autoexit',
+        '-loglevel', 'quiet',
+        '-'
+    ]
+    return command, ffplay_cmd
+
+def kill_existing_processes(registry, by_name=False):
+    """Kill FFmpeg, ffplay and OBS processes left over from an earlier run.
+
+    Only processes that the pidfile says a finished run started are touched,
+    so unrelated ffmpeg jobs on the same machine survive. by_name also kills
+    every ffmpeg, ffplay and OBS process found by a full process-table scan.
+    """
+    leftovers = registry.alive(leftovers=True)
+    if by_name:
+        own_pid = os.getpid()
+        for proc in registry.scan(['ffmpeg.exe', 'ffplay.exe', 'obs64.exe']):
             try:
-                # Check for FFmpeg and OBS processes
-                if proc.info['name'].lower() in ['ffmpeg.exe', 'ffplay.exe', 'obs64.exe']:
-                    process = psutil.Process(proc.info['pid'])
-                    print(f"Killing existing {proc.info['name']} (PID: {proc.info['pid']})")
-                    process.kill()
-                    killed = True
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                # Spare the ones this startup is already running side by side (device detection)
+                if proc.ppid() != own_pid and proc not in leftovers:
+                    leftovers.append(proc)
+            except psutil.Error:
                 continue
-    except Exception as e:
-        print(f"Error checking processes: {e}")
-    
-    if killed:
+
+    for proc in leftovers:
+        try:
+            print(f"Killing existing {proc.name()} (PID: {proc.pid})")
+        except psutil.Error:
+            continue
+    if leftovers:
         print("Waiting for processes to close...")
-        time.sleep(2)
+        # Returns as soon as they are gone rather than after a fixed sleep
+        alive = registry.kill(leftovers, timeout=KILL_WAIT_SECONDS)
+        if alive:
+            print(f"[X] {len(alive)} processes still running after {KILL_WAIT_SECONDS}s")
 
-def check_audio_files():
+def check_audio_files(library=None):
     """Check for audio files recursively in all configured locations"""
-    with open('config.json', 'r') as f:
-        config = json.load(f)
-    
+    config = get_config()
     audio_sources = config['audio_sources']
-    audio_files = []
+    if library is None:
+        library = LibraryIndex(config.get('library_index', LIBRARY_INDEX_FILE))
     
     print("\nScanning for audio files...")
+    available = []
     for source in audio_sources:
         if not os.path.exists(source):
             print(f"\nWarning: Source folder not found: {source}")
             continue
-            
-        print(f"\nScanning: {source}")
-        for root, _, files in os.walk(source):
-            for file in files:
-                if file.lower().endswith(('.mp3', '.wav', '.flac')):
-                    audio_files.append(os.path.join(root, file))
+        available.append(source)
+
+    stats = library.scan(audio_sources)
+    print(f"Library index updated: {stats['added']} added, {stats['changed']} changed, "
+          f"{stats['removed']} removed ({stats['dirs_listed']} folders re-read)")
+    audio_files = library.tracks(available)
 
     if not audio_files:
-        print(f"\n[ERROR] No audio files found in any source folders:")
-        for source in audio_sources:
-            print(f"- {source}")
-        print("\nPlease add supported audio files:")
-        print("- MP3 files (*.mp3)")
-        print("- WAV files (*.wav)")
-        print("- FLAC files (*.flac)")
+        report_missing_audio(audio_sources)
         return False
 
     print(f"\nFound {len(audio_files)} audio files total")
     return True
 
+def report_missing_audio(audio_sources):
+    print(f"\n[ERROR] No audio files found in any source folders:")
+    for source in audio_sources:
+        print(f"- {source}")
+    print("\nPlease add supported audio files:")
+    print("- MP3 files (*.mp3)")
+    print("- WAV files (*.wav)")
+    print("- FLAC files (*.flac)")
+
 class CurrentSong:
-    def __init__(self):
+    def __init__(self, metadata=None):
+        self.metadata = metadata
         self.title = "No song playing"
         self.artist = "Unknown"
         self.album = "Unknown"
@@ -277,20 +327,28 @@ class CurrentSong:
             
             self.path = file_path
             self.start_time = time.time()
-            # Get audio duration using ffprobe
-            result = subprocess.run([
-                os.path.join(os.path.dirname(FFMPEG_PATH), 'ffprobe'),
-                '-v', 'error',
-                '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1',
-                file_path
-            ], capture_output=True, text=True)
-            self.duration = float(result.stdout)
+            self.duration = self._lookup_duration(file_path)
             return True
         except Exception as e:
             print(f"Error parsing song info: {e}")
             return False
 
+    def _lookup_duration(self, file_path):
+        """Get the duration from the metadata cache, probing in the background if needed"""
+        if self.metadata is None:
+            ffprobe = ffmpeg_tool('ffprobe')
+            return probe_file(file_path, ffprobe)['duration']
+
+        # Always re-validate in the background; a stale entry is still a good guess
+        self.metadata.refresh(file_path, callback=self._on_metadata)
+        entry = self.metadata.lookup(file_path)
+        return entry['duration'] if entry else 0
+
+    def _on_metadata(self, file_path, entry):
+        """Apply a background probe result if the song is still playing"""
+        if entry and file_path == self.path:
+            self.duration = entry['duration']
+
     def get_status(self):
         if not self.start_time:
             return "Waiting..."
@@ -303,126 +361,224 @@ class CurrentSong:
 
 class VirtualDJ:
     def __init__(self):
-        self.ffmpeg_process = None
         self.obs_process = None
         self.running = True
-        self.playlist_update_interval = 10800  # 3 hours in seconds
-        self.current_song = CurrentSong()
+        self.current_song = None
         self.last_status_update = 0
         self.status_update_interval = 1  # Update every second
         self.songs_in_playlist = 0
         self.songs_played = 0
-
-        # Load configuration
-        with open('config.json', 'r') as f:
-            self.config = json.load(f)
-
-    def _generate_playlist(self):
-        """Create shuffled playlist with recursive folder support"""
+        self.window_size = 0
+        self.library_probed = False
+        self.engine = None
+        self.watcher = None
+        self.control = None
+        self.paused_at = None
+        self.startup = None       # StartupTimer until the first song plays
+        self.obs_startup = None   # Future: True once OBS is up, False if it never came up
+
+        # Shared, hot-reloaded configuration
+        self.config = get_config()
+        processes = self.config.get('processes', {})
+        self.registry = get_registry(processes.get('pid_file', PID_FILE),
+                                     processes.get('scan_interval', SCAN_INTERVAL))
+
+        # Persistent library index shared by the startup check and playlist generation
+        self.library = LibraryIndex(self.config.get('library_index', LIBRARY_INDEX_FILE))
+        self.metadata = MetadataCache(
+            self.config.get('metadata_cache', METADATA_CACHE_FILE),
+            ffprobe_path=ffmpeg_tool('ffprobe'))
+        self.prober = BulkProber(self.metadata, workers=self.config.get('probe_workers'))
+        loudness = self.config.get('loudness', {})
+        self.loudness = LoudnessAnalyzer(self.metadata, ffmpeg_path(), loudness.get('workers')) \
+            if loudness.get('enabled') else None
+        self.track_cache = self._build_track_cache()
+        self.current_song = CurrentSong(self.metadata)
+        history = self.config.get('history', {})
+        self.history = PlayHistory(LOG_FILE) if history.get('enabled', True) else None
+        self.playlist_source = PlaylistSource(
+            self.config.get('playlist_state', PLAYLIST_STATE_FILE),
+            order=self._shuffle_order(),
+            history=self.history,
+            recency={k: history[k] for k in ('recent_hours', 'weight') if k in history})
+        self.status_writer = self._build_status_writer()
+        self.stream_server = self._build_stream_server()
+        # Listeners get the audio straight from the stream server: no OBS, no virtual cable
+        self.audio_only = self.stream_server is not None and \
+            self.config.get('http_stream', {}).get('replace_obs', True)
+        self.config.subscribe(self._on_sources_changed, ['audio_sources'])
+        self.config.subscribe(self._on_tools_changed, ['ffmpeg_path'])
+        self.config.subscribe(lambda changes, config: self._rebuild_status_writer(),
+                              ['status_outputs'])
+
+    def _refresh_library(self):
+        """Rescan the configured sources and hand the track list to the shuffle"""
+        # Incremental rescan: only folders whose mtime changed are re-read
+        stats = self.library.scan(self.config['audio_sources'])
+        sources = [s for s in self.config['audio_sources'] if os.path.exists(s)]
+        all_songs = self.library.tracks(sources)
+
+        if not all_songs:
+            raise Exception("No audio files found in source directories")
+
+        print(f"\nFound {len(all_songs)} total audio files")
+
+        # The shuffle is a seeded permutation read on demand; only its
+        # position is stored, so a restart carries on where it left off
+        source = self.playlist_source
+        source.set_tracks(all_songs)
+        self.songs_in_playlist = len(source)
+        self.songs_played = min(source.index, len(source))
+        return stats, all_songs
+
+    def _generate_playlist(self, refreshed=None):
+        """Refresh the library and queue the next window of the shuffle in the concat playlist.
+
+        refreshed is the result of a _refresh_library call made just before,
+        so startup does not walk the library twice.
+        """
         try:
-            # Recursive search for audio files
-            all_songs = []
-            for source in self.config['audio_sources']:
-                for root, _, files in os.walk(source):
-                    for file in files:
-                        if file.lower().endswith(('.mp3', '.wav', '.flac')):
-                            full_path = os.path.abspath(os.path.join(root, file))
-                            all_songs.append(full_path)
-
-            if not all_songs:
-                raise Exception("No audio files found in source directories")
-
-            print(f"\nFound {len(all_songs)} total audio files")
-
-            # Create shuffled playlist
-            random.shuffle(all_songs)
-            self.songs_in_playlist = len(all_songs)
-            self.songs_played = 0
-
-            # Write playlist
+            stats, all_songs = refreshed or self._refresh_library()
+            source = self.playlist_source
+            # By default queue the rest of the cycle, so ffmpeg restarts once per cycle
+            remaining = len(source) - source.index
+            size = self.config.get('playlist_window') or remaining or len(source)
+            # FFmpeg plays the concat window as written; the streaming engine asks for each track itself
+            pipe_mode = self.config.get('audio_engine', 'pipe') != 'stream'
+            window = source.queue(size) if pipe_mode else source.peek(size)
+            self.window_size = len(window)
+
+            # Write the rolling window of upcoming songs
             with open(PLAYLIST_FILE, "w", encoding='utf-8') as f:
-                for song in all_songs:
+                for song in window:
                     escaped_path = song.replace("'", "'\\''")
                     f.write(f"file '{escaped_path}'\n")
 
-            print(f"Created new playlist with {self.songs_in_playlist} songs")
+            print(f"Queued {self.window_size} songs (position {self.songs_played}/{self.songs_in_playlist})")
+            self._prefetch_upcoming()
+
+            # Warm the metadata cache so track changes never wait on ffprobe
+            if stats['added'] or stats['changed'] or not self.library_probed:
+                self._warm_caches_in_background(window, all_songs)
+                self.library_probed = True
+            else:
+                self._warm_caches_in_background(window, window)
             return True
 
         except Exception as e:
             print(f"Error generating playlist: {str(e)}")
             return False
 
-    def _verify_playlist(self, playlist_file):
-        """Verify playlist integrity"""
+    def _start_watcher(self):
+        """Follow new, removed and renamed files as they happen instead of waiting for a rescan"""
+        settings = self.config.get('watch', {})
+        if not settings.get('enabled', True):
+            return
+        self.watcher = LibraryWatcher(self.library, self.config['audio_sources'], self._on_library_changed,
+                                      debounce=settings.get('debounce_seconds', DEBOUNCE_SECONDS),
+                                      poll_interval=settings.get('poll_seconds', POLL_SECONDS))
+        self.watcher.start()
+
+    def _on_library_changed(self, stats):
+        """Put watcher-reported changes into the live shuffle (called on the watcher thread)"""
+        sources = [s for s in self.config['audio_sources'] if os.path.exists(s)]
+        all_songs = self.library.tracks(sources)
+        if not all_songs:
+            return
+        self.playlist_source.set_tracks(all_songs)
+        self.songs_in_playlist = len(self.playlist_source)
+        print(f"\nLibrary updated: {stats['added']} added, {stats['changed']} changed, "
+              f"{stats['removed']} removed ({self.songs_in_playlist} songs)")
+        if stats['added'] or stats['changed']:
+            self._warm_caches_in_background(self.playlist_source.peek(10), all_songs)
+
+    def _on_sources_changed(self, changes, config):
+        """Pick up added or removed audio sources without touching the audio pipeline"""
+        if self.watcher:
+            self.watcher.set_sources(config['audio_sources'])
         try:
-            # Check if FFmpeg can read the playlist
-            cmd = [
-                FFMPEG_PATH,
-                '-v', 'error',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', playlist_file,
-                '-f', 'null',
-                '-'
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
-        except Exception:
-            return False
+            stats, all_songs = self._refresh_library()
+            print(f"Library updated for new sources: {stats['added']} added, {stats['removed']} removed")
+            self._warm_caches_in_background(self.playlist_source.peek(10), all_songs)
+        except Exception as e:
+            print(f"Error applying new audio sources: {e}")
+
+    def _on_tools_changed(self, changes, config):
+        """Point background helpers at a new ffmpeg install; new processes use it anyway"""
+        self.metadata.ffprobe_path = ffmpeg_tool('ffprobe')
+        if self.loudness:
+            self.loudness.ffmpeg_path = ffmpeg_path()
+        if self.track_cache:
+            self.track_cache.ffmpeg_path = ffmpeg_path()
+
+    def _rebuild_status_writer(self):
+        self.status_writer = self._build_status_writer()
+        self._update_status_file()
 
-    def _start_ffmpeg(self):
-        """Start FFmpeg with better process handling"""
-        print("\n=== Starting FFmpeg ===")
-        
-        # Kill any existing FFmpeg process
-        if self.ffmpeg_process:
-            try:
-                self.ffmpeg_process.terminate()
-                time.sleep(2)
-                if self.ffmpeg_process.poll() is None:
-                    self.ffmpeg_process.kill()
-            except:
-                pass
-
-        # Start new FFmpeg process
-        process = start_stream(PLAYLIST_FILE)
-        if not process:
-            print("[X] FFmpeg failed to start - check error messages above")
-            return False
-            
-        self.ffmpeg_process = process
-        print("[OK] FFmpeg started successfully")
-        return True
+    def _shuffle_order(self):
+        """Artist/album-aware ordering when shuffle.mode is 'smart', else the plain permutation"""
+        settings = self.config.get('shuffle', {})
+        if settings.get('mode', 'random') != 'smart':
+            return None
+        artist_gap = settings.get('artist_gap', ARTIST_GAP)
+        album_gap = settings.get('album_gap', ALBUM_GAP)
+        return lambda tracks, seed: smart_shuffle(tracks, seed, artist_gap, album_gap)
+
+    def _build_track_cache(self):
+        """Optional local transcodes of upcoming tracks (stream engine only)"""
+        settings = self.config.get('track_cache', {})
+        if not settings.get('enabled'):
+            return None
+        return TrackCache(settings.get('directory', TRACK_CACHE_DIR),
+                          max_bytes=settings.get('max_mb', 5120) * 1024 ** 2,
+                          fmt=settings.get('format', 'pcm'),
+                          ffmpeg_path=ffmpeg_path(),
+                          gain_of=self._track_gain)
+
+    def _prefetch_upcoming(self):
+        if self.track_cache:
+            self.track_cache.prefetch(
+                self.playlist_source.peek(self.config.get('track_cache', {}).get('ahead', 5)))
+
+    def _warm_caches(self, window, songs):
+        """Probe metadata, then measure loudness, upcoming songs first"""
+        self.prober.probe(songs)
+        if self.loudness:
+            self.loudness.analyze(window)
+            self.loudness.analyze(songs)
+
+    def _warm_caches_in_background(self, window, songs):
+        thread = threading.Thread(target=self._warm_caches, args=(list(window), list(songs)), daemon=True)
+        thread.start()
+        return thread
 
     def _start_obs(self):
         """Launch OBS with better process handling"""
         print("\n=== Starting OBS ===")
-        obs_bin_dir = os.path.dirname(OBS_PATH)
+        obs_bin_dir = os.path.dirname(obs_path())
         print(f"OBS directory: {obs_bin_dir}")
         
         if self.obs_process and self.obs_process.poll() is None:
             print("Terminating existing OBS process...")
             self.obs_process.terminate()
-            time.sleep(2)
+            try:
+                self.obs_process.wait(KILL_WAIT_SECONDS)
+            except subprocess.TimeoutExpired:
+                self.obs_process.kill()
+            self.registry.unregister(self.obs_process.pid)
             
         try:
             self.obs_process = subprocess.Popen(
-                [OBS_PATH, "--startstreaming"],
+                [obs_path(), "--startstreaming"],
                 cwd=obs_bin_dir,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NO_WINDOW
+                creationflags=CREATE_NO_WINDOW
             )
+            self.registry.register('obs', self.obs_process.pid)
             
-            # Give OBS time to start and check if it's running
-            for _ in range(5):  # Try for 10 seconds
-                time.sleep(2)
-                if self.obs_process.poll() is None:
-                    # Check if OBS is actually running
-                    for proc in psutil.process_iter(['name']):
-                        if 'obs64.exe' in proc.info['name'].lower():
-                            print("[OK] OBS started successfully")
-                            return True
+            if self._wait_for_obs():
+                return True
             
             # If we get here, OBS failed to start properly
             stdout, stderr = self.obs_process.communicate()
@@ -434,7 +590,7 @@ class VirtualDJ:
             print("\nTroubleshooting steps:")
             print("1. Try starting OBS manually first")
             print("2. Check if OBS is already running")
-            print("3. Verify OBS installation at:", OBS_PATH)
+            print("3. Verify OBS installation at:", obs_path())
             print("4. Run this script as administrator")
             return False
             
@@ -442,153 +598,312 @@ class VirtualDJ:
             print(f"[X] Error starting OBS: {e}")
             return False
 
-    def _playlist_updater(self):
-        """Removed automatic playlist updates since we now update after all songs are played"""
-        while self.running:
-            time.sleep(60)  # Just keep thread alive with minimal overhead
-
-    def _watchdog(self):
-        """Monitor and restart failed processes with improved retry logic"""
-        consecutive_failures = 0
-        while self.running:
-            if self.ffmpeg_process and self.ffmpeg_process.poll() is not None:
-                print(f"FFmpeg crashed! Attempt {consecutive_failures + 1}")
-                
-                # Get error output
-                stderr = self.ffmpeg_process.stderr.read().decode()
-                if stderr:
-                    print(f"FFmpeg error: {stderr}")
-                
-                # Retry with increasing delay
-                time.sleep(min(consecutive_failures * 2, 30))  # Max 30 second delay
-                if self._start_ffmpeg():
-                    consecutive_failures = 0
-                else:
-                    consecutive_failures += 1
-                    
-                # If too many failures, regenerate playlist
-                if consecutive_failures >= 3:
-                    print("Multiple FFmpeg failures, regenerating playlist...")
-                    self._generate_playlist()
-                    consecutive_failures = 0
-                    
-            if self.obs_process and self.obs_process.poll() is not None:
-                print("OBS crashed! Restarting...")
-                self._start_obs()
-                
-            time.sleep(5)
+    def _wait_for_obs(self):
+        """Readiness probe for a freshly launched OBS instead of fixed sleeps.
+
+        OBS is ready once its WebSocket server accepts connections. With
+        obs_websocket_port set to 0 it is ready once it has stayed up for
+        OBS_MIN_ALIVE seconds. If the port never opens OBS is assumed ready
+        after obs_ready_timeout, as long as it is still running.
+        """
+        settings = self.config.get('startup', {})
+        port = settings.get('obs_websocket_port', OBS_WEBSOCKET_PORT)
+        timeout = settings.get('obs_ready_timeout', OBS_READY_TIMEOUT)
+        process = self.obs_process
+
+        def probe():
+            if process.poll() is not None:
+                return 'exited'
+            if port and port_open('127.0.0.1', port):
+                return 'ready'
+            return None
+
+        state = wait_until(probe, timeout if port else OBS_MIN_ALIVE)
+        if state == 'exited':
+            # The launcher may have handed over to an OBS that was already running;
+            # watch that one instead, or the supervisor would see a dead OBS
+            running = self.registry.scan(['obs64.exe'])
+            if running:
+                self.obs_process = AdoptedProcess(running[0])
+                print(f"[OK] OBS is running (PID: {self.obs_process.pid})")
+                return True
+            return False
+        if state == 'ready':
+            print("[OK] OBS started successfully")
+        elif port:
+            print(f"[OK] OBS started (WebSocket port {port} not open after {timeout}s, carrying on)")
+        else:
+            print("[OK] OBS started successfully")
+        return True
+
+    def _launch_obs(self):
+        """Start OBS, retrying up to 3 times; True once it is up"""
+        for attempt in range(3):
+            if attempt > 0:
+                print(f"\nRetrying OBS startup (attempt {attempt + 1}/3)...")
+                time.sleep(5)
+            if self._start_obs():
+                return True
+        return False
+
+    def _build_status_writer(self):
+        """Text status for OBS plus any extra outputs configured under status_outputs"""
+        settings = self.config.get('status_outputs', {})
+        outputs = [TextStatusOutput(settings.get('text', STATUS_FILE))]
+        if settings.get('json'):
+            outputs.append(JsonStatusOutput(settings['json']))
+        if settings.get('countdown'):
+            outputs.append(CountdownStatusOutput(settings['countdown'],
+                                                 settings.get('countdown_resolution', 15)))
+        return StatusWriter(outputs, min_interval=settings.get('min_interval', 0.5))
+
+    def _build_stream_server(self):
+        """Built-in HTTP/ICY server for the encoded stream, if http_stream is configured"""
+        settings = self.config.get('http_stream')
+        if not settings:
+            return None
+        return StreamServer(self._status, fmt=settings.get('format', 'mp3'),
+                            **{k: settings[k] for k in ('bitrate', 'host', 'port', 'mount', 'metaint',
+                                                        'burst_seconds', 'max_listeners', 'name')
+                               if k in settings})
+
+    def _status(self):
+        """Snapshot of what is playing, shared by the status files and the control API"""
+        song = self.current_song
+        return {
+            'title': song.title,
+            'artist': song.artist,
+            'album': song.album,
+            'path': song.path,
+            'start_time': song.start_time,
+            'duration': song.duration,
+            'songs_played': self.songs_played,
+            'songs_in_playlist': self.songs_in_playlist,
+            'paused': self.paused_at is not None,
+        }
 
     def _update_status_file(self):
-        """Write current status to file"""
-        try:
-            with open("now_playing.txt", "w", encoding='utf-8') as f:
-                f.write(f"{self.current_song.title}\n")
-                f.write(f"{self.current_song.artist} // {self.current_song.album}\n")
-        except Exception as e:
-            print(f"Error writing status: {e}")
+        """Hand the current status to the status writer (writes only when it changed)"""
+        status = self._status()
+        self.status_writer.update(status)
+        if self.control:
+            self.control.publish(status)
+        if self.stream_server:
+            self.stream_server.publish(status)
+
+    def pause(self):
+        if self.engine and self.paused_at is None:
+            self.engine.pause()
+            self.paused_at = time.time()
+            self._update_status_file()
 
-    def monitor_ffmpeg_output(self, process):
-        """Monitor FFmpeg output for song changes"""
-        try:
-            while process.poll() is None and self.running:
-                line = process.stderr.readline().decode().strip()
-                if not line:
-                    continue
-                    
-                # Detect song changes
-                if "Opening '" in line:
-                    file_path = line.split("'")[1]
-                    if file_path.endswith(('.mp3', '.wav', '.flac')):
-                        self.songs_played += 1
-                        if self.current_song.update(file_path):
-                            print(f"\nNow Playing: {self.current_song.get_status()}")
-                            print(f"Progress: {self.songs_played}/{self.songs_in_playlist} songs played")
-                            self._update_status_file()
-                            
-                            # Check if all songs have been played
-                            if self.songs_played >= self.songs_in_playlist:
-                                print("\n=== All songs have been played! Generating new playlist... ===")
-                                self._generate_playlist()
-                                self._start_ffmpeg()
-                
-                # Regular status updates
-                current_time = time.time()
-                if current_time - self.last_status_update >= self.status_update_interval:
-                    if "size=" in line:  # Progress indicator
-                        print(f"\r{self.current_song.get_status()} ({self.songs_played}/{self.songs_in_playlist})", end='', flush=True)
-                        self._update_status_file()
-                        self.last_status_update = current_time
-                    
-        except Exception as e:
-            print(f"Monitor error: {e}")
+    def resume(self):
+        if self.engine and self.paused_at is not None:
+            # Shift the start so the remaining time picks up where it stopped
+            if self.current_song.start_time:
+                self.current_song.start_time += time.time() - self.paused_at
+            self.paused_at = None
+            self.engine.resume()
+            self._update_status_file()
+
+    def _on_song_started(self, file_path, detected_at=None):
+        """Record a track change reported by either audio engine.
+
+        detected_at is the monotonic time the change was read off FFmpeg's
+        stderr; the streaming engine calls in at the track boundary itself.
+        """
+        detected_at = detected_at or time.monotonic()
+        self._record_gap()
+        self.playlist_source.advance(file_path)
+        if self.history:
+            self.history.record(file_path)
+        self.songs_played = self.playlist_source.index
+        self._prefetch_upcoming()
+        if self.startup:
+            print(f"\n{self.startup.summary()}; first song playing")
+            self.startup = None
+        if not self.current_song.update(file_path):
+            return False
+        print(f"\nNow Playing: {self.current_song.get_status()}")
+        print(f"Progress: {self.songs_played}/{self.songs_in_playlist} songs played")
+        self._update_status_file()
+        SONGS_STARTED.inc()
+        SONG_CHANGE_LATENCY.observe(time.monotonic() - detected_at)
+        return True
+
+    def _record_gap(self):
+        """How long after its expected end the outgoing song was replaced"""
+        song = self.current_song
+        if not song.start_time or not song.duration or self.paused_at is not None:
+            return
+        gap = time.time() - (song.start_time + song.duration)
+        if gap < -EARLY_CHANGE_SECONDS:
+            EARLY_CHANGES.inc()
+        else:
+            TRACK_GAP.observe(max(0.0, gap))
+
+    def _on_progress(self):
+        """Rate-limited status line and status file refresh"""
+        current_time = time.time()
+        if current_time - self.last_status_update >= self.status_update_interval:
+            print(f"\r{self.current_song.get_status()} ({self.songs_played}/{self.songs_in_playlist})", end='', flush=True)
             self._update_status_file()
+            self.last_status_update = current_time
+
+    def _next_track(self):
+        """Feed the streaming engine from the shuffle, rescanning the library between cycles"""
+        if self.playlist_source.cursor >= len(self.playlist_source):
+            print("\n=== All songs have been played! Refreshing library... ===")
+            self._generate_playlist()
+        return self.playlist_source.next()
+
+    def _cached_duration(self, file_path):
+        """Track duration from the metadata cache, 0 when not probed yet"""
+        entry = self.metadata.lookup(file_path)
+        return entry['duration'] if entry else 0
+
+    def _track_gain(self, file_path):
+        """Normalization gain from the cached loudness measurement, 0 when not measured"""
+        entry = self.metadata.lookup(file_path)
+        if not self.loudness or not entry:
+            return 0.0
+        settings = self.config.get('loudness', {})
+        return track_gain(entry.get('loudness'), entry.get('true_peak'),
+                          target=settings.get('target', TARGET_LOUDNESS),
+                          max_gain=settings.get('max_gain', MAX_GAIN))
+
+    def _build_sink(self):
+        """ffplay into the virtual cable (or a real-time clock when serving listeners
+        directly), fanned out to any extra outputs and the stream encoder from one decode"""
+        if self.audio_only:
+            sinks, names = [ClockSink()], ['clock']
+        else:
+            sinks, names = [FFplaySink(ffmpeg_tool('ffplay'), registry=self.registry)], ['ffplay']
+        settings = self.config.get('outputs', {})
+        for spec in settings.get('sinks', []):
+            sinks.append(sink_from_config(spec, self.registry))
+            names.append(spec.get('name', spec['type']))
+        if self.stream_server:
+            sinks.append(EncoderSink(self.stream_server, ffmpeg_path(), registry=self.registry))
+            names.append('http_stream')
+        if len(sinks) == 1:
+            return sinks[0]
+        return FanOutSink(sinks, queue_ms=settings.get('queue_ms', QUEUE_MS),
+                          on_overflow=settings.get('on_overflow', 'resync'), names=names)
+
+    def _start_engine(self):
+        """Start the in-process streaming engine with a persistent ffplay output"""
+        if self.engine:
+            self.engine.stop()
+        transition = self.config.get('transition', {})
+        buffer = self.config.get('buffer', {})
+        self.engine = StreamingEngine(
+            self._next_track,
+            self._build_sink(),
+            ffmpeg_path=ffmpeg_path(),
+            on_track_start=self._on_song_started,
+            on_progress=self._on_progress,
+            duration_of=self._cached_duration,
+            gain_of=self._track_gain,
+            transition=transition.get('mode', 'gapless'),
+            crossfade_seconds=transition.get('crossfade_seconds', 4),
+            lookahead_seconds=transition.get('lookahead_seconds', 10),
+            buffer_ms=buffer.get('size_ms', 2000),
+            start_ms=buffer.get('start_ms', 500),
+            cache=self.track_cache
+        )
+        self.engine.start()
+        return True
+
+    def _start_obs_in_background(self):
+        """Launch OBS on its own thread; self.obs_startup resolves to whether it came up"""
+        self.obs_startup = Future()
+
+        def launch():
+            try:
+                self.obs_startup.set_result(self.startup.run("OBS", self._launch_obs))
+            except Exception as e:
+                self.obs_startup.set_exception(e)
+
+        threading.Thread(target=launch, daemon=True).start()
+
+    def _abort_startup(self, message):
+        print(message)
+        if self.obs_process and self.obs_process.poll() is None:
+            self.obs_process.terminate()
+        sys.exit(1)
 
     def run(self):
-        """Ensure clean startup"""
-        if not check_dependencies():
-            sys.exit(1)
-            
-        print("\n=== Checking for existing processes ===")
-        kill_existing_processes()
-            
-        if not check_audio_files():
-            sys.exit(1)
+        """Staged startup: independent checks run side by side and audio starts
+        as soon as the first songs are queued, while OBS is still coming up.
+        Every phase is timed."""
+        self.startup = StartupTimer()
+        self.config.watch()
+        pipe_mode = self.config.get('audio_engine', 'pipe') != 'stream'
+        settings = self.config.get('startup', {})
+        device_cache = DeviceCache(max_age_hours=settings.get('device_cache_hours', DEVICE_CACHE_HOURS))
 
         print("\n=== Starting Virtual DJ ===")
-        print("1. Starting OBS...")
-        
-        # Try starting OBS up to 3 times
-        for attempt in range(3):
-            if attempt > 0:
-                print(f"\nRetrying OBS startup (attempt {attempt + 1}/3)...")
-                time.sleep(5)
-                
-            if self._start_obs():
-                print("2. Waiting for OBS to initialize...")
-                time.sleep(15)
-                break
+        if self.audio_only:
+            print("1. Checking leftover processes and library (serving listeners directly, no OBS)...")
         else:
-            print("[X] Failed to start OBS after 3 attempts")
-            sys.exit(1)
-        
+            print("1. Checking audio device, leftover processes and library...")
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            device = None if self.audio_only else \
+                pool.submit(self.startup.run, "audio device", detect_audio_device,
+                            device_cache, list_variants=pipe_mode)
+            cleanup = pool.submit(self.startup.run, "process cleanup", kill_existing_processes,
+                                  self.registry, by_name=self.config.get('processes', {}).get('kill_by_name', False))
+            library = pool.submit(self.startup.run, "library scan", self._refresh_library)
+
+            # OBS only has to wait for the cleanup, which would otherwise kill it again
+            cleanup.result()
+            if not self.audio_only:
+                print("2. Starting OBS...")
+                self._start_obs_in_background()
+
+            try:
+                refreshed = library.result()
+            except Exception:
+                report_missing_audio(self.config['audio_sources'])
+                self._abort_startup("Failed to scan the library")
+            if device and not device.result():
+                self._abort_startup("Audio device not found")
+
         print("3. Generating playlist...")
-        if not self._generate_playlist():
-            print("Failed to generate playlist")
-            sys.exit(1)
+        with self.startup.phase("playlist"):
+            if not self._generate_playlist(refreshed):
+                self._abort_startup("Failed to generate playlist")
+        self._start_watcher()
         
-        print("4. Starting FFmpeg stream...")
-        ffmpeg_process, ffplay_process = start_stream(PLAYLIST_FILE)
-        if not ffmpeg_process or not ffplay_process:
-            print("Failed to start FFmpeg")
-            sys.exit(1)
-        
-        self.ffmpeg_process = ffplay_process  # Store ffplay process for watchdog
-        print("\n[OK] All systems running!")
-        
-        # Start monitoring threads
-        Thread(target=self._playlist_updater, daemon=True).start()
-        Thread(target=self._watchdog, daemon=True).start()
-        Thread(target=lambda: self.monitor_ffmpeg_output(ffmpeg_process), daemon=True).start()
+        if pipe_mode:
+            print("4. Starting FFmpeg stream...")
+        else:
+            print("4. Starting streaming engine...")
 
         # Write initial status
         self._update_status_file()
 
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            print("\nShutting down...")
-            self.running = False
-            if ffmpeg_process:
-                ffmpeg_process.terminate()
-            if ffplay_process:
-                ffplay_process.terminate()
-            print("Stream stopped.")
+        # Processes, stderr and signals are all awaited on one event loop from here on
+        supervisor = DJSupervisor(self, lambda: stream_commands(PLAYLIST_FILE))
+        asyncio.run(supervisor.run())
+        self.prober.stop()
+        if self.loudness:
+            self.loudness.stop()
+        self.metadata.stop()
+        if supervisor.failed:
+            sys.exit(1)
 
 if __name__ == "__main__":
     if not os.path.exists("Playlist.m3u"):
         print("Error: Playlist.m3u not found")
         sys.exit(1)
 
-    dj = VirtualDJ()
-    dj.run()
\ No newline at end of file
+    try:
+        dj = VirtualDJ()
+    except ConfigError as e:
+        print("Error: config.json is not usable:")
+        for problem in e.problems:
+            print(f"- {problem}")
+        sys.exit(1)
+    dj.run()